@@ -1,9 +1,17 @@
 #include <pybind11/pybind11.h>
 #include <pybind11/stl.h>
+#include <pybind11/numpy.h>
 #include <Python.h>  // PyLong_AsUnsignedLongLongMask, etc.
 
+#include <algorithm>
+#include <cstring>
+
+#include "f2_matrix.hpp"
 #include "linear_hash.hpp"
+#include "multi_hash.hpp"
 #include "parallel_trials.hpp"
+#include "simd_kernels.hpp"
+#include "structured_sets.hpp"
 
 namespace py = pybind11;
 
@@ -24,12 +32,16 @@ static std::vector<uint64_t> pylong_to_u64_blocks(py::handle x, int u) {
     buf.resize(nbytes, '\0');
 
     // signed=0, little_endian=1
+    // (Python 3.13 added a trailing with_exceptions argument)
     if (_PyLong_AsByteArray((PyLongObject*)obj,
                             (unsigned char*)buf.data(),
                             nbytes,
                             /*little_endian=*/1,
-                            /*is_signed=*/0,
-                            0) < 0) {
+                            /*is_signed=*/0
+#if PY_VERSION_HEX >= 0x030D0000
+                            , 0
+#endif
+                            ) < 0) {
         throw py::error_already_set();
     }
 
@@ -42,11 +54,11 @@ static std::vector<uint64_t> pylong_to_u64_blocks(py::handle x, int u) {
     return blocks;
 }
 
-static py::int_ u64_blocks_to_pylong(const std::vector<uint64_t>& blocks) {
+static py::int_ u64_ptr_to_pylong(const uint64_t* blocks, size_t n) {
     // Convert little-endian 64-bit blocks to Python int via bytes
     std::string buf;
-    buf.resize(blocks.size() * 8, '\0');
-    for (size_t i = 0; i < blocks.size(); i++) {
+    buf.resize(n * 8, '\0');
+    for (size_t i = 0; i < n; i++) {
         std::memcpy(buf.data() + i * 8, &blocks[i], 8);
     }
     PyObject* out = _PyLong_FromByteArray((const unsigned char*)buf.data(),
@@ -57,11 +69,185 @@ static py::int_ u64_blocks_to_pylong(const std::vector<uint64_t>& blocks) {
     return py::reinterpret_steal<py::int_>(out);
 }
 
+static py::int_ u64_blocks_to_pylong(const std::vector<uint64_t>& blocks) {
+    return u64_ptr_to_pylong(blocks.data(), blocks.size());
+}
+
+static HashMode parse_hash_mode(const std::string& mode) {
+    if (mode == "auto") return HashMode::Auto;
+    if (mode == "popcount") return HashMode::Popcount;
+    if (mode == "table") return HashMode::Table;
+    throw py::value_error("mode must be 'auto', 'popcount' or 'table', got '" + mode + "'");
+}
+
+static CounterMode parse_counter_mode(const std::string& counter) {
+    if (counter == "auto") return CounterMode::Auto;
+    if (counter == "dense") return CounterMode::Dense;
+    if (counter == "space_saving") return CounterMode::SpaceSaving;
+    if (counter == "sort") return CounterMode::Sort;
+    if (counter == "partitioned") return CounterMode::Partitioned;
+    throw py::value_error("counter must be 'auto', 'dense', 'sort', 'partitioned' or 'space_saving', got '" +
+                          counter + "'");
+}
+
+// dist and its parameters (the keyword arguments of src/hashing/sampling.py),
+// checked for a u-bit key
+static DistSpec parse_dist_spec(const std::string& dist, const py::dict& params, int u) {
+    DistSpec spec{dist};
+    for (auto item : params) {
+        const std::string key = py::cast<std::string>(item.first);
+        if (key == "p") spec.p = py::cast<double>(item.second);
+        else if (key == "k") spec.k = py::cast<int>(item.second);
+        else if (key == "p0") spec.p0 = py::cast<double>(item.second);
+        else if (key == "p1") spec.p1 = py::cast<double>(item.second);
+        else throw py::value_error("unknown dist parameter '" + key + "' (expected p, k, p0 or p1)");
+    }
+    try {
+        BlockSampler(spec, u);
+    } catch (const std::invalid_argument& e) {
+        throw py::value_error(e.what());
+    }
+    return spec;
+}
+
+static MatrixGen parse_matrix_gen(const std::string& gen) {
+    if (gen == "sequential") return MatrixGen::Sequential;
+    if (gen == "counter") return MatrixGen::Counter;
+    throw py::value_error("gen must be 'sequential' or 'counter', got '" + gen + "'");
+}
+
+static LinearHash linear_hash_from_buffer(const py::buffer& data) {
+    py::buffer_info info = data.request();
+    if (info.ndim != 1 || info.strides[0] != info.itemsize)
+        throw py::value_error("data must be a contiguous bytes-like object");
+    try {
+        return LinearHash::from_bytes(info.ptr, size_t(info.size) * size_t(info.itemsize));
+    } catch (const std::invalid_argument& e) {
+        throw py::value_error(e.what());
+    }
+}
+
+using U64Array = py::array_t<uint64_t, py::array::c_style | py::array::forcecast>;
+
+// hash_many_blocks: xs is (N, ceil(u/64)) uint64, or a flat buffer of N*ceil(u/64) words.
+// Output is (N,) uint32 for l<=32, (N,) uint64 for l<=64, else (N, ceil(l/64)) uint64.
+// No Python int is created; the GIL is released while hashing.
+static py::array hash_many_blocks(const LinearHash& self, const U64Array& xs, py::object out) {
+    const int B = self.get_num_in_blocks();
+    const int OB = self.get_num_out_blocks();
+    const int l = self.get_l();
+
+    if (xs.ndim() == 2) {
+        if (xs.shape(1) != B)
+            throw py::value_error("xs must have shape (N, " + std::to_string(B) + ")");
+    } else if (xs.ndim() != 1 || xs.size() % B != 0) {
+        throw py::value_error("xs must be (N, " + std::to_string(B) + ") or a flat buffer of N*" +
+                              std::to_string(B) + " uint64 words");
+    }
+    const size_t n = size_t(xs.size()) / B;
+
+    const bool narrow = l <= 32;
+    std::vector<py::ssize_t> shape = (OB == 1) ? std::vector<py::ssize_t>{py::ssize_t(n)}
+                                               : std::vector<py::ssize_t>{py::ssize_t(n), OB};
+    py::dtype dt = narrow ? py::dtype::of<uint32_t>() : py::dtype::of<uint64_t>();
+
+    py::array res;
+    if (out.is_none()) {
+        res = py::array(dt, shape);
+    } else {
+        const bool dtype_ok = narrow ? py::isinstance<py::array_t<uint32_t>>(out)
+                                     : py::isinstance<py::array_t<uint64_t>>(out);
+        if (!dtype_ok)
+            throw py::value_error(std::string("out must be a ") + (narrow ? "uint32" : "uint64") + " numpy array");
+        res = py::reinterpret_borrow<py::array>(out);
+        if (!(res.flags() & py::array::c_style) || !res.writeable())
+            throw py::value_error("out must be C-contiguous and writeable");
+        if (size_t(res.ndim()) != shape.size() ||
+            !std::equal(shape.begin(), shape.end(), res.shape()))
+            throw py::value_error("out has the wrong shape");
+    }
+
+    const uint64_t* x = xs.data();
+    void* y = res.mutable_data();
+    {
+        py::gil_scoped_release release;
+        if (!narrow) {
+            self.hash_batch(x, n, static_cast<uint64_t*>(y));
+        } else {
+            // hash in chunks into a scratch buffer, then narrow to uint32
+            constexpr size_t kChunk = 4096;
+            std::vector<uint64_t> tmp(std::min(n, kChunk));
+            uint32_t* y32 = static_cast<uint32_t*>(y);
+            for (size_t i = 0; i < n; i += kChunk) {
+                const size_t len = std::min(kChunk, n - i);
+                self.hash_batch(x + i * B, len, tmp.data());
+                for (size_t t = 0; t < len; ++t) y32[i + t] = uint32_t(tmp[t]);
+            }
+        }
+    }
+    return res;
+}
+
 PYBIND11_MODULE(fasthash, m) {
     m.doc() = "High-performance linear hash over F2";
 
+    // pick the SIMD kernel (CPUID) at import time
+    active_simd_level();
+
+    m.def("cpu_features",
+          []() {
+              const CpuFeatures& f = cpu_features();
+              py::dict d;
+              d["popcnt"] = f.popcnt;
+              d["avx2"] = f.avx2;
+              d["avx512f"] = f.avx512f;
+              d["avx512vpopcntdq"] = f.avx512vpopcntdq;
+              d["kernel"] = simd_level_name(active_simd_level());
+              return d;
+          },
+          "CPU features detected at import and the active row loop kernel");
+
+    m.def("set_simd_kernel",
+          [](const std::string& name) {
+              try {
+                  set_simd_level(parse_simd_level(name.c_str()));
+              } catch (const std::invalid_argument& e) {
+                  throw py::value_error(e.what());
+              }
+          },
+          py::arg("name"),
+          "Select the row loop kernel ('scalar', 'avx2', 'avx512') for LinearHash objects created afterwards");
+
     py::class_<LinearHash>(m, "LinearHash")
-        .def(py::init<int, int, uint64_t>(), py::arg("l"), py::arg("u"), py::arg("seed"))
+        .def(py::init([](int l, int u, uint64_t seed, const std::string& mode, const std::string& gen) {
+                 return LinearHash(l, u, seed, parse_hash_mode(mode), parse_matrix_gen(gen));
+             }),
+             py::arg("l"), py::arg("u"), py::arg("seed"), py::arg("mode") = "auto",
+             py::arg("gen") = "sequential",
+             "mode: 'popcount' (row parities), 'table' (precomputed byte tables) or 'auto'\n"
+             "gen: 'sequential' (mt19937_64 stream) or 'counter' (block (i, b) = f(seed, i, b))")
+        .def_property_readonly("seed", &LinearHash::get_seed)
+        .def_property_readonly("gen",
+             [](const LinearHash& self) {
+                 return self.get_gen() == MatrixGen::Counter ? "counter" : "sequential";
+             })
+
+        // serialization: header + raw rows, M is not regenerated on load
+        .def("to_bytes",
+             [](const LinearHash& self) { return py::bytes(self.to_bytes()); },
+             "Compact binary form (header + packed rows of M)")
+        .def_static("from_bytes", &linear_hash_from_buffer, py::arg("data"),
+             "Rebuild from to_bytes() output (any contiguous buffer, e.g. a shared memory block)")
+        .def(py::pickle(
+             [](const LinearHash& self) { return py::bytes(self.to_bytes()); },
+             [](const py::bytes& state) { return linear_hash_from_buffer(state); }))
+        .def_property_readonly("mode",
+             [](const LinearHash& self) {
+                 return self.get_mode() == HashMode::Table ? "table" : "popcount";
+             })
+        .def_property_readonly("table_bits", &LinearHash::get_table_bits)
+        .def_property_readonly("simd_kernel", &LinearHash::get_simd_kernel,
+             "Row loop kernel chosen at construction: 'scalar', 'avx2' or 'avx512'")
 
         // old API
         .def("hash", &LinearHash::hash, py::arg("x_blocks"),
@@ -77,37 +263,338 @@ PYBIND11_MODULE(fasthash, m) {
              py::arg("x"),
              "Compute h(x) given x as a Python int, return Python int")
 
+        // sparse API: x given by the indices of its set bits
+        .def("hash_sparse",
+             [](LinearHash& self, const std::vector<int64_t>& idx) -> py::int_ {
+                 std::vector<uint32_t> pos;
+                 pos.reserve(idx.size());
+                 for (int64_t i : idx) {
+                     if (i < 0 || i >= self.get_u())
+                         throw py::value_error("bit index " + std::to_string(i) + " out of range [0, u)");
+                     pos.push_back(uint32_t(i));
+                 }
+                 return u64_blocks_to_pylong(self.hash_sparse(pos));
+             },
+             py::arg("indices"),
+             "Compute h(x) for x given by the indices of its set bits (XOR of columns of M)")
+
         // batch int API (ONE boundary crossing)
         .def("hash_many_int",
              [](LinearHash& self, py::sequence xs) -> py::list {
-                 py::list out;
-                 // 逐个元素处理，但只跨边界一次；核心收益在这里
+                 // 只跨边界一次：先把所有 x 打包成连续的 blocks，再用 batch kernel 一次算完
+                 const size_t n = size_t(py::len(xs));
+                 const int B = self.get_num_in_blocks();
+                 const int OB = self.get_num_out_blocks();
+                 std::vector<uint64_t> x_flat(n * B);
+                 std::vector<uint64_t> y_flat(n * OB);
+                 size_t t = 0;
                  for (py::handle item : xs) {
-                     py::int_ x = py::reinterpret_borrow<py::int_>(item);
-                     auto blocks = pylong_to_u64_blocks(x, self.get_u());
-                     auto y_blocks = self.hash(blocks);
-                     out.append(u64_blocks_to_pylong(y_blocks));
+                     auto blocks = pylong_to_u64_blocks(item, self.get_u());
+                     std::copy(blocks.begin(), blocks.end(), x_flat.begin() + t * B);
+                     ++t;
+                 }
+                 self.hash_batch(x_flat.data(), n, y_flat.data());
+
+                 py::list out(n);
+                 for (size_t i = 0; i < n; ++i) {
+                     out[i] = u64_ptr_to_pylong(y_flat.data() + i * OB, size_t(OB));
                  }
                  return out;
              },
              py::arg("xs"),
-             "Batch compute: xs(list[int]) -> list[int]");
+             "Batch compute: xs(list[int]) -> list[int]")
+
+        // batch array API (zero copy for C-contiguous uint64 input)
+        .def("hash_many_blocks", &hash_many_blocks,
+             py::arg("xs"), py::arg("out") = py::none(),
+             "Batch compute on a (N, ceil(u/64)) uint64 array (or any buffer of N*ceil(u/64) words).\n"
+             "Returns (N,) uint32 if l<=32, (N,) uint64 if l<=64, else (N, ceil(l/64)) uint64.\n"
+             "out: optional preallocated array of that dtype and shape to write into.");
     
+    // structured key sets, enumerated in Gray-code order (no S buffer)
+    m.def("maxload_subspace",
+          [](const LinearHash& h, py::int_ x0, const std::vector<py::int_>& basis, int k) {
+              auto x0_blocks = pylong_to_u64_blocks(x0, h.get_u());
+              std::vector<std::vector<uint64_t>> basis_blocks;
+              basis_blocks.reserve(basis.size());
+              for (const auto& b : basis) basis_blocks.push_back(pylong_to_u64_blocks(b, h.get_u()));
+              py::gil_scoped_release release;
+              return maxload_affine_subspace(h, x0_blocks, basis_blocks, k);
+          },
+          py::arg("h"), py::arg("x0"), py::arg("basis"), py::arg("k") = 50000,
+          "Space-Saving max-load of h over x0 + span(basis) (2^len(basis) keys)");
+
+    m.def("maxload_subcube",
+          [](const LinearHash& h, py::int_ x0, const std::vector<int64_t>& free_bits, int k) {
+              auto x0_blocks = pylong_to_u64_blocks(x0, h.get_u());
+              std::vector<uint32_t> bits;
+              bits.reserve(free_bits.size());
+              for (int64_t b : free_bits) {
+                  if (b < 0 || b >= h.get_u())
+                      throw py::value_error("bit index " + std::to_string(b) + " out of range [0, u)");
+                  bits.push_back(uint32_t(b));
+              }
+              py::gil_scoped_release release;
+              return maxload_subcube(h, x0_blocks, bits, k);
+          },
+          py::arg("h"), py::arg("x0"), py::arg("free_bits"), py::arg("k") = 50000,
+          "Space-Saving max-load of h over the subcube of x0 with the given free coordinates");
+
+    m.def("maxload_hamming_ball",
+          [](const LinearHash& h, py::int_ center, int radius, int k) {
+              auto c_blocks = pylong_to_u64_blocks(center, h.get_u());
+              py::gil_scoped_release release;
+              return maxload_hamming_ball(h, c_blocks, radius, k);
+          },
+          py::arg("h"), py::arg("center"), py::arg("radius"), py::arg("k") = 50000,
+          "Space-Saving max-load of h over the Hamming ball of the given radius around center");
+
+    // exact max-load over subspaces by F2 linear algebra (no enumeration)
+    py::class_<BitMatrix>(m, "BitMatrix")
+        .def(py::init([](const std::vector<py::int_>& rows, int ncols) {
+                 if (ncols < 0) throw py::value_error("ncols must be >= 0");
+                 std::vector<std::vector<uint64_t>> blocks;
+                 blocks.reserve(rows.size());
+                 for (const auto& r : rows) blocks.push_back(pylong_to_u64_blocks(r, ncols));
+                 return BitMatrix::from_rows(blocks, ncols);
+             }),
+             py::arg("rows"), py::arg("ncols"),
+             "Matrix over F2; row i is the int rows[i] (bit j = column j), truncated to ncols bits")
+        .def_property_readonly("nrows", &BitMatrix::nrows)
+        .def_property_readonly("ncols", &BitMatrix::ncols)
+        .def("row", [](const BitMatrix& self, int i) {
+                 if (i < 0 || i >= self.nrows()) throw py::index_error("row index out of range");
+                 return u64_ptr_to_pylong(self.row(i), size_t(self.words_per_row()));
+             }, py::arg("i"))
+        .def("rank", &BitMatrix::rank, "Rank over F2 (M4RI-style elimination)");
+
+    m.def("maxload_subspace_exact",
+          [](const LinearHash& h, const std::vector<py::int_>& basis) {
+              std::vector<std::vector<uint64_t>> basis_blocks;
+              basis_blocks.reserve(basis.size());
+              for (const auto& b : basis) basis_blocks.push_back(pylong_to_u64_blocks(b, h.get_u()));
+              int e;
+              {
+                  py::gil_scoped_release release;
+                  e = maxload_affine_subspace_exact_log2(h, basis_blocks);
+              }
+              return py::int_(1).attr("__lshift__")(e);
+          },
+          py::arg("h"), py::arg("basis"),
+          "Exact max-load of h over x0 + span(basis) as a set, for any x0:\n"
+          "2^(rank(basis) - rank(M basis)), computed without enumerating the subspace");
+
+    m.def("maxload_subspace_exact_trials",
+          [](int u, int l, const std::vector<py::int_>& basis,
+             const std::vector<uint64_t>& seeds_h, int num_threads) {
+              std::vector<std::vector<uint64_t>> basis_blocks;
+              basis_blocks.reserve(basis.size());
+              for (const auto& b : basis) basis_blocks.push_back(pylong_to_u64_blocks(b, u));
+              std::vector<int> es;
+              {
+                  py::gil_scoped_release release;
+                  es = maxload_affine_subspace_exact_log2_trials(u, l, basis_blocks, seeds_h, num_threads);
+              }
+              py::list out;
+              for (int e : es) out.append(py::int_(1).attr("__lshift__")(e));
+              return out;
+          },
+          py::arg("u"), py::arg("l"), py::arg("basis"), py::arg("seeds_h"), py::arg("num_threads") = 0,
+          "maxload_subspace_exact for LinearHash(l, u, seed) and every seed in seeds_h, in parallel");
+
+    m.def("maxload_fixed_S_multi",
+          [](const U64Array& S, int u, int l, const std::vector<uint64_t>& seeds_h,
+             int k, int num_threads, const std::string& counter, uint64_t mem_budget,
+             const std::string& tmp_dir, bool details) {
+              if (u <= 0 || l <= 0) throw py::value_error("l and u must be positive");
+              const int B = (u + 63) / 64;
+              if (S.ndim() == 2) {
+                  if (S.shape(1) != B)
+                      throw py::value_error("S must have shape (N, " + std::to_string(B) + ")");
+              } else if (S.ndim() != 1 || S.size() % B != 0) {
+                  throw py::value_error("S must be (N, " + std::to_string(B) + ") or a flat buffer of N*" +
+                                        std::to_string(B) + " uint64 words");
+              }
+              const CounterMode mode = parse_counter_mode(counter);
+              if (mem_budget == 0) mem_budget = default_mem_budget();
+              const size_t n = size_t(S.size()) / B;
+              const uint64_t* data = S.data();
+              std::vector<TrialResult> res;
+              {
+                  py::gil_scoped_release release;
+                  res = maxload_fixed_S_multi(data, n, u, l, seeds_h, k, num_threads, mode, mem_budget, tmp_dir);
+              }
+              py::list out;
+              for (const TrialResult& r : res) {
+                  if (!details) {
+                      out.append(r.max_load);
+                      continue;
+                  }
+                  py::dict d;
+                  d["max_load"] = r.max_load;
+                  d["max_lb"] = r.max_lb;
+                  d["max_err"] = r.max_err;
+                  d["max_exact"] = r.exact;
+                  out.append(d);
+              }
+              return out;
+          },
+          py::arg("S"), py::arg("u"), py::arg("l"), py::arg("seeds_h"),
+          py::arg("k") = 50000, py::arg("num_threads") = 0,
+          py::arg("counter") = "auto", py::arg("mem_budget") = 0, py::arg("tmp_dir") = "",
+          py::arg("details") = false,
+          "Max-load of LinearHash(l, u, seed) over the fixed set S for every seed, in one pass over S\n"
+          "(the matrices are stacked). S is (N, ceil(u/64)) uint64.\n"
+          "counter: auto (dense if l <= 32 and it fits in mem_budget / num_threads, else sort), dense,\n"
+          "sort (both exact) or space_saving (k counters, max_load is an upper bound). mem_budget = 0:\n"
+          "half the RAM.\n"
+          "details: a dict per seed instead of the max-load: max_load, max_lb, max_err, max_exact (the\n"
+          "max-load lies in [max_lb, max_load]).");
+
     m.def("run_trials_maxload",
           [](int u, int l, int64_t m_count,
              const std::string& dist,
              const std::vector<uint64_t>& seeds_S,
              const std::vector<uint64_t>& seeds_h,
              int k,
-             int num_threads) {
-              // 释放 GIL：C++ 多线程计算期间不占用 Python GIL
-              py::gil_scoped_release release;
-              return run_trials_parallel(u, l, m_count, dist, seeds_S, seeds_h, k, num_threads);
+             int num_threads,
+             const std::string& counter,
+             uint64_t mem_budget,
+             const std::string& tmp_dir,
+             int threads_per_trial,
+             std::vector<int> thresholds,
+             bool details,
+             bool stats,
+             int top_n,
+             const py::dict& dist_params,
+             bool legacy_rng,
+             bool distinct) -> py::object {
+              const CounterMode mode = parse_counter_mode(counter);
+              const DistSpec spec = parse_dist_spec(dist, dist_params, u);
+              if (mode == CounterMode::Dense && l > 32)
+                  throw py::value_error("counter='dense' needs l <= 32");
+              if (mode == CounterMode::Partitioned && l > 64)
+                  throw py::value_error("counter='partitioned' needs l <= 64");
+              if (threads_per_trial < 1) throw py::value_error("threads_per_trial must be >= 1");
+              if (top_n < 0) throw py::value_error("top_n must be >= 0");
+              std::sort(thresholds.begin(), thresholds.end());
+              thresholds.erase(std::unique(thresholds.begin(), thresholds.end()), thresholds.end());
+
+              std::vector<TrialResult> res;
+              {
+                  // 释放 GIL：C++ 多线程计算期间不占用 Python GIL
+                  py::gil_scoped_release release;
+                  res = run_trials_parallel(u, l, m_count, spec, seeds_S, seeds_h, k, num_threads,
+                                            mode, mem_budget, tmp_dir, threads_per_trial, thresholds,
+                                            stats ? top_n : -1, legacy_rng, distinct);
+              }
+              py::list out;
+              for (const TrialResult& r : res) {
+                  if (!details && !stats) {
+                      out.append(r.max_load);
+                      continue;
+                  }
+                  py::dict d;
+                  d["max_load"] = r.max_load;
+                  d["keys"] = r.keys;
+                  d["stopped"] = r.stopped;
+                  d["reached"] = r.reached;
+                  d["max_lb"] = r.max_lb;
+                  d["max_err"] = r.max_err;
+                  d["max_exact"] = r.exact;
+                  d["draws"] = r.draws;
+                  if (distinct) {
+                      d["duplicates"] = r.duplicates;
+                      d["dedup_seconds"] = r.dedup_seconds;
+                  }
+                  if (r.stats) {
+                      const LoadStats& st = *r.stats;
+                      d["exact"] = st.exact;
+                      d["hist"] = py::array_t<uint64_t>(py::ssize_t(st.hist.size()), st.hist.data());
+                      d["top"] = py::array_t<uint32_t>(py::ssize_t(st.top.size()), st.top.data());
+                      d["top_err"] = py::array_t<uint32_t>(py::ssize_t(st.top_err.size()), st.top_err.data());
+                      d["sum_sq"] = py::make_tuple(st.sum_sq_lb, st.sum_sq_ub);
+                      d["max_load_bounds"] = py::make_tuple(st.max_lb, st.max_ub);
+                  }
+                  out.append(d);
+              }
+              return std::move(out);
           },
           py::arg("u"), py::arg("l"), py::arg("m"),
           py::arg("dist"),
           py::arg("seeds_S"), py::arg("seeds_h"),
           py::arg("k") = 50000,
-          py::arg("num_threads") = 0
+          py::arg("num_threads") = 0,
+          py::arg("counter") = "auto",
+          py::arg("mem_budget") = 0,
+          py::arg("tmp_dir") = "",
+          py::arg("threads_per_trial") = 1,
+          py::arg("thresholds") = std::vector<int>{},
+          py::arg("details") = false,
+          py::arg("stats") = false,
+          py::arg("top_n") = 16,
+          py::arg("dist_params") = py::dict(),
+          py::arg("legacy_rng") = false,
+          py::arg("distinct") = false,
+          "Max-load of one trial per (seed_S, seed_h): S (m keys of dist, dist_params as in\n"
+          "src/hashing/sampling.py) streamed through LinearHash(l, u, seed_h) and counted with counter\n"
+          "('auto', 'dense', 'sort', 'partitioned' or 'space_saving' with k counters) within mem_budget\n"
+          "(0 = half the RAM). details / stats return a dict per trial (bounds, keys counted, load\n"
+          "histogram); thresholds stop a trial once every max_load >= T is decided. All the options are\n"
+          "described in the README (Essais en C++)."
     );
+
+    m.def("sample_blocks",
+          [](int u, int64_t n, const std::string& dist, uint64_t seed, const py::dict& dist_params,
+             bool legacy_rng, bool distinct) {
+              if (u <= 0 || n < 0) throw py::value_error("u must be positive and n >= 0");
+              TrialConfig cfg;
+              cfg.u = u;
+              cfg.l = 1;
+              cfg.m = n;
+              cfg.seed_S = seed;
+              cfg.seed_h = 0;
+              cfg.k = 1;
+              cfg.dist = parse_dist_spec(dist, dist_params, u);
+              cfg.legacy_rng = legacy_rng;
+              cfg.distinct = distinct;
+              py::array_t<uint64_t> out(std::vector<py::ssize_t>{py::ssize_t(n), (u + 63) / 64});
+              uint64_t* data = out.mutable_data();
+              {
+                  py::gil_scoped_release release;
+                  sample_trial_keys(cfg, n, data);
+              }
+              return out;
+          },
+          py::arg("u"), py::arg("n"), py::arg("dist"), py::arg("seed"), py::arg("dist_params") = py::dict(),
+          py::arg("legacy_rng") = false, py::arg("distinct") = false,
+          "The first n keys of the S of run_trials_maxload's trial with seed_S = seed (dist, dist_params,\n"
+          "legacy_rng, distinct as there; with legacy_rng, that of a single-threaded trial), as (n, ceil(u/64))\n"
+          "uint64.");
+
+    m.def("derive_seed",
+          [](uint64_t root, uint64_t i) { return derive_seed(root, i); },
+          py::arg("root"), py::arg("i"),
+          "Seed of child i of root: splitmix64(splitmix64(root) ^ i), as src.hashing.linear_f2.derive_seed.");
+
+    m.def("trial_counter",
+          [](int l, int64_t m_count, const std::string& counter, uint64_t mem_budget) {
+              TrialConfig cfg;
+              cfg.u = 1;
+              cfg.l = l;
+              cfg.m = m_count;
+              cfg.seed_S = 0;
+              cfg.seed_h = 0;
+              cfg.k = 1;
+              cfg.dist.name = "uniform";
+              cfg.counter = parse_counter_mode(counter);
+              cfg.mem_budget = mem_budget == 0 ? default_mem_budget() : mem_budget;
+              try {
+                  return std::string(trial_counter_name(cfg));
+              } catch (const std::invalid_argument& e) {
+                  throw py::value_error(e.what());
+              }
+          },
+          py::arg("l"), py::arg("m"), py::arg("counter") = "auto", py::arg("mem_budget") = 0,
+          "Counter a single trial would use: 'dense8', 'dense16', 'sort', 'partitioned' or 'space_saving'");
 }
@@ -0,0 +1,170 @@
+#pragma once
+#include <cstdint>
+#include <cstdlib>
+#include <cstring>
+#include <limits>
+#include <memory>
+#include <mutex>
+#include <new>
+#include <unordered_map>
+#include <vector>
+
+// Exact bucket counts for l <= 32: one counter of type C (uint8_t / uint16_t)
+// per bucket, indexed by y directly. A counter that reaches its maximum stays
+// there and the excess goes to a side map, so the rare heavy buckets stay
+// exact without widening every counter (l = 30: 1 GiB in uint8 instead of
+// 4 GiB in uint32).
+//
+// The array comes from calloc, so for large l the pages are zero-filled by
+// the OS on first touch instead of memset up front.
+template <typename C>
+class DenseCounter {
+public:
+    // reusable: remember the first touched keys (up to 2^l / 128 of them, i.e.
+    // at most 1/16 of a uint8 array) so that clear() can skip the memset
+    explicit DenseCounter(int l, bool reusable = false)
+        : n_(size_t(1) << l), counts_(static_cast<C*>(std::calloc(n_, sizeof(C)))),
+          reusable_(reusable), touched_overflow_(!reusable) {
+        if (!counts_) throw std::bad_alloc();
+    }
+
+    // back to all-zero counts, keeping the (already faulted-in) array: only
+    // the touched counters are reset while they are few, else the whole array
+    void clear() {
+        if (touched_overflow_) {
+            std::memset(counts_.get(), 0, n_ * sizeof(C));
+        } else {
+            for (uint64_t key : touched_) counts_.get()[key] = 0;
+        }
+        touched_.clear();
+        touched_overflow_ = !reusable_;
+        spill_.clear();
+        max_c_ = 0;
+    }
+
+    void offer(uint64_t key) {
+        C& c = counts_.get()[key];
+        uint32_t total;
+        if (c < kMax) {
+            if (c == 0 && !touched_overflow_) {
+                if (touched_.size() < (n_ >> 7)) touched_.push_back(key);
+                else touched_overflow_ = true;
+            }
+            total = ++c;
+        } else {
+            total = uint32_t(kMax) + ++spill_[key];
+        }
+        if (total > max_c_) max_c_ = total;
+    }
+
+    uint32_t count(uint64_t key) const {
+        const C c = counts_.get()[key];
+        if (c < kMax) return c;
+        auto it = spill_.find(key);
+        return uint32_t(kMax) + (it == spill_.end() ? 0 : it->second);
+    }
+
+    uint32_t max_count() const { return max_c_; }
+
+    // f(count) for every non-empty bucket
+    template <typename F>
+    void for_each_count(F&& f) const {
+        const C* counts = counts_.get();
+        for (size_t i = 0; i < n_; ++i) {
+            if (counts[i] == 0) continue;
+            f(counts[i] < kMax ? uint32_t(counts[i]) : count(i));
+        }
+    }
+
+    // bytes of the counter array for 2^l buckets
+    static size_t array_bytes(int l) { return (size_t(1) << l) * sizeof(C); }
+
+private:
+    static constexpr C kMax = std::numeric_limits<C>::max();
+
+    struct FreeDeleter {
+        void operator()(C* p) const { std::free(p); }
+    };
+
+    size_t n_;
+    std::unique_ptr<C, FreeDeleter> counts_;
+    std::unordered_map<uint64_t, uint32_t> spill_;  // key -> count above kMax
+    std::vector<uint64_t> touched_;                  // first keys offered, for clear()
+    bool reusable_;
+    bool touched_overflow_;                          // more than n / 128 of them, or not reusable
+    uint32_t max_c_ = 0;
+};
+
+// DenseCounter shared by the threads of one trial: the counters are bumped
+// with a relaxed compare-and-swap (so a saturated counter never wraps) and
+// the spilled counts are kept under a mutex. offer() returns the count of the
+// key after the increment, each thread keeping the max of what it saw.
+template <typename C>
+class AtomicDenseCounter {
+public:
+    explicit AtomicDenseCounter(int l)
+        : n_(size_t(1) << l), counts_(static_cast<C*>(std::calloc(n_, sizeof(C)))) {
+        if (!counts_) throw std::bad_alloc();
+    }
+
+    uint32_t offer(uint64_t key) {
+        C* p = counts_.get() + key;
+        C c = __atomic_load_n(p, __ATOMIC_RELAXED);
+        while (c < kMax) {
+            if (__atomic_compare_exchange_n(p, &c, C(c + 1), true, __ATOMIC_RELAXED, __ATOMIC_RELAXED))
+                return uint32_t(c) + 1;
+        }
+        std::lock_guard<std::mutex> lock(spill_mutex_);
+        return uint32_t(kMax) + ++spill_[key];
+    }
+
+    // not thread-safe (between passes only): f(count) for every non-empty bucket
+    template <typename F>
+    void for_each_count(F&& f) const {
+        const C* counts = counts_.get();
+        for (size_t i = 0; i < n_; ++i) {
+            if (counts[i] == 0) continue;
+            if (counts[i] < kMax) {
+                f(uint32_t(counts[i]));
+            } else {
+                auto it = spill_.find(i);
+                f(uint32_t(kMax) + (it == spill_.end() ? 0 : it->second));
+            }
+        }
+    }
+
+    // not thread-safe: between passes only
+    void clear() {
+        std::memset(counts_.get(), 0, n_ * sizeof(C));
+        spill_.clear();
+    }
+
+private:
+    static constexpr C kMax = std::numeric_limits<C>::max();
+
+    struct FreeDeleter {
+        void operator()(C* p) const { std::free(p); }
+    };
+
+    size_t n_;
+    std::unique_ptr<C, FreeDeleter> counts_;
+    std::mutex spill_mutex_;
+    std::unordered_map<uint64_t, uint32_t> spill_;
+};
+
+// One thread's handle on an AtomicDenseCounter.
+template <typename C>
+class SharedDenseView {
+public:
+    explicit SharedDenseView(AtomicDenseCounter<C>& shared) : shared_(shared) {}
+
+    void offer(uint64_t key) {
+        const uint32_t c = shared_.offer(key);
+        if (c > max_c_) max_c_ = c;
+    }
+    uint32_t max_count() const { return max_c_; }
+
+private:
+    AtomicDenseCounter<C>& shared_;
+    uint32_t max_c_ = 0;
+};
@@ -0,0 +1,124 @@
+#pragma once
+#include "fingerprint.hpp"
+#include "rng.hpp"
+
+#include <algorithm>
+#include <chrono>
+#include <cstdint>
+#include <stdexcept>
+#include <string>
+#include <vector>
+
+// Set semantics for S: remembers the keys drawn so far and replaces every
+// repeat by a fresh draw, so the stream yields distinct keys only.
+//  - a key is stored as a 128-bit value: x itself when u <= 128, else
+//    fingerprint64 and fingerprint64_keyed of its blocks, two 64-bit hashes
+//    that share no mixed word (two keys collide with probability about
+//    2^-128, i.e. never over any S that fits in memory);
+//  - the values live in one flat open-addressing table (linear probing) of
+//    fixed size, allocated for max_keys keys at most 3/4 full: 16 bytes per
+//    slot, bytes_for(max_keys) in all, whatever the number of repeats;
+//  - a pass over S that takes more than max_draws(max_keys) draws stops
+//    with std::runtime_error: the distribution has too few likely keys.
+// draws(), duplicates() and seconds() report the cost of the dedup.
+class DistinctKeys {
+public:
+    DistinctKeys(int u, int64_t max_keys)
+        : B_((u + 63) / 64), exact_(u <= 128), max_draws_(max_draws(max_keys)) {
+        size_t cap = 16;
+        while (3 * cap < 4 * size_t(max_keys)) cap *= 2;
+        slots_.assign(cap, Slot{0, 0});
+        shift_ = 64 - __builtin_ctzll(cap);
+    }
+
+    static uint64_t bytes_for(int64_t max_keys) {
+        uint64_t cap = 16;
+        while (3 * cap < 4 * uint64_t(max_keys)) cap *= 2;
+        return cap * sizeof(Slot);
+    }
+
+    // draws allowed to collect max_keys distinct keys
+    static uint64_t max_draws(int64_t max_keys) { return 64 * uint64_t(max_keys) + (uint64_t(1) << 20); }
+
+    // Keeps the n keys of xs (rows of B blocks) that are new, in order, and
+    // draws each repeat again with sample(rng, x) until it is new.
+    template <typename Sampler, typename Rng>
+    void keep_new(const Sampler& sample, Rng& rng, uint64_t* xs, int64_t n) {
+        const auto t0 = std::chrono::steady_clock::now();
+        for (int64_t t = 0; t < n; ++t) {
+            uint64_t* x = xs + t * B_;
+            ++pass_draws_;
+            ++draws_;
+            while (!insert(x)) {
+                ++duplicates_;
+                if (pass_draws_ >= max_draws_)
+                    throw std::runtime_error("distinct keys: " + std::to_string(size_) + " distinct in " +
+                                             std::to_string(pass_draws_) +
+                                             " draws, the distribution has too few likely keys");
+                sample(rng, x);
+                ++pass_draws_;
+                ++draws_;
+            }
+        }
+        seconds_ += std::chrono::duration<double>(std::chrono::steady_clock::now() - t0).count();
+    }
+
+    // forget the keys (another pass over the same S), keep the counts
+    void clear() {
+        std::fill(slots_.begin(), slots_.end(), Slot{0, 0});
+        has_zero_ = false;
+        size_ = 0;
+        pass_draws_ = 0;
+    }
+
+    size_t size() const { return size_; }
+    uint64_t draws() const { return draws_; }
+    uint64_t duplicates() const { return duplicates_; }
+    double seconds() const { return seconds_; }
+
+private:
+    struct Slot {
+        uint64_t lo, hi;  // (0, 0) = free
+    };
+
+    // true if x was not in the set (and is now)
+    bool insert(const uint64_t* x) {
+        Slot k;
+        if (exact_) {
+            k.lo = x[0];
+            k.hi = B_ > 1 ? x[1] : 0;
+        } else {
+            k.lo = fingerprint64(x, B_);
+            k.hi = fingerprint64_keyed(x, B_, 0xd1b54a32d192ed03ULL);
+        }
+        if ((k.lo | k.hi) == 0) {
+            if (has_zero_) return false;
+            has_zero_ = true;
+            ++size_;
+            return true;
+        }
+        const size_t mask = slots_.size() - 1;
+        size_t pos = size_t(splitmix64_mix(k.lo ^ splitmix64_mix(k.hi)) >> shift_);
+        while ((slots_[pos].lo | slots_[pos].hi) != 0) {
+            if (slots_[pos].lo == k.lo && slots_[pos].hi == k.hi) return false;
+            pos = (pos + 1) & mask;
+        }
+        if (4 * (size_ + 1) > 3 * slots_.size())
+            throw std::logic_error("DistinctKeys: more keys than max_keys");
+        slots_[pos] = k;
+        ++size_;
+        return true;
+    }
+
+    int B_;
+    bool exact_;
+    uint64_t max_draws_;
+    std::vector<Slot> slots_;
+    int shift_ = 64;
+    bool has_zero_ = false;
+    size_t size_ = 0;
+    uint64_t pass_draws_ = 0;  // since clear()
+    uint64_t draws_ = 0;
+    uint64_t duplicates_ = 0;
+    double seconds_ = 0.0;
+};
@@ -0,0 +1,111 @@
+#include "f2_matrix.hpp"
+
+#include <algorithm>
+#include <stdexcept>
+
+BitMatrix::BitMatrix(int nrows, int ncols)
+    : nrows_(nrows), ncols_(ncols), wpr_((ncols + 63) / 64)
+{
+    if (nrows < 0 || ncols < 0) throw std::invalid_argument("matrix dimensions must be >= 0");
+    data_.assign(size_t(nrows_) * wpr_, 0ULL);
+}
+
+BitMatrix BitMatrix::from_rows(const std::vector<std::vector<uint64_t>>& rows, int ncols)
+{
+    BitMatrix m(int(rows.size()), ncols);
+    const int excess = m.wpr_ * 64 - ncols;
+    for (int i = 0; i < m.nrows_; ++i) {
+        if (int(rows[i].size()) != m.wpr_) throw std::invalid_argument("row size mismatch");
+        std::copy(rows[i].begin(), rows[i].end(), m.row(i));
+        if (excess > 0) m.row(i)[m.wpr_ - 1] &= (~0ULL) >> excess;
+    }
+    return m;
+}
+
+void BitMatrix::set(int i, int j, bool v)
+{
+    uint64_t& w = row(i)[j >> 6];
+    const uint64_t bit = 1ULL << (j & 63);
+    w = v ? (w | bit) : (w & ~bit);
+}
+
+int BitMatrix::rank() const
+{
+    BitMatrix copy(*this);
+    return copy.eliminate();
+}
+
+int BitMatrix::eliminate()
+{
+    constexpr int kStripe = 8;
+    std::vector<uint64_t> table;
+    std::vector<uint64_t> tmp(wpr_);
+    int r = 0;  // pivots found so far = rows [0, r) are done
+
+    for (int col = 0; col < ncols_ && r < nrows_; col += kStripe) {
+        const int width = std::min(kStripe, ncols_ - col);
+        const int w0 = col >> 6;             // stripe is inside one word (64 % 8 == 0)
+        const int sh = col & 63;
+        const uint64_t stripe_mask = ((width == 64) ? ~0ULL : ((1ULL << width) - 1)) << sh;
+        const int span = wpr_ - w0;          // words from the stripe to the end of the row
+
+        // 1. pivots of the stripe: reduce each candidate row by the pivots
+        //    found so far; a non-zero remainder on the stripe is a new pivot
+        int pivcol[kStripe];
+        int found = 0;
+        for (int i = r; i < nrows_ && found < width; ++i) {
+            uint64_t* ri = row(i);
+            for (int p = 0; p < found; ++p) {
+                if ((ri[w0] >> pivcol[p]) & 1ULL) {
+                    const uint64_t* rp = row(r + p);
+                    for (int w = w0; w < wpr_; ++w) ri[w] ^= rp[w];
+                }
+            }
+            const uint64_t bits = ri[w0] & stripe_mask;
+            if (bits == 0) continue;
+
+            const int c = __builtin_ctzll(bits);
+            uint64_t* rn = row(r + found);
+            if (rn != ri) {
+                std::copy(rn + w0, rn + wpr_, tmp.begin());
+                std::copy(ri + w0, ri + wpr_, rn + w0);
+                std::copy(tmp.begin(), tmp.begin() + span, ri + w0);
+                // words before w0 are zero on every row >= r, nothing to swap there
+            }
+            // keep the pivots reduced against each other
+            for (int p = 0; p < found; ++p) {
+                uint64_t* rp = row(r + p);
+                if ((rp[w0] >> c) & 1ULL) {
+                    for (int w = w0; w < wpr_; ++w) rp[w] ^= rn[w];
+                }
+            }
+            pivcol[found++] = c;
+        }
+        if (found == 0) continue;
+
+        // 2. table[mask] = XOR of the pivots selected by mask, one row XOR per entry
+        const size_t combos = size_t(1) << found;
+        table.assign(combos * span, 0ULL);
+        for (size_t g = 1; g < combos; ++g) {
+            const int p = __builtin_ctzll(g);
+            const size_t prev = (g ^ (1ULL << p));
+            const uint64_t* rp = row(r + p) + w0;
+            uint64_t* dst = table.data() + g * span;
+            const uint64_t* src = table.data() + prev * span;
+            for (int w = 0; w < span; ++w) dst[w] = src[w] ^ rp[w];
+        }
+
+        // 3. clear the stripe on the remaining rows with one lookup each
+        for (int i = r + found; i < nrows_; ++i) {
+            uint64_t* ri = row(i);
+            const uint64_t v = ri[w0];
+            if ((v & stripe_mask) == 0) continue;
+            size_t mask = 0;
+            for (int p = 0; p < found; ++p) mask |= size_t((v >> pivcol[p]) & 1ULL) << p;
+            const uint64_t* t = table.data() + mask * span;
+            for (int w = 0; w < span; ++w) ri[w0 + w] ^= t[w];
+        }
+        r += found;
+    }
+    return r;
+}
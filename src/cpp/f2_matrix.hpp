@@ -0,0 +1,39 @@
+#pragma once
+#include <cstddef>
+#include <cstdint>
+#include <vector>
+
+// Dense matrix over F2, packed row by row: bit j of row i is bit (j % 64) of
+// word j / 64 of the row (same little-endian layout as the LinearHash blocks).
+class BitMatrix {
+public:
+    BitMatrix(int nrows, int ncols);
+
+    // rows given as ceil(ncols/64) blocks each; bits past ncols are ignored
+    static BitMatrix from_rows(const std::vector<std::vector<uint64_t>>& rows, int ncols);
+
+    int nrows() const { return nrows_; }
+    int ncols() const { return ncols_; }
+    int words_per_row() const { return wpr_; }
+
+    uint64_t* row(int i) { return data_.data() + size_t(i) * wpr_; }
+    const uint64_t* row(int i) const { return data_.data() + size_t(i) * wpr_; }
+    bool get(int i, int j) const { return (row(i)[j >> 6] >> (j & 63)) & 1ULL; }
+    void set(int i, int j, bool v);
+
+    // Rank by M4RI-style elimination (method of the four Russians): columns
+    // are processed in stripes of up to 8; the stripe's pivots are reduced
+    // against each other, the 2^p XOR combinations of the p pivot rows are
+    // tabulated, and every other row is cleared on the stripe with a single
+    // table lookup instead of up to p row XORs. Works on a copy.
+    int rank() const;
+
+    // In-place variant: leaves the matrix in row echelon form (pivots first).
+    int eliminate();
+
+private:
+    int nrows_;
+    int ncols_;
+    int wpr_;                     // words per row
+    std::vector<uint64_t> data_;
+};
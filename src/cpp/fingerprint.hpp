@@ -0,0 +1,45 @@
+#pragma once
+#include <cstdint>
+
+// 因为SpaceSaving的key类型是uint64_t，但h(x)的输出是l位，当l>64时会跨多个block存储。
+// 需要压缩的根本原因是这两者之间的不匹配：
+//      h(x) 输出: [block0][block1][block2]...  ← l=200时有4个uint64
+//      SpaceSaving.offer(key)                  ← 只接受一个uint64
+// 在之前的python实现中，h(x) 输出: [block0][block1][block2]... 是一串bits，我们可以直接用其表示的整数当key
+// 而这里我们通过fingerprint64，近似实现了: 相同的y产生相同的key，不同的y产生不同的key
+// seed 是 h 的初始值：不同的 seed 给出（近似）独立的 fingerprint，两个拼起来就是 128 位
+static inline uint64_t fingerprint64_seeded(const uint64_t* y, int n, uint64_t seed) {
+    // 任意长度 uint64 数组 ==> uint64 
+    uint64_t h = seed;
+    for (int j = 0; j < n; ++j) {
+        uint64_t v = y[j];
+        // SplitMix64混淆 --> 让输入的每一个bit都影响输出的所有bit
+        v ^= v >> 30;  // 高位的信息混入低位
+        v *= 0xbf58476d1ce4e5b9ULL;    // v *= 大质数：乘法让每个bit扩散到更高位（进位传播）
+        v ^= v >> 27; v *= 0x94d049bb133111ebULL;
+        v ^= v >> 31;
+        // 把多个64位值合并进一个h，且顺序敏感; 让 h 自身的历史状态参与混合，使得 [a,b] 和 [b,a] 得到不同结果
+        h ^= v + 0x9e3779b97f4a7c15ULL + (h<<6) + (h>>2);
+    }
+    return h;
+}
+
+static inline uint64_t fingerprint64(const uint64_t* y, int n) {
+    return fingerprint64_seeded(y, n, 0x9e3779b97f4a7c15ULL);
+}
+
+// 第二个 64 位指纹，与 fingerprint64 独立：seed 不只是 h 的初值，每个 block 在 SplitMix64
+// 混淆之前也先异或 seed，所以混淆后的 word 与 fingerprint64 的完全不同（换 seed 的
+// fingerprint64_seeded 只是用另一个初值合并同一组 word）。两者拼起来才是 128 位
+static inline uint64_t fingerprint64_keyed(const uint64_t* y, int n, uint64_t seed) {
+    uint64_t h = seed;
+    for (int j = 0; j < n; ++j) {
+        uint64_t v = y[j] ^ seed;
+        v ^= v >> 30;
+        v *= 0xbf58476d1ce4e5b9ULL;
+        v ^= v >> 27; v *= 0x94d049bb133111ebULL;
+        v ^= v >> 31;
+        h ^= v + 0x9e3779b97f4a7c15ULL + (h<<6) + (h>>2);
+    }
+    return h;
+}
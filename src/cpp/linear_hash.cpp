@@ -1,33 +1,367 @@
 #include "linear_hash.hpp"
+#include "simd_kernels.hpp"
 
 #include <stdexcept>
+#include <algorithm>
+#include <cstring>
+#include <thread>
+#if defined(__unix__) || defined(__APPLE__)
+#include <unistd.h>
+#endif
 
-// Constructor
-LinearHash::LinearHash(int l_, int u_, uint64_t seed)
-    : l(l_), u(u_)
+// Transpose a 64x64 bit matrix in place: bit j of a[i] <-> bit i of a[j].
+static inline void transpose64(uint64_t a[64]) {
+    uint64_t m = 0x00000000FFFFFFFFULL;
+    for (int j = 32; j != 0; j >>= 1, m ^= (m << j)) {
+        for (int k = 0; k < 64; k = ((k | j) + 1) & ~j) {
+            uint64_t t = ((a[k] >> j) ^ a[k | j]) & m;
+            a[k] ^= t << j;
+            a[k | j] ^= t;
+        }
+    }
+}
+
+// Kernel cost models, all in the same rough unit (about 1 ns per key on the
+// machines we benchmarked). They only need to rank the kernels.
+
+// Bit-sliced kernel with g-bit column groups: ceil(u/g) * (2^g + l) XORs per
+// 64 inputs, plus two 64x64 transposes (~200 ops each) per input / output
+// block; ~2 units per word op.
+static int64_t bitsliced_cost(int l, int u, int g) {
+    const int64_t num_in_blocks = (u + 63) / 64;
+    const int64_t num_out_blocks = (l + 63) / 64;
+    const int64_t xors = int64_t((u + g - 1) / g) * ((int64_t(1) << g) + l);
+    return 2 * (xors + (num_in_blocks + num_out_blocks) * 200) / 64;
+}
+
+// Per-key row loop: l * ceil(u/64) AND/XOR steps (~1.5 units each); both
+// vector kernels handle 8 rows per step.
+static int64_t rowloop_cost(int l, int u, SimdLevel level) {
+    const int64_t lanes = level == SimdLevel::Scalar ? 1 : 8;
+    return 3 * int64_t(l) * ((u + 63) / 64) / (2 * lanes) + 1;
+}
+
+// Table mode: ceil(u/bits) lookups, each a likely cache miss (~4 units) plus
+// one unit per output block.
+static int64_t table_cost(int l, int u, int bits) {
+    return int64_t((u + bits - 1) / bits) * (4 + (l + 63) / 64);
+}
+
+// Sparse path: one XOR of ceil(l/64) words per set bit, plus the bit scan.
+static int sparse_weight_limit(int l, int64_t dense_cost) {
+    return int(dense_cost / (2 + (l + 63) / 64));
+}
+
+// Pick the group width g of the bit-sliced kernel by minimising its cost, and
+// compare it with the per-key row loop. Return 0 if the row loop wins.
+static int choose_slice_bits(int l, int u, SimdLevel level) {
+    int best_g = 1;
+    for (int g = 2; g <= 8; ++g) {
+        if (bitsliced_cost(l, u, g) < bitsliced_cost(l, u, best_g)) best_g = g;
+    }
+    return bitsliced_cost(l, u, best_g) < rowloop_cost(l, u, level) ? best_g : 0;
+}
+
+// Popcount row loop: bit i of y = parity(row_i & x). The ANDed blocks are
+// XOR-folded first, so each row costs a single popcount. BI > 0 fixes the
+// number of input blocks at compile time so the inner loop is fully unrolled.
+template <int BI>
+static void rowloop_kernel(const uint64_t* rows, int l, int num_in_blocks,
+                           const uint64_t* x, uint64_t* y)
 {
-    if (l <= 0 || u <= 0)
-        throw std::invalid_argument("l and u must be positive");
+    const int B = BI > 0 ? BI : num_in_blocks;
+    const int num_out_blocks = (l + 63) / 64;
+    for (int ob = 0; ob < num_out_blocks; ++ob) y[ob] = 0ULL;
 
-    num_in_blocks  = (u + 63) / 64;
-    num_out_blocks = (l + 63) / 64;
+    for (int i = 0; i < l; ++i) {
+        const uint64_t* row = rows + size_t(i) * B;
+        uint64_t acc = 0ULL;
+        for (int b = 0; b < B; ++b) acc ^= row[b] & x[b];
+        y[i / 64] |= uint64_t(__builtin_popcountll(acc) & 1) << (i % 64);
+    }
+}
 
-    std::mt19937_64 rng(seed);
+// Size of the cache the lookup tables should fit in: the last level cache
+// reported by the OS, capped at 8 MiB since it is shared between threads.
+static size_t table_cache_budget() {
+    size_t budget = size_t(1) << 20;
+#if defined(_SC_LEVEL2_CACHE_SIZE)
+    long l2 = sysconf(_SC_LEVEL2_CACHE_SIZE);
+    if (l2 > 0) budget = size_t(l2);
+#endif
+#if defined(_SC_LEVEL3_CACHE_SIZE)
+    long l3 = sysconf(_SC_LEVEL3_CACHE_SIZE);
+    if (l3 > 0 && size_t(l3) > budget) budget = size_t(l3);
+#endif
+    return std::min(budget, size_t(8) << 20);
+}
+
+// Pick the chunk width of table mode (8 or 16 bits), or 0 for popcount mode:
+// the tables must fit in the cache budget and beat the row loop.
+static int choose_table_bits(int l, int u, SimdLevel level) {
+    const size_t num_out_blocks = size_t(l + 63) / 64;
+    const size_t budget = table_cache_budget();
+    for (int bits : {16, 8}) {
+        const size_t chunks = size_t(u + bits - 1) / bits;
+        const size_t bytes = chunks * (size_t(1) << bits) * num_out_blocks * sizeof(uint64_t);
+        if (bytes <= budget && table_cost(l, u, bits) < rowloop_cost(l, u, level)) return bits;
+    }
+    return 0;
+}
 
-    rows.resize(l);
+// Rows i = 0..l-1 of the matrix drawn from mt19937_64(seed), row-major, with
+// the bits past u in the last block cleared.
+static void fill_rows(uint64_t* rows, int l, int u, uint64_t seed)
+{
+    const int num_in_blocks = (u + 63) / 64;
+    std::mt19937_64 rng(seed);
     for (int i = 0; i < l; ++i) {
-        rows[i].resize(num_in_blocks);
+        uint64_t* row = rows + size_t(i) * num_in_blocks;
         for (int b = 0; b < num_in_blocks; ++b) {
-            rows[i][b] = rng();  // uniform 64-bit
+            row[b] = rng();  // uniform 64-bit
         }
 
         // Mask off unused bits in last block if u not multiple of 64
         int excess_bits = num_in_blocks * 64 - u;
         if (excess_bits > 0) {
             uint64_t mask = (~0ULL) >> excess_bits;
-            rows[i][num_in_blocks - 1] &= mask;
+            row[num_in_blocks - 1] &= mask;
+        }
+    }
+}
+
+// Same with the counter-based generator. Rows are independent, so large
+// matrices are split over threads.
+static void fill_rows_counter(uint64_t* rows, int l, int u, uint64_t seed)
+{
+    const int num_in_blocks = (u + 63) / 64;
+    const int excess_bits = num_in_blocks * 64 - u;
+    const uint64_t last_mask = excess_bits > 0 ? (~0ULL) >> excess_bits : ~0ULL;
+
+    auto fill = [&](int i0, int i1) {
+        for (int i = i0; i < i1; ++i) {
+            uint64_t* row = rows + size_t(i) * num_in_blocks;
+            for (int b = 0; b < num_in_blocks; ++b) row[b] = matrix_block(seed, uint32_t(i), uint32_t(b));
+            row[num_in_blocks - 1] &= last_mask;
+        }
+    };
+
+    constexpr size_t kParallelWords = size_t(1) << 18;
+    int num_threads = int(std::thread::hardware_concurrency());
+    if (size_t(l) * num_in_blocks < kParallelWords || num_threads <= 1) {
+        fill(0, l);
+        return;
+    }
+    num_threads = std::min(num_threads, l);
+    std::vector<std::thread> threads;
+    threads.reserve(size_t(num_threads));
+    for (int t = 0; t < num_threads; ++t) {
+        threads.emplace_back(fill, int(int64_t(l) * t / num_threads), int(int64_t(l) * (t + 1) / num_threads));
+    }
+    for (auto& th : threads) th.join();
+}
+
+static void fill_rows(uint64_t* rows, int l, int u, uint64_t seed, MatrixGen gen)
+{
+    if (gen == MatrixGen::Counter) fill_rows_counter(rows, l, u, seed);
+    else fill_rows(rows, l, u, seed);
+}
+
+// Constructor
+LinearHash::LinearHash(int l_, int u_, uint64_t seed_, HashMode mode, MatrixGen gen_)
+    : l(l_), u(u_), seed(seed_), gen(gen_), table_bits(0)
+{
+    if (l <= 0 || u <= 0)
+        throw std::invalid_argument("l and u must be positive");
+
+    num_in_blocks  = (u + 63) / 64;
+    num_out_blocks = (l + 63) / 64;
+
+    rows.resize(size_t(l) * num_in_blocks);
+    fill_rows(rows.data(), l, u, seed, gen);
+    init(mode);
+}
+
+LinearHash::LinearHash(int l_, int u_, const std::vector<uint64_t>& seeds, HashMode mode, MatrixGen gen_)
+    : l(l_ * int(seeds.size())), u(u_), seed(seeds.empty() ? 0 : seeds[0]), gen(gen_), table_bits(0)
+{
+    if (l_ <= 0 || u <= 0)
+        throw std::invalid_argument("l and u must be positive");
+    if (seeds.empty())
+        throw std::invalid_argument("seeds must not be empty");
+
+    num_in_blocks  = (u + 63) / 64;
+    num_out_blocks = (l + 63) / 64;
+
+    rows.resize(size_t(l) * num_in_blocks);
+    for (size_t t = 0; t < seeds.size(); ++t) {
+        fill_rows(rows.data() + t * size_t(l_) * num_in_blocks, l_, u, seeds[t], gen);
+    }
+    init(mode);
+}
+
+LinearHash::LinearHash(FromRows, int l_, int u_, std::vector<uint64_t> rows_,
+                       uint64_t seed_, MatrixGen gen_, HashMode mode)
+    : l(l_), u(u_), seed(seed_), gen(gen_), rows(std::move(rows_)), table_bits(0)
+{
+    num_in_blocks  = (u + 63) / 64;
+    num_out_blocks = (l + 63) / 64;
+
+    // every kernel assumes the bits past u are clear
+    const int excess_bits = num_in_blocks * 64 - u;
+    if (excess_bits > 0) {
+        for (int i = 0; i < l; ++i) rows[size_t(i) * num_in_blocks + num_in_blocks - 1] &= (~0ULL) >> excess_bits;
+    }
+    init(mode);
+}
+
+// Serialized header, all fields little-endian.
+namespace {
+struct SerialHeader {
+    char magic[4];      // "LHF2"
+    uint32_t version;
+    int32_t l;
+    int32_t u;
+    uint64_t seed;
+    uint32_t gen;       // MatrixGen
+    uint32_t mode;      // requested HashMode
+};
+static_assert(sizeof(SerialHeader) == 32, "unexpected padding in SerialHeader");
+constexpr uint32_t kSerialVersion = 1;
+}  // namespace
+
+std::string LinearHash::to_bytes() const
+{
+    SerialHeader hd{{'L', 'H', 'F', '2'}, kSerialVersion, l, u, seed,
+                    uint32_t(gen), uint32_t(requested_mode)};
+    std::string out(sizeof(hd) + rows.size() * sizeof(uint64_t), '\0');
+    std::memcpy(&out[0], &hd, sizeof(hd));
+    std::memcpy(&out[sizeof(hd)], rows.data(), rows.size() * sizeof(uint64_t));
+    return out;
+}
+
+LinearHash LinearHash::from_bytes(const void* data, size_t size)
+{
+    SerialHeader hd;
+    if (size < sizeof(hd)) throw std::invalid_argument("LinearHash bytes: truncated header");
+    std::memcpy(&hd, data, sizeof(hd));
+    if (std::memcmp(hd.magic, "LHF2", 4) != 0) throw std::invalid_argument("LinearHash bytes: bad magic");
+    if (hd.version != kSerialVersion) throw std::invalid_argument("LinearHash bytes: unsupported version");
+    if (hd.l <= 0 || hd.u <= 0 || hd.gen > uint32_t(MatrixGen::Counter) || hd.mode > uint32_t(HashMode::Table))
+        throw std::invalid_argument("LinearHash bytes: bad header");
+
+    const size_t words = size_t(hd.l) * ((size_t(hd.u) + 63) / 64);
+    if (size != sizeof(hd) + words * sizeof(uint64_t))
+        throw std::invalid_argument("LinearHash bytes: size does not match l and u");
+    std::vector<uint64_t> rows(words);
+    std::memcpy(rows.data(), static_cast<const char*>(data) + sizeof(hd), words * sizeof(uint64_t));
+    return LinearHash(FromRows{}, hd.l, hd.u, std::move(rows), hd.seed, MatrixGen(hd.gen), HashMode(hd.mode));
+}
+
+// Kernel selection and derived copies of M (columns, SIMD layout, tables).
+void LinearHash::init(HashMode mode)
+{
+    requested_mode = mode;
+
+    switch (num_in_blocks) {
+        case 1:  rowloop = rowloop_kernel<1>;  break;
+        case 2:  rowloop = rowloop_kernel<2>;  break;
+        case 4:  rowloop = rowloop_kernel<4>;  break;
+        case 8:  rowloop = rowloop_kernel<8>;  break;
+        case 16: rowloop = rowloop_kernel<16>; break;
+        case 47: rowloop = rowloop_kernel<47>; break;  // u = 3000
+        default: rowloop = rowloop_kernel<0>;  break;
+    }
+
+    build_columns();
+
+    // vector row loop (AVX2 / AVX-512) if the CPU has one
+    const SimdLevel level = active_simd_level();
+    simd_rowloop = interleaved_rowloop(level);
+    simd_level = int(level);
+    if (simd_rowloop) {
+        rows8.resize(interleaved_rows8_size(l, num_in_blocks));
+        interleave_rows8(rows.data(), l, num_in_blocks, rows8.data());
+    }
+
+    slice_bits = choose_slice_bits(l, u, level);
+
+    if (mode != HashMode::Popcount) {
+        int bits = choose_table_bits(l, u, level);
+        if (bits == 0 && mode == HashMode::Table) bits = 8;  // forced, even if out of cache
+        if (bits > 0) build_tables(bits);
+    }
+
+    // Batches go through the tables only if they beat the bit-sliced kernel.
+    batch_use_table = table_bits > 0 &&
+        (slice_bits == 0 || table_cost(l, u, table_bits) < bitsliced_cost(l, u, slice_bits));
+
+    const int64_t dense_cost = table_bits > 0 ? table_cost(l, u, table_bits) : rowloop_cost(l, u, level);
+    sparse_max_weight = sparse_weight_limit(l, dense_cost);
+    sparse_max_weight_batch = (slice_bits > 0 && !batch_use_table)
+        ? sparse_weight_limit(l, bitsliced_cost(l, u, slice_bits))
+        : sparse_max_weight;
+}
+
+const char* LinearHash::get_simd_kernel() const
+{
+    return simd_level_name(SimdLevel(simd_level));
+}
+
+// Transpose M tile by tile (64 rows x 64 input bits) into the column-major copy.
+void LinearHash::build_columns()
+{
+    cols.assign(size_t(num_in_blocks) * 64 * num_out_blocks, 0ULL);
+    uint64_t tmp[64];
+    for (int ob = 0; ob < num_out_blocks; ++ob) {
+        for (int b = 0; b < num_in_blocks; ++b) {
+            for (int r = 0; r < 64; ++r) {
+                const int i = ob * 64 + r;
+                tmp[r] = (i < l) ? rows[size_t(i) * num_in_blocks + b] : 0ULL;
+            }
+            transpose64(tmp);
+            for (int j = 0; j < 64; ++j) cols[(size_t(b) * 64 + j) * num_out_blocks + ob] = tmp[j];
+        }
+    }
+    cols.resize(size_t(u) * num_out_blocks);
+}
+
+// tables[c][v] = h(v << (c * bits)) = XOR of the columns of M selected by v
+void LinearHash::build_tables(int bits)
+{
+    const int num_chunks = (u + bits - 1) / bits;
+    const size_t per_chunk = (size_t(1) << bits) * num_out_blocks;
+    tables.assign(size_t(num_chunks) * per_chunk, 0ULL);
+
+    // columns of the last chunk past u are zero
+    std::vector<uint64_t> col(cols);
+    col.resize(size_t(num_chunks) * bits * num_out_blocks, 0ULL);
+    for (int c = 0; c < num_chunks; ++c) {
+        const uint64_t* chunk_cols = col.data() + size_t(c) * bits * num_out_blocks;
+        uint64_t* T = tables.data() + size_t(c) * per_chunk;
+        for (uint32_t v = 1; v < (1u << bits); ++v) {
+            const uint64_t* prev = T + size_t(v & (v - 1)) * num_out_blocks;
+            const uint64_t* cj = chunk_cols + size_t(__builtin_ctz(v)) * num_out_blocks;
+            uint64_t* cur = T + size_t(v) * num_out_blocks;
+            for (int ob = 0; ob < num_out_blocks; ++ob) cur[ob] = prev[ob] ^ cj[ob];
         }
     }
+    table_bits = bits;
+}
+
+void LinearHash::hash_table(const uint64_t* x, uint64_t* y) const
+{
+    std::fill(y, y + num_out_blocks, 0ULL);
+    const int per_block = 64 / table_bits;
+    const uint64_t mask = (1ULL << table_bits) - 1ULL;
+    const size_t per_chunk = (size_t(1) << table_bits) * num_out_blocks;
+    const int num_chunks = (u + table_bits - 1) / table_bits;
+    const uint64_t* T = tables.data();
+    for (int c = 0; c < num_chunks; ++c, T += per_chunk) {
+        const uint64_t v = (x[c / per_block] >> ((c % per_block) * table_bits)) & mask;
+        const uint64_t* e = T + v * num_out_blocks;
+        for (int ob = 0; ob < num_out_blocks; ++ob) y[ob] ^= e[ob];
+    }
 }
 
 
@@ -40,38 +374,143 @@ LinearHash::hash(const std::vector<uint64_t>& x_blocks) const
     }
 
     std::vector<uint64_t> y(num_out_blocks, 0ULL);
+    hash_into(x_blocks.data(), y.data());
+    return y;
+}
 
-    for (int i = 0; i < l; ++i) {
-
-        uint64_t parity = 0ULL;
+// Sparse path: XOR of the columns of the set bits of x. The weight is counted
+// block by block and the scan stops as soon as it exceeds max_weight, so dense
+// inputs only pay for a popcount or two. Returns false if x is not sparse.
+bool LinearHash::hash_if_sparse(const uint64_t* x, uint64_t* y, int max_weight) const
+{
+    int weight = 0;
+    for (int b = 0; b < num_in_blocks; ++b) {
+        weight += __builtin_popcountll(x[b]);
+        if (weight > max_weight) return false;
+    }
 
-        for (int b = 0; b < num_in_blocks; ++b) {
-            uint64_t v = rows[i][b] & x_blocks[b];
-            parity ^= (__builtin_popcountll(v) & 1ULL);
+    std::fill(y, y + num_out_blocks, 0ULL);
+    for (int b = 0; b < num_in_blocks; ++b) {
+        for (uint64_t w = x[b]; w; w &= w - 1) {
+            const uint64_t* c = cols.data() + size_t(b * 64 + __builtin_ctzll(w)) * num_out_blocks;
+            for (int ob = 0; ob < num_out_blocks; ++ob) y[ob] ^= c[ob];
         }
+    }
+    return true;
+}
 
-        if (parity & 1ULL) {
-            int block_id = i / 64;
-            int bit_id   = i % 64;
-            y[block_id] |= (1ULL << bit_id);
-        }
+void LinearHash::hash_sparse_into(const uint32_t* idx, size_t k, uint64_t* y) const
+{
+    std::fill(y, y + num_out_blocks, 0ULL);
+    for (size_t j = 0; j < k; ++j) {
+        if (idx[j] >= uint32_t(u)) throw std::out_of_range("bit index out of range [0, u)");
+        const uint64_t* c = cols.data() + size_t(idx[j]) * num_out_blocks;
+        for (int ob = 0; ob < num_out_blocks; ++ob) y[ob] ^= c[ob];
     }
+}
 
+std::vector<uint64_t>
+LinearHash::hash_sparse(const std::vector<uint32_t>& idx) const
+{
+    std::vector<uint64_t> y(num_out_blocks, 0ULL);
+    hash_sparse_into(idx.data(), idx.size(), y.data());
     return y;
 }
 
+void LinearHash::hash_into(const uint64_t* x, uint64_t* y) const
+{
+    if (table_bits > 0) {
+        hash_table(x, y);
+        return;
+    }
+    run_rowloop(x, y);
+}
+
 uint32_t LinearHash::hash_u32(const std::vector<uint64_t>& x_blocks) const {
     if (l > 32) throw std::invalid_argument("hash_u32 requires l<=32");
     if ((int)x_blocks.size() != num_in_blocks) throw std::invalid_argument("x_blocks size mismatch");
 
-    uint32_t y = 0;
-    for (int i = 0; i < l; ++i) {
-        uint64_t parity = 0ULL;
-        for (int b = 0; b < num_in_blocks; ++b) {
-            uint64_t v = rows[i][b] & x_blocks[b];
-            parity ^= (__builtin_popcountll(v) & 1ULL);
+    uint64_t y = 0;
+    hash_into(x_blocks.data(), &y);
+    return uint32_t(y);
+}
+
+// Bit-sliced kernel for up to 64 inputs.
+// After transposing, X[j] holds bit j of all 64 inputs (bit t = input t), so
+// output bit i of all inputs is the XOR of the X[j] with M[i][j] = 1. Columns
+// are grouped g at a time into a table of all 2^g XOR combinations, and each
+// row then costs one lookup per group (method of the four Russians).
+void LinearHash::hash_bitsliced64(const uint64_t* xs, size_t n, uint64_t* ys) const
+{
+    thread_local std::vector<uint64_t> X, Yt, T;
+    X.resize(size_t(num_in_blocks) * 64);
+    Yt.assign(size_t(num_out_blocks) * 64, 0ULL);
+    T.resize(size_t(1) << slice_bits);
+
+    uint64_t tmp[64];
+    for (int b = 0; b < num_in_blocks; ++b) {
+        for (size_t t = 0; t < 64; ++t) tmp[t] = (t < n) ? xs[t * num_in_blocks + b] : 0ULL;
+        transpose64(tmp);
+        std::memcpy(X.data() + size_t(b) * 64, tmp, sizeof(tmp));
+    }
+
+    for (int b = 0; b < num_in_blocks; ++b) {
+        const int valid = std::min(64, u - b * 64);
+        for (int s = 0; s < valid; s += slice_bits) {
+            const int w = std::min(slice_bits, valid - s);
+            const uint64_t* Xs = X.data() + size_t(b) * 64 + s;
+            // T[v] = T[v without its lowest bit] ^ X[lowest bit of v]
+            T[0] = 0ULL;
+            for (uint32_t v = 1; v < (1u << w); ++v) {
+                T[v] = T[v & (v - 1)] ^ Xs[__builtin_ctz(v)];
+            }
+            const uint64_t mask = (1ULL << w) - 1ULL;
+            for (int i = 0; i < l; ++i) {
+                Yt[i] ^= T[(rows[size_t(i) * num_in_blocks + b] >> s) & mask];
+            }
         }
-        if (parity & 1ULL) y |= (1u << i);
     }
-    return y;
+
+    for (int ob = 0; ob < num_out_blocks; ++ob) {
+        std::memcpy(tmp, Yt.data() + size_t(ob) * 64, sizeof(tmp));
+        transpose64(tmp);
+        for (size_t t = 0; t < n; ++t) ys[t * num_out_blocks + ob] = tmp[t];
+    }
+}
+
+void LinearHash::hash_batch(const uint64_t* xs, size_t n, uint64_t* ys) const
+{
+    if (batch_use_table || slice_bits == 0) {
+        // per-key kernels (tables iff table_bits > 0 here, as in hash_into);
+        // the first key of each 64 decides whether the weights are scanned
+        for (size_t i = 0; i < n; i += 64) {
+            const size_t len = std::min<size_t>(64, n - i);
+            const bool sparse = sparse_max_weight > 0 &&
+                                hash_if_sparse(xs + i * num_in_blocks, ys + i * num_out_blocks, sparse_max_weight);
+            for (size_t t = i + (sparse ? 1 : 0); t < i + len; ++t) {
+                const uint64_t* x = xs + t * num_in_blocks;
+                uint64_t* y = ys + t * num_out_blocks;
+                if (sparse && hash_if_sparse(x, y, sparse_max_weight)) continue;
+                hash_into(x, y);
+            }
+        }
+        return;
+    }
+
+    for (size_t i = 0; i < n; i += 64) {
+        const size_t len = std::min<size_t>(64, n - i);
+        const uint64_t* x = xs + i * num_in_blocks;
+        uint64_t* y = ys + i * num_out_blocks;
+        // sparse batches (e.g. low Hamming weight keys) skip the transposes;
+        // the first key decides, the others fall back on their own if dense
+        if (sparse_max_weight_batch > 0 && hash_if_sparse(x, y, sparse_max_weight_batch)) {
+            for (size_t t = 1; t < len; ++t) {
+                const uint64_t* xt = x + t * num_in_blocks;
+                uint64_t* yt = y + t * num_out_blocks;
+                if (!hash_if_sparse(xt, yt, sparse_max_weight_batch)) run_rowloop(xt, yt);
+            }
+            continue;
+        }
+        hash_bitsliced64(x, len, y);
+    }
 }
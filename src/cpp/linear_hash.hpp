@@ -3,27 +3,139 @@
 
 #include <vector>
 #include <cstdint>
+#include <cstddef>
 #include <random>
+#include <string>
+
+#include "rng.hpp"  // splitmix64_mix
+
+// How h(x) is evaluated:
+//  - Popcount: parity of (row_i & x) for each of the l rows
+//  - Table:    h is linear, so h(x) is the XOR of h(chunk_j(x)) over the 8- or
+//              16-bit chunks of x; the images of every chunk value are
+//              precomputed at construction (four Russians)
+//  - Auto:     Table when its lookups are cheaper and the tables fit in cache
+enum class HashMode { Auto, Popcount, Table };
+
+// How the entries of M are drawn from the seed:
+//  - Sequential: rows from one mt19937_64(seed) stream, row-major
+//  - Counter:    block b of row i is matrix_block(seed, i, b), a pure function
+//                of its coordinates, so rows can be built in parallel, in any
+//                order, or only when needed (same generator as the Python side)
+enum class MatrixGen { Sequential, Counter };
+
+// Counter-based generator: block b of row i (before masking to u bits).
+static inline uint64_t matrix_block(uint64_t seed, uint32_t i, uint32_t b) {
+    return splitmix64_mix(splitmix64_mix(seed) ^ ((uint64_t(i) << 32) | b));
+}
 
 class LinearHash {
 public:
-    LinearHash(int l, int u, uint64_t seed);
+    LinearHash(int l, int u, uint64_t seed, HashMode mode = HashMode::Auto,
+               MatrixGen gen = MatrixGen::Sequential);
+
+    // Stacked hash: the seeds.size() matrices LinearHash(l, u, seeds[t]) on top
+    // of each other, i.e. a (T*l) x u matrix. Bits [t*l, (t+1)*l) of its output
+    // are h_t(x), so one pass over x evaluates all T hashes.
+    LinearHash(int l, int u, const std::vector<uint64_t>& seeds, HashMode mode = HashMode::Auto,
+               MatrixGen gen = MatrixGen::Sequential);
+
+    // Compact binary form: a fixed 32-byte header (magic "LHF2", version, l, u,
+    // seed, generator, requested mode) followed by the l * ceil(u/64) row
+    // blocks, little-endian. from_bytes rebuilds the kernels for the current
+    // CPU but does not regenerate M.
+    std::string to_bytes() const;
+    static LinearHash from_bytes(const void* data, size_t size);
 
     // Compute h(x) where x is given as little-endian uint64 blocks
     // Return output also as little-endian uint64 blocks
     std::vector<uint64_t> hash(const std::vector<uint64_t>& x_blocks) const;
-    int get_u() {return u;}
+    int get_u() const { return u; }
     int get_l() const { return l; }
     uint32_t hash_u32(const std::vector<uint64_t>& x_blocks) const;  // support l<=32 only
 
+    // Allocation-free API: x points to ceil(u/64) blocks, y to ceil(l/64) blocks.
+    // Dense kernels only, no weight scan: sparse keys go through hash_sparse_into,
+    // or hash_batch, which detects batches of low Hamming weight keys.
+    void hash_into(const uint64_t* x, uint64_t* y) const;
+
+    // Sparse API: x given by the indices of its set bits (each in [0, u)).
+    // h(x) is the XOR of the matching columns of M: O(k * ceil(l/64)).
+    // Repeated indices cancel out (linearity over F2).
+    void hash_sparse_into(const uint32_t* idx, size_t k, uint64_t* y) const;
+    std::vector<uint64_t> hash_sparse(const std::vector<uint32_t>& idx) const;
+
+    // Batch API: xs holds n inputs back to back (ceil(u/64) blocks each),
+    // ys receives the n outputs back to back (ceil(l/64) blocks each).
+    // Inputs are processed 64 at a time with the bit-sliced kernel; when the
+    // first of the 64 has a low Hamming weight, the batch goes column by column.
+    void hash_batch(const uint64_t* xs, size_t n, uint64_t* ys) const;
+    int get_num_in_blocks() const { return num_in_blocks; }
+    int get_num_out_blocks() const { return num_out_blocks; }
+    const char* get_simd_kernel() const;  // row loop kernel: "scalar", "avx2" or "avx512"
+    HashMode get_mode() const { return table_bits > 0 ? HashMode::Table : HashMode::Popcount; }
+    int get_table_bits() const { return table_bits; }
+    uint64_t get_seed() const { return seed; }  // first seed if stacked
+    MatrixGen get_gen() const { return gen; }
+    HashMode get_requested_mode() const { return requested_mode; }
+
 private:
+    struct FromRows {};
+    LinearHash(FromRows, int l, int u, std::vector<uint64_t> rows,
+               uint64_t seed, MatrixGen gen, HashMode mode);
+
     int l;                 // output bits
     int u;                 // input bits
     int num_in_blocks;     // ceil(u / 64)
     int num_out_blocks;    // ceil(l / 64)
+    uint64_t seed;
+    MatrixGen gen;
+    HashMode requested_mode;
+
+    // flat row-major matrix: rows[i * num_in_blocks + b] = b-th 64-bit block of i-th row
+    std::vector<uint64_t> rows;
+
+    // popcount row loop, specialised on num_in_blocks for the common sizes
+    using RowLoopFn = void (*)(const uint64_t* rows, int l, int num_in_blocks,
+                               const uint64_t* x, uint64_t* y);
+    RowLoopFn rowloop;
+
+    // SIMD row loop over the 8-row interleaved copy of M (see simd_kernels.hpp),
+    // selected from the CPU features at construction; nullptr if scalar
+    using SimdRowLoopFn = void (*)(const uint64_t* rows8, int l, int num_in_blocks,
+                                   const uint64_t* x, uint64_t* y);
+    SimdRowLoopFn simd_rowloop;
+    int simd_level;  // SimdLevel the row loop was chosen for
+    std::vector<uint64_t> rows8;
+
+    void run_rowloop(const uint64_t* x, uint64_t* y) const {
+        if (simd_rowloop) simd_rowloop(rows8.data(), l, num_in_blocks, x, y);
+        else rowloop(rows.data(), l, num_in_blocks, x, y);
+    }
+
+    // column-major copy of M: cols[k * num_out_blocks + ob] = block ob of h(e_k)
+    std::vector<uint64_t> cols;
+    // inputs with at most this many set bits go through the columns (batches
+    // of per-key kernels / of the bit-sliced kernel); 0 disables the sparse path
+    int sparse_max_weight;
+    int sparse_max_weight_batch;
+
+    // bit-sliced kernel: number of input columns combined per XOR table
+    // (chosen at construction), 0 if the per-key row loop is cheaper
+    int slice_bits;
+
+    // table mode: chunk width in bits (8 or 16), 0 if disabled
+    // tables[((c << table_bits) + v) * num_out_blocks + ob] = block ob of h(v << (c * table_bits))
+    int table_bits;
+    std::vector<uint64_t> tables;
+    bool batch_use_table;  // hash_batch: tables rather than the bit-sliced kernel
 
-    // rows[i][b] = b-th 64-bit block of i-th row
-    std::vector<std::vector<uint64_t>> rows;
+    void init(HashMode mode);
+    void build_columns();
+    void build_tables(int bits);
+    bool hash_if_sparse(const uint64_t* x, uint64_t* y, int max_weight) const;
+    void hash_bitsliced64(const uint64_t* xs, size_t n, uint64_t* ys) const;
+    void hash_table(const uint64_t* x, uint64_t* y) const;
 };
 
 #endif
\ No newline at end of file
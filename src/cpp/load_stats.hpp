@@ -0,0 +1,97 @@
+#pragma once
+#include <algorithm>
+#include <cstdint>
+#include <functional>
+#include <queue>
+#include <vector>
+
+// Load distribution of one trial, gathered from the counter after the pass.
+// For Space-Saving the loads are the monitored counts c (upper bounds, with
+// error e: the true load is in [c - e, c]) and the moments come as bounds.
+struct LoadStats {
+    bool exact = true;
+    std::vector<uint64_t> hist;      // hist[j]: buckets of load j (j >= 1), hist[0]: empty
+                                     // buckets (exact counts, l < 64; else 0)
+    std::vector<uint32_t> top;       // the top_n largest loads, descending
+    std::vector<uint32_t> top_err;   // their error e (0 when exact)
+    uint64_t sum_sq_lb = 0;          // bounds on sum_y c_y^2 (equal when exact)
+    uint64_t sum_sq_ub = 0;
+    uint32_t max_lb = 0;             // bounds on the max-load (equal when exact)
+    uint32_t max_ub = 0;
+};
+
+class LoadStatsBuilder {
+public:
+    explicit LoadStatsBuilder(size_t top_n) : top_n_(top_n) {}
+
+    // one non-empty bucket (or monitored key) with count c and error e
+    void add(uint32_t c, uint32_t e = 0) {
+        if (c == 0) return;
+        if (hist_.size() <= c) hist_.resize(size_t(c) + 1, 0);
+        ++hist_[c];
+        ++nonempty_;
+        sum_sq_ += uint64_t(c) * c;
+        const uint64_t lo = c - e;
+        sum_sq_lo_ += lo * lo;
+        sum_lo_ += lo;
+        max_ub_ = std::max(max_ub_, c);
+        max_lb_ = std::max(max_lb_, uint32_t(lo));
+        if (e != 0) exact_ = false;
+        if (top_n_ == 0) return;
+        if (top_.size() < top_n_) {
+            top_.push({c, e});
+        } else if (c > top_.top().first) {
+            top_.pop();
+            top_.push({c, e});
+        }
+    }
+
+    // Space-Saving: keys that are not monitored count at most `bound`
+    void set_unmonitored_bound(uint32_t bound) {
+        unmonitored_ = bound;
+        if (bound != 0) exact_ = false;
+    }
+
+    // l: output bits; m: keys counted (bounds of approximate counters)
+    LoadStats finish(int l, int64_t m) {
+        LoadStats s;
+        s.exact = exact_;
+        s.hist = hist_.empty() ? std::vector<uint64_t>(1, 0) : hist_;
+        if (exact_ && l < 64) s.hist[0] = (uint64_t(1) << l) - nonempty_;
+        s.max_ub = max_ub_;
+        s.max_lb = exact_ ? max_ub_ : max_lb_;
+        if (exact_) {
+            s.sum_sq_lb = s.sum_sq_ub = sum_sq_;
+        } else {
+            // the true counts f >= c - e of the monitored keys and the keys
+            // left out (f <= unmonitored bound) add up to m; f^2 >= f
+            const uint64_t rest = uint64_t(std::max<int64_t>(0, m - int64_t(sum_lo_)));
+            s.sum_sq_lb = sum_sq_lo_ + rest;
+            s.sum_sq_ub = sum_sq_ + uint64_t(unmonitored_) * rest;
+            s.max_ub = std::max(max_ub_, unmonitored_);
+        }
+        while (!top_.empty()) {
+            s.top.push_back(top_.top().first);
+            s.top_err.push_back(top_.top().second);
+            top_.pop();
+        }
+        std::reverse(s.top.begin(), s.top.end());
+        std::reverse(s.top_err.begin(), s.top_err.end());
+        return s;
+    }
+
+private:
+    using Load = std::pair<uint32_t, uint32_t>;  // (c, e)
+
+    size_t top_n_;
+    std::vector<uint64_t> hist_;
+    std::priority_queue<Load, std::vector<Load>, std::greater<Load>> top_;  // min-heap of the top_n
+    uint64_t nonempty_ = 0;
+    uint64_t sum_sq_ = 0;
+    uint64_t sum_sq_lo_ = 0;
+    uint64_t sum_lo_ = 0;
+    uint32_t max_ub_ = 0;
+    uint32_t max_lb_ = 0;
+    uint32_t unmonitored_ = 0;
+    bool exact_ = true;
+};
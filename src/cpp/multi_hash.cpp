@@ -0,0 +1,192 @@
+#include "multi_hash.hpp"
+#include "linear_hash.hpp"
+#include "space_saving.hpp"
+#include "dense_counter.hpp"
+#include "sort_counter.hpp"
+#include "fingerprint.hpp"
+
+#include <algorithm>
+#include <atomic>
+#include <exception>
+#include <memory>
+#include <mutex>
+#include <stdexcept>
+#include <thread>
+
+// Output rows stacked per group: enough to amortise reading x over many
+// trials, while the group's counters and lookup tables stay small.
+static constexpr int kMaxStackedRows = 1024;
+
+// out[0..ceil(len/64)) = bits [start, start + len) of y (total_words long).
+static inline void extract_bits(const uint64_t* y, size_t total_words,
+                                size_t start, int len, uint64_t* out) {
+    const int words = (len + 63) / 64;
+    for (int j = 0; j < words; ++j) {
+        const size_t pos = start + size_t(j) * 64;
+        const size_t w = pos >> 6;
+        const int sh = int(pos & 63);
+        uint64_t v = y[w] >> sh;
+        if (sh != 0 && w + 1 < total_words) v |= y[w + 1] << (64 - sh);
+        out[j] = v;
+    }
+    const int tail = len % 64;
+    if (tail != 0) out[words - 1] &= (~0ULL) >> (64 - tail);
+}
+
+static void offer(SpaceSaving& ss, const uint64_t* y, int OB) { ss.offer(fingerprint64(y, OB)); }
+template <typename C>
+static void offer(DenseCounter<C>& dense, const uint64_t* y, int) { dense.offer(y[0]); }  // l <= 32
+static void offer(SortCounter& sort, const uint64_t* y, int OB) { sort.offer(y, OB); }
+
+// Space-Saving: the max-load lies in [max (c - e), max c]
+static TrialResult result(SpaceSaving& ss) {
+    TrialResult r;
+    const uint32_t ub = ss.max_count();
+    uint32_t lb = 0, err = ub;
+    ss.for_each([&](uint64_t, uint32_t c, uint32_t e) {
+        lb = std::max(lb, c - e);
+        if (c == ub) err = std::min(err, e);
+    });
+    r.max_load = int(ub);
+    r.max_lb = int(lb);
+    r.max_err = int(err);
+    r.exact = lb == ub;
+    return r;
+}
+
+template <typename Counter>
+static TrialResult result(Counter& counter) {
+    TrialResult r;
+    r.max_load = r.max_lb = int(counter.max_count());
+    return r;
+}
+
+// One group: trials [t0, t0 + seeds.size()) share a stacked matrix; make()
+// builds the counter of one trial.
+template <typename Counter, typename Make>
+static void run_group(const uint64_t* S, size_t n, int u, int l,
+                      const std::vector<uint64_t>& seeds, Make&& make, TrialResult* out) {
+    const LinearHash h(l, u, seeds);
+    const int T = int(seeds.size());
+    const int B = h.get_num_in_blocks();
+    const int OBs = h.get_num_out_blocks();   // stacked output
+    const int OB = (l + 63) / 64;             // one trial
+
+    std::vector<std::unique_ptr<Counter>> counters;
+    counters.reserve(size_t(T));
+    for (int t = 0; t < T; ++t) counters.push_back(make());
+
+    // hash a chunk of S for all trials, then feed the chunk to one counter
+    // at a time so its table stays in cache
+    constexpr size_t kChunk = 4096;
+    std::vector<uint64_t> ys(std::min(n, kChunk) * OBs);
+    std::vector<uint64_t> y(OB);
+
+    for (size_t i = 0; i < n; i += kChunk) {
+        const size_t len = std::min(kChunk, n - i);
+        h.hash_batch(S + i * B, len, ys.data());
+        for (int t = 0; t < T; ++t) {
+            for (size_t r = 0; r < len; ++r) {
+                extract_bits(ys.data() + r * OBs, size_t(OBs), size_t(t) * l, l, y.data());
+                offer(*counters[t], y.data(), OB);
+            }
+        }
+    }
+    for (int t = 0; t < T; ++t) {
+        out[t] = result(*counters[t]);
+        out[t].keys = out[t].draws = int64_t(n);
+    }
+}
+
+std::vector<TrialResult> maxload_fixed_S_multi(const uint64_t* S, size_t n,
+                                               int u, int l,
+                                               const std::vector<uint64_t>& seeds_h,
+                                               int k,
+                                               int num_threads,
+                                               CounterMode counter,
+                                               uint64_t mem_budget,
+                                               const std::string& tmp_dir) {
+    if (u <= 0 || l <= 0) throw std::invalid_argument("l and u must be positive");
+    if (counter == CounterMode::Partitioned)
+        throw std::invalid_argument("the partitioned counter needs S regenerated per pass, not a fixed S");
+    if (counter == CounterMode::Dense && l > 32) throw std::invalid_argument("dense counter needs l <= 32");
+    const size_t T = seeds_h.size();
+    std::vector<TrialResult> out(T);
+    if (T == 0) return out;
+    if (counter == CounterMode::SpaceSaving && k <= 0) {
+        for (TrialResult& r : out) r.exact = n == 0;
+        return out;
+    }
+
+    if (num_threads <= 0) num_threads = int(std::thread::hardware_concurrency());
+    if (num_threads <= 0) num_threads = 1;
+    const uint64_t thread_budget = std::max<uint64_t>(1, mem_budget / uint64_t(num_threads));
+
+    // the counter of one trial and its memory; exact counters fill the
+    // thread's budget with as few as one trial per group
+    const bool wide = l < 64 && (uint64_t(n) >> l) >= 64;
+    const uint64_t dense_bytes = l > 32 ? ~uint64_t(0)
+                                        : uint64_t(wide ? DenseCounter<uint16_t>::array_bytes(l)
+                                                        : DenseCounter<uint8_t>::array_bytes(l));
+    if (counter == CounterMode::Auto)
+        counter = dense_bytes <= thread_budget ? CounterMode::Dense : CounterMode::Sort;
+    uint64_t trial_bytes = 0;
+    if (counter == CounterMode::Dense) trial_bytes = dense_bytes;
+    if (counter == CounterMode::Sort) trial_bytes = std::max<uint64_t>(1, SortCounter::in_memory_bytes(int64_t(n)));
+
+    size_t per_group = size_t(std::max(1, kMaxStackedRows / l));
+    if (trial_bytes > 0) per_group = size_t(std::max<uint64_t>(1, std::min<uint64_t>(per_group, thread_budget / trial_bytes)));
+    const uint64_t sort_budget = thread_budget / per_group;
+    const size_t num_groups = (T + per_group - 1) / per_group;
+    num_threads = int(std::min(size_t(num_threads), num_groups));
+
+    auto group = [&](const std::vector<uint64_t>& seeds, TrialResult* res) {
+        switch (counter) {
+            case CounterMode::Dense:
+                if (wide) run_group<DenseCounter<uint16_t>>(S, n, u, l, seeds, [&] {
+                    return std::make_unique<DenseCounter<uint16_t>>(l); }, res);
+                else run_group<DenseCounter<uint8_t>>(S, n, u, l, seeds, [&] {
+                    return std::make_unique<DenseCounter<uint8_t>>(l); }, res);
+                return;
+            case CounterMode::Sort:
+                run_group<SortCounter>(S, n, u, l, seeds, [&] {
+                    return std::make_unique<SortCounter>(l, sort_budget, tmp_dir, int64_t(n)); }, res);
+                return;
+            default:
+                run_group<SpaceSaving>(S, n, u, l, seeds, [&] {
+                    return std::make_unique<SpaceSaving>(size_t(k)); }, res);
+                return;
+        }
+    };
+
+    std::atomic<size_t> next{0};
+    std::exception_ptr error;  // first failure (e.g. bad_alloc), rethrown after join
+    std::mutex error_mutex;
+    auto worker = [&]() {
+        while (true) {
+            const size_t g = next.fetch_add(1);
+            if (g >= num_groups) break;
+            const size_t t0 = g * per_group;
+            const size_t t1 = std::min(T, t0 + per_group);
+            try {
+                std::vector<uint64_t> seeds(seeds_h.begin() + t0, seeds_h.begin() + t1);
+                group(seeds, out.data() + t0);
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(error_mutex);
+                if (!error) error = std::current_exception();
+                next.store(num_groups);  // stop handing out groups
+            }
+        }
+    };
+
+    if (num_threads == 1) {
+        worker();
+    } else {
+        std::vector<std::thread> threads;
+        threads.reserve(size_t(num_threads));
+        for (int t = 0; t < num_threads; ++t) threads.emplace_back(worker);
+        for (auto& th : threads) th.join();
+    }
+    if (error) std::rethrow_exception(error);
+    return out;
+}
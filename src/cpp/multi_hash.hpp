@@ -0,0 +1,33 @@
+#pragma once
+#include "trial_maxload.hpp"
+
+#include <cstddef>
+#include <cstdint>
+#include <string>
+#include <vector>
+
+// Max-load of T hash functions over one fixed set S, in a single sweep of S.
+//
+// The T matrices LinearHash(l, u, seeds_h[t]) are stacked into one (T*l) x u
+// matrix (in groups, see multi_hash.cpp), so each x is read once per group
+// and its T images come out of a single batch kernel call. Image t is fed to
+// the t-th counter, in the order of S, which gives the same result as T
+// separate trials over S.
+//
+// counter, as for run_trial_maxload: Dense (exact, l <= 32), Sort (exact,
+// runs spilled to tmp_dir past their share of mem_budget), SpaceSaving (k
+// counters: max_load is an upper bound, max_lb / max_err / exact as in
+// TrialResult) or Auto (Dense when the arrays fit in mem_budget, else Sort).
+// Groups hold as many trials as their counters' memory allows (at least one).
+//
+// S holds n keys back to back, ceil(u/64) little-endian uint64 blocks each.
+// Groups of trials are spread over num_threads threads (0 = all cores) that
+// share mem_budget bytes.
+std::vector<TrialResult> maxload_fixed_S_multi(const uint64_t* S, size_t n,
+                                               int u, int l,
+                                               const std::vector<uint64_t>& seeds_h,
+                                               int k,
+                                               int num_threads,
+                                               CounterMode counter,
+                                               uint64_t mem_budget,
+                                               const std::string& tmp_dir = "");
@@ -5,30 +5,72 @@
 #include <atomic>
 #include <vector>
 #include <stdexcept>
+#include <algorithm>
+#include <exception>
+#include <mutex>
+#if defined(__unix__) || defined(__APPLE__)
+#include <unistd.h>
+#endif
 
-static std::vector<int> run_trials_parallel(
+// Default memory budget for the counters of all concurrent trials: half of
+// the physical memory (4 GiB if unknown).
+static uint64_t default_mem_budget() {
+#if defined(_SC_PHYS_PAGES) && defined(_SC_PAGESIZE)
+    long pages = sysconf(_SC_PHYS_PAGES);
+    long page = sysconf(_SC_PAGESIZE);
+    if (pages > 0 && page > 0) return uint64_t(pages) * uint64_t(page) / 2;
+#endif
+    return uint64_t(4) << 30;
+}
+
+static std::vector<TrialResult> run_trials_parallel(
     int u, int l, int64_t m,
-    const std::string& dist,
+    const DistSpec& dist,
     const std::vector<uint64_t>& seeds_S,
     const std::vector<uint64_t>& seeds_h,
     int k,
-    int num_threads
+    int num_threads,
+    CounterMode counter = CounterMode::Auto,
+    uint64_t mem_budget = 0,  // bytes shared by all threads, 0 = default_mem_budget()
+    const std::string& tmp_dir = "",
+    int threads_per_trial = 1,  // > 1: num_threads / threads_per_trial trials at a time, each split
+    const std::vector<int>& thresholds = {},  // ascending; stop each trial once they are decided
+    int stats_top_n = -1,  // >= 0: gather each trial's LoadStats with that many top loads
+    bool legacy_rng = false,  // mt19937_64 streams for S and M (TrialConfig::legacy_rng)
+    bool distinct = false     // S as a set of m distinct keys (TrialConfig::distinct)
 ) {
     if (seeds_S.size() != seeds_h.size()) throw std::invalid_argument("seeds size mismatch");
     const size_t T = seeds_S.size();
-    std::vector<int> out(T);
+    std::vector<TrialResult> out(T);
 
     if (num_threads <= 0) num_threads = int(std::thread::hardware_concurrency());
     if (num_threads <= 0) num_threads = 1;
+    if (threads_per_trial < 1) throw std::invalid_argument("threads_per_trial must be >= 1");
+    threads_per_trial = std::min(threads_per_trial, num_threads);
+    num_threads = int(std::max<size_t>(1, std::min(size_t(num_threads / threads_per_trial), T)));
+
+    // each running trial gets an equal share of the budget
+    if (mem_budget == 0) mem_budget = default_mem_budget();
+    const uint64_t trial_budget = mem_budget / uint64_t(num_threads);
 
     std::atomic<size_t> idx{0};
+    std::exception_ptr error;  // first failure (e.g. temp file I/O), rethrown after join
+    std::mutex error_mutex;
 
     auto worker = [&]() {
         while (true) {
             size_t i = idx.fetch_add(1);
             if (i >= T) break;
-            TrialConfig cfg{u, l, m, seeds_S[i], seeds_h[i], k, dist};
-            out[i] = run_trial_maxload(cfg);
+            TrialConfig cfg{u, l, m, seeds_S[i], seeds_h[i], k, dist, counter, trial_budget, tmp_dir,
+                            threads_per_trial, thresholds, stats_top_n >= 0, std::max(stats_top_n, 0),
+                            legacy_rng, distinct};
+            try {
+                out[i] = run_trial_maxload(cfg);
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(error_mutex);
+                if (!error) error = std::current_exception();
+                idx.store(T);  // stop handing out trials
+            }
         }
     };
 
@@ -36,6 +78,7 @@ static std::vector<int> run_trials_parallel(
     threads.reserve(size_t(num_threads));
     for (int t = 0; t < num_threads; ++t) threads.emplace_back(worker);
     for (auto& th : threads) th.join();
+    if (error) std::rethrow_exception(error);
 
     return out;
 }
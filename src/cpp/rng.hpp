@@ -0,0 +1,68 @@
+#pragma once
+#include <cstdint>
+#include <limits>
+
+// SplitMix64 finalizer (Steele et al.): a bijection of uint64 with full avalanche
+static inline uint64_t splitmix64_mix(uint64_t z) {
+    z += 0x9e3779b97f4a7c15ULL;
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    return z ^ (z >> 31);
+}
+
+// Seed derivation: the seed of child i of root (trial i of an experiment,
+// chunk i of a stream, ...). Deeper paths fold it, derive_seed(derive_seed(
+// root, a), b). Same function as derive_seed in src/hashing/linear_f2.py.
+static inline uint64_t derive_seed(uint64_t root, uint64_t i) {
+    return splitmix64_mix(splitmix64_mix(root) ^ i);
+}
+
+// xoshiro256** (Blackman & Vigna): 32 bytes of state, a few cycles per word,
+// period 2^256 - 1. jump() advances the stream by 2^128 words in 256 steps,
+// so stream.jump()^c gives 2^128 non-overlapping substreams. The state is
+// seeded with the SplitMix64 sequence of the seed, as the authors recommend.
+// Meets UniformRandomBitGenerator, a drop-in for std::mt19937_64.
+class Xoshiro256ss {
+public:
+    using result_type = uint64_t;
+
+    explicit Xoshiro256ss(uint64_t seed) {
+        for (int i = 0; i < 4; ++i) s_[i] = splitmix64_mix(seed + uint64_t(i) * 0x9e3779b97f4a7c15ULL);
+    }
+
+    static constexpr result_type min() { return 0; }
+    static constexpr result_type max() { return std::numeric_limits<uint64_t>::max(); }
+
+    result_type operator()() {
+        const uint64_t result = rotl(s_[1] * 5, 7) * 9;
+        const uint64_t t = s_[1] << 17;
+        s_[2] ^= s_[0];
+        s_[3] ^= s_[1];
+        s_[1] ^= s_[2];
+        s_[0] ^= s_[3];
+        s_[2] ^= t;
+        s_[3] = rotl(s_[3], 45);
+        return result;
+    }
+
+    // advance by 2^128 words
+    void jump() {
+        static constexpr uint64_t kJump[4] = {0x180ec6d33cfd0abaULL, 0xd5a61266f0c9392cULL,
+                                              0xa9582618e03fc9aaULL, 0x39abdc4529b1661cULL};
+        uint64_t t[4] = {0, 0, 0, 0};
+        for (uint64_t word : kJump) {
+            for (int b = 0; b < 64; ++b) {
+                if ((word >> b) & 1) {
+                    for (int i = 0; i < 4; ++i) t[i] ^= s_[i];
+                }
+                (*this)();
+            }
+        }
+        for (int i = 0; i < 4; ++i) s_[i] = t[i];
+    }
+
+private:
+    static uint64_t rotl(uint64_t x, int k) { return (x << k) | (x >> (64 - k)); }
+
+    uint64_t s_[4];
+};
@@ -1,20 +1,28 @@
 #pragma once
+#include <algorithm>
+#include <cmath>
 #include <cstdint>
+#include <limits>
 #include <random>
 #include <vector>
 #include <string>
 #include <stdexcept>
 
+// Distribution of the keys x in F2^u, with the parameters of src/hashing/sampling.py
 struct DistSpec {
-    std::string name; // "uniform" / "bernoulli" / ...
-    // 以后可加入参数，比如 p/k/p0/p1
+    std::string name;   // "uniform" / "bernoulli" / "Hamming_weight" / "Markov"
+    double p = 0.5;     // bernoulli: P(bit = 1)
+    int k = 0;          // Hamming_weight: number of ones
+    double p0 = 0.5;    // Markov: P(bit_i = 1 | bit_{i-1} = 1)
+    double p1 = 0.5;    // Markov: P(bit_i = 1 | bit_{i-1} = 0)
 };
 
-// fill x_blocks with u-bit random vector
-inline void sample_uniform_blocks(std::mt19937_64& rng,
-                                 std::vector<uint64_t>& x_blocks,
-                                 int u) {
-    const int B = int(x_blocks.size());
+// fill x_blocks[0..B) with u-bit random vector
+template <typename Rng>
+inline void sample_uniform_blocks(Rng& rng,
+                                  uint64_t* x_blocks,
+                                  int B,
+                                  int u) {
     for (int b = 0; b < B; ++b) x_blocks[b] = rng();
     // mask last block
     const int excess_bits = B * 64 - u;
@@ -24,15 +32,215 @@ inline void sample_uniform_blocks(std::mt19937_64& rng,
     }
 }
 
+// uniform integer in [0, n), n > 0 (Lemire's multiply-shift, unbiased)
+template <typename Rng>
+inline uint64_t uniform_below(Rng& rng, uint64_t n) {
+    unsigned __int128 m = (unsigned __int128)rng() * n;
+    uint64_t low = uint64_t(m);
+    if (low < n) {
+        const uint64_t t = (0 - n) % n;
+        while (low < t) {
+            m = (unsigned __int128)rng() * n;
+            low = uint64_t(m);
+        }
+    }
+    return uint64_t(m >> 64);
+}
+
+// uniform double in (0, 1]
+template <typename Rng>
+inline double uniform_open0(Rng& rng) {
+    return double((rng() >> 11) + 1) * (1.0 / 9007199254740992.0);
+}
+
+// set bits [begin, end) of x
+inline void set_bit_range(uint64_t* x, int begin, int end) {
+    while (begin < end) {
+        const int w = begin >> 6, sh = begin & 63;
+        const int n = std::min(end - begin, 64 - sh);
+        x[w] |= (n == 64 ? ~0ULL : ((uint64_t(1) << n) - 1)) << sh;
+        begin += n;
+    }
+}
+
+// Draws keys of one DistSpec into u-bit blocks, with O(1) random words per
+// 64 bits or per one / run rather than one call per bit:
+//  - bernoulli: p is rounded to 32 binary digits 0.d1 d2 ... d32 and every
+//    word is built from random words r_j, least significant digit first,
+//    as w = d_j ? (w | r_j) : (w & r_j), which makes each bit 1 with
+//    probability p (trailing zero digits cost nothing: p = 1/2 takes one
+//    word, p = 1/4 two); when min(p, 1 - p) * u is small, or below 2^-33
+//    where the rounding would lose it, the few ones (or zeros) are placed
+//    by geometric jumps of the unrounded p instead;
+//  - Hamming_weight: Floyd's selection of k distinct positions (k random
+//    numbers, the vector itself is the set), of the u - k zeros if k > u/2;
+//  - Markov: runs of equal bits with geometric lengths, filled word-wise.
+// The parameters are checked once, by the constructor (std::invalid_argument).
+class BlockSampler {
+public:
+    BlockSampler(const DistSpec& dist, int u) : u_(u), B_((u + 63) / 64) {
+        if (u <= 0) throw std::invalid_argument("u must be positive");
+        if (dist.name == "uniform") {
+            kind_ = Kind::Uniform;
+        } else if (dist.name == "bernoulli") {
+            check_prob(dist.p, "p");
+            kind_ = Kind::Bernoulli;
+            init_bernoulli(dist.p);
+        } else if (dist.name == "Hamming_weight") {
+            if (dist.k < 0 || dist.k > u)
+                throw std::invalid_argument("k must be in [0,u], got k=" + std::to_string(dist.k) +
+                                            ", u=" + std::to_string(u));
+            kind_ = Kind::HammingWeight;
+            k_ = dist.k;
+        } else if (dist.name == "Markov") {
+            check_prob(dist.p0, "p0");
+            check_prob(dist.p1, "p1");
+            kind_ = Kind::Markov;
+            // probability that the next bit repeats the current one
+            stay_[1] = dist.p0;
+            stay_[0] = 1.0 - dist.p1;
+            for (int b = 0; b < 2; ++b) log_stay_[b] = std::log(stay_[b]);
+        } else {
+            throw std::invalid_argument("unsupported dist: " + dist.name);
+        }
+    }
+
+    template <typename Rng>
+    void operator()(Rng& rng, uint64_t* x_blocks) const {
+        switch (kind_) {
+            case Kind::Uniform:
+                sample_uniform_blocks(rng, x_blocks, B_, u_);
+                return;
+            case Kind::Bernoulli:
+                if (sparse_) sample_sparse(rng, x_blocks);
+                else sample_bernoulli_words(rng, x_blocks);
+                return;
+            case Kind::HammingWeight:
+                sample_hamming_weight(rng, x_blocks);
+                return;
+            case Kind::Markov:
+                sample_markov(rng, x_blocks);
+                return;
+        }
+    }
+
+private:
+    enum class Kind { Uniform, Bernoulli, HammingWeight, Markov };
+
+    static void check_prob(double p, const char* name) {
+        if (!(p >= 0.0 && p <= 1.0))
+            throw std::invalid_argument(std::string(name) + " must be in [0,1], got " + std::to_string(p));
+    }
+
+    void init_bernoulli(double p) {
+        const double minority = std::min(p, 1.0 - p);
+        if (minority == 0.0) {
+            fill_ = p == 1.0 ? ~0ULL : 0;
+            return;
+        }
+        // geometric jumps cost about 3 random words per one (or zero);
+        // the word-parallel build ndigits words per block, and cannot
+        // represent a minority below 2^-33 (it rounds to 0 or 1): those go
+        // through the jumps whatever u
+        const uint64_t P = uint64_t(std::llround(std::ldexp(p, 32)));  // p ~ P / 2^32
+        if (P != 0 && (P >> 32) == 0) {
+            const int tz = __builtin_ctzll(P);
+            digits_ = P >> tz;
+            ndigits_ = 32 - tz;
+        }
+        sparse_ = ndigits_ == 0 || 3.0 * minority * u_ < double(ndigits_) * B_;
+        if (sparse_) {
+            sparse_ones_ = p <= 0.5;
+            log_skip_ = std::log1p(-minority);
+        }
+    }
+
+    void mask_last(uint64_t* x) const {
+        const int excess_bits = B_ * 64 - u_;
+        if (excess_bits > 0) x[B_ - 1] &= (~0ULL) >> excess_bits;
+    }
+
+    template <typename Rng>
+    void sample_bernoulli_words(Rng& rng, uint64_t* x) const {
+        for (int b = 0; b < B_; ++b) {
+            uint64_t w = fill_;
+            for (int j = 0; j < ndigits_; ++j) {
+                const uint64_t r = rng();
+                w = ((digits_ >> j) & 1) ? (w | r) : (w & r);
+            }
+            x[b] = w;
+        }
+        mask_last(x);
+    }
+
+    // ones (p <= 1/2) or zeros at geometric gaps of parameter min(p, 1 - p)
+    template <typename Rng>
+    void sample_sparse(Rng& rng, uint64_t* x) const {
+        std::fill(x, x + B_, sparse_ones_ ? 0 : ~0ULL);
+        for (double pos = -1.0;;) {
+            pos += 1.0 + std::floor(std::log(uniform_open0(rng)) / log_skip_);
+            if (!(pos < u_)) break;
+            const int i = int(pos);
+            x[i >> 6] ^= uint64_t(1) << (i & 63);
+        }
+        mask_last(x);
+    }
+
+    template <typename Rng>
+    void sample_hamming_weight(Rng& rng, uint64_t* x) const {
+        // pick the minority: ones when k <= u/2, else the u - k zeros
+        const bool pick_ones = 2 * k_ <= u_;
+        const int n = pick_ones ? k_ : u_ - k_;
+        std::fill(x, x + B_, pick_ones ? 0 : ~0ULL);
+        mask_last(x);
+        auto picked = [&](int i) { return bool((x[i >> 6] >> (i & 63)) & 1) == pick_ones; };
+        auto pick = [&](int i) { x[i >> 6] ^= uint64_t(1) << (i & 63); };
+        // Floyd: for j = u - n .. u - 1, take a random t <= j, or j if t is taken
+        for (int j = u_ - n; j < u_; ++j) {
+            const int t = int(uniform_below(rng, uint64_t(j) + 1));
+            pick(picked(t) ? j : t);
+        }
+    }
+
+    template <typename Rng>
+    void sample_markov(Rng& rng, uint64_t* x) const {
+        std::fill(x, x + B_, 0);
+        int bit = int(rng() >> 63);  // P(bit_0 = 1) = 1/2
+        for (int i = 0; i < u_;) {
+            // the run goes on for `extra` more bits: P(extra >= n) = stay^n
+            int64_t extra;
+            if (stay_[bit] <= 0.0) extra = 0;
+            else if (stay_[bit] >= 1.0) extra = u_;
+            else extra = int64_t(std::min(double(u_), std::floor(std::log(uniform_open0(rng)) / log_stay_[bit])));
+            const int end = int(std::min<int64_t>(u_, i + 1 + extra));
+            if (bit) set_bit_range(x, i, end);
+            i = end;
+            bit ^= 1;
+        }
+    }
+
+    int u_;
+    int B_;
+    Kind kind_ = Kind::Uniform;
+    // bernoulli
+    uint64_t fill_ = 0;
+    uint64_t digits_ = 0;
+    int ndigits_ = 0;
+    bool sparse_ = false;
+    bool sparse_ones_ = true;
+    double log_skip_ = 0.0;
+    // Hamming_weight
+    int k_ = 0;
+    // Markov
+    double stay_[2] = {0.5, 0.5};
+    double log_stay_[2] = {0.0, 0.0};
+};
+
 inline void sample_blocks(std::mt19937_64& rng,
-                          std::vector<uint64_t>& x_blocks,
+                          uint64_t* x_blocks,
+                          int B,
                           int u,
                           const DistSpec& dist) {
-    if (dist.name == "uniform") {
-        sample_uniform_blocks(rng, x_blocks, u);
-        return;
-    }
-    throw std::invalid_argument("unsupported dist: " + dist.name);
+    if (B != (u + 63) / 64) throw std::invalid_argument("B must be ceil(u/64)");
+    BlockSampler(dist, u)(rng, x_blocks);
 }
-
-// TODO : sample_bernoulli, sample_Hamming_weight, sample_Markov
\ No newline at end of file
@@ -0,0 +1,165 @@
+#include "simd_kernels.hpp"
+
+#include <atomic>
+#include <cstdlib>
+#include <cstring>
+#include <stdexcept>
+#include <string>
+
+#if defined(__x86_64__) && (defined(__GNUC__) || defined(__clang__))
+#define FASTHASH_X86_SIMD 1
+#include <immintrin.h>
+#endif
+
+const CpuFeatures& cpu_features() {
+    static const CpuFeatures features = [] {
+        CpuFeatures f{false, false, false, false};
+#ifdef FASTHASH_X86_SIMD
+        __builtin_cpu_init();
+        f.popcnt = __builtin_cpu_supports("popcnt");
+        f.avx2 = __builtin_cpu_supports("avx2");
+        f.avx512f = __builtin_cpu_supports("avx512f");
+        f.avx512vpopcntdq = __builtin_cpu_supports("avx512vpopcntdq");
+#endif
+        return f;
+    }();
+    return features;
+}
+
+bool simd_level_supported(SimdLevel level) {
+    const CpuFeatures& f = cpu_features();
+    switch (level) {
+        case SimdLevel::Scalar: return true;
+        case SimdLevel::AVX2:   return f.avx2 && f.popcnt;
+        case SimdLevel::AVX512: return f.avx512f && f.avx512vpopcntdq;
+    }
+    return false;
+}
+
+const char* simd_level_name(SimdLevel level) {
+    switch (level) {
+        case SimdLevel::Scalar: return "scalar";
+        case SimdLevel::AVX2:   return "avx2";
+        case SimdLevel::AVX512: return "avx512";
+    }
+    return "scalar";
+}
+
+SimdLevel parse_simd_level(const char* name) {
+    const std::string s(name);
+    if (s == "scalar") return SimdLevel::Scalar;
+    if (s == "avx2") return SimdLevel::AVX2;
+    if (s == "avx512") return SimdLevel::AVX512;
+    throw std::invalid_argument("unknown SIMD level '" + s + "' (expected scalar, avx2 or avx512)");
+}
+
+static SimdLevel detect_simd_level() {
+    SimdLevel best = SimdLevel::Scalar;
+    if (simd_level_supported(SimdLevel::AVX2)) best = SimdLevel::AVX2;
+    if (simd_level_supported(SimdLevel::AVX512)) best = SimdLevel::AVX512;
+
+    // FASTHASH_SIMD can only lower the level (e.g. to compare kernels)
+    if (const char* env = std::getenv("FASTHASH_SIMD")) {
+        try {
+            SimdLevel wanted = parse_simd_level(env);
+            if (int(wanted) < int(best)) best = wanted;
+        } catch (const std::invalid_argument&) {
+            // ignore unknown values, keep the detected level
+        }
+    }
+    return best;
+}
+
+static std::atomic<int>& simd_level_slot() {
+    static std::atomic<int> level{int(detect_simd_level())};
+    return level;
+}
+
+SimdLevel active_simd_level() {
+    return SimdLevel(simd_level_slot().load(std::memory_order_relaxed));
+}
+
+void set_simd_level(SimdLevel level) {
+    if (!simd_level_supported(level))
+        throw std::invalid_argument(std::string("SIMD level not supported by this CPU: ") +
+                                    simd_level_name(level));
+    simd_level_slot().store(int(level), std::memory_order_relaxed);
+}
+
+void interleave_rows8(const uint64_t* rows, int l, int num_in_blocks, uint64_t* rows8) {
+    const int groups = (l + 7) / 8;
+    std::memset(rows8, 0, interleaved_rows8_size(l, num_in_blocks) * sizeof(uint64_t));
+    for (int g = 0; g < groups; ++g) {
+        for (int r = 0; r < 8 && g * 8 + r < l; ++r) {
+            const uint64_t* row = rows + size_t(g * 8 + r) * num_in_blocks;
+            for (int b = 0; b < num_in_blocks; ++b) {
+                rows8[(size_t(g) * num_in_blocks + b) * 8 + r] = row[b];
+            }
+        }
+    }
+}
+
+#ifdef FASTHASH_X86_SIMD
+
+// AVX2: two 256-bit accumulators cover the 8 rows of a group, the 8 lane
+// parities are then taken with scalar popcnt.
+__attribute__((target("avx2,popcnt")))
+static void rowloop_avx2(const uint64_t* rows8, int l, int num_in_blocks,
+                         const uint64_t* x, uint64_t* y) {
+    const int groups = (l + 7) / 8;
+    const int num_out_blocks = (l + 63) / 64;
+    for (int ob = 0; ob < num_out_blocks; ++ob) y[ob] = 0ULL;
+
+    alignas(32) uint64_t lanes[8];
+    for (int g = 0; g < groups; ++g) {
+        const uint64_t* base = rows8 + size_t(g) * num_in_blocks * 8;
+        __m256i lo = _mm256_setzero_si256();
+        __m256i hi = _mm256_setzero_si256();
+        for (int b = 0; b < num_in_blocks; ++b) {
+            const __m256i xb = _mm256_set1_epi64x((long long)x[b]);
+            const uint64_t* r = base + size_t(b) * 8;
+            lo = _mm256_xor_si256(lo, _mm256_and_si256(_mm256_loadu_si256((const __m256i*)r), xb));
+            hi = _mm256_xor_si256(hi, _mm256_and_si256(_mm256_loadu_si256((const __m256i*)(r + 4)), xb));
+        }
+        _mm256_store_si256((__m256i*)lanes, lo);
+        _mm256_store_si256((__m256i*)(lanes + 4), hi);
+        uint64_t bits = 0;
+        for (int r = 0; r < 8; ++r) bits |= uint64_t(_mm_popcnt_u64(lanes[r]) & 1) << r;
+        y[g / 8] |= bits << ((g % 8) * 8);
+    }
+}
+
+// AVX-512: VPTERNLOG computes acc ^ (rows & x) in one instruction (imm 0x78),
+// VPOPCNTDQ + VPTESTMQ turn the 8 lanes into 8 parity bits.
+__attribute__((target("avx512f,avx512vpopcntdq")))
+static void rowloop_avx512(const uint64_t* rows8, int l, int num_in_blocks,
+                           const uint64_t* x, uint64_t* y) {
+    const int groups = (l + 7) / 8;
+    const int num_out_blocks = (l + 63) / 64;
+    for (int ob = 0; ob < num_out_blocks; ++ob) y[ob] = 0ULL;
+
+    const __m512i one = _mm512_set1_epi64(1);
+    for (int g = 0; g < groups; ++g) {
+        const uint64_t* base = rows8 + size_t(g) * num_in_blocks * 8;
+        __m512i acc = _mm512_setzero_si512();
+        for (int b = 0; b < num_in_blocks; ++b) {
+            const __m512i xb = _mm512_set1_epi64((long long)x[b]);
+            const __m512i r = _mm512_loadu_si512((const void*)(base + size_t(b) * 8));
+            acc = _mm512_ternarylogic_epi64(acc, r, xb, 0x78);
+        }
+        const __mmask8 parity = _mm512_test_epi64_mask(_mm512_popcnt_epi64(acc), one);
+        y[g / 8] |= uint64_t(parity) << ((g % 8) * 8);
+    }
+}
+
+#endif
+
+InterleavedRowLoopFn interleaved_rowloop(SimdLevel level) {
+#ifdef FASTHASH_X86_SIMD
+    if (level == SimdLevel::AVX512) return rowloop_avx512;
+    if (level == SimdLevel::AVX2) return rowloop_avx2;
+#else
+    (void)level;
+#endif
+    return nullptr;
+}
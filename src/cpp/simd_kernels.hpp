@@ -0,0 +1,46 @@
+#pragma once
+#include <cstdint>
+#include <cstddef>
+
+// Row-parity kernels with run-time dispatch on the CPU features.
+//
+// The vector kernels read M in an 8-row interleaved layout:
+//     rows8[(g * B + b) * 8 + r] = block b of row 8g + r   (rows >= l are zero)
+// so that one 512-bit (or two 256-bit) loads give block b of 8 rows. For every
+// group of 8 rows they accumulate acc ^= rows & broadcast(x[b]) over the B input
+// blocks, and take the parity of each lane once at the end:
+// parity(a) ^ parity(b) = parity(a ^ b).
+
+enum class SimdLevel { Scalar = 0, AVX2 = 1, AVX512 = 2 };
+
+struct CpuFeatures {
+    bool popcnt;
+    bool avx2;
+    bool avx512f;
+    bool avx512vpopcntdq;
+};
+
+// Detected once with CPUID.
+const CpuFeatures& cpu_features();
+
+// Kernel used by LinearHash objects constructed from now on. Defaults to the
+// best level supported by the CPU, lowered by the FASTHASH_SIMD environment
+// variable ("scalar" / "avx2" / "avx512") if set.
+SimdLevel active_simd_level();
+// Throws std::invalid_argument if the CPU does not support the level.
+void set_simd_level(SimdLevel level);
+bool simd_level_supported(SimdLevel level);
+const char* simd_level_name(SimdLevel level);
+SimdLevel parse_simd_level(const char* name);
+
+using InterleavedRowLoopFn = void (*)(const uint64_t* rows8, int l, int num_in_blocks,
+                                      const uint64_t* x, uint64_t* y);
+
+// nullptr for SimdLevel::Scalar
+InterleavedRowLoopFn interleaved_rowloop(SimdLevel level);
+
+// Build the 8-row interleaved copy of a row-major (l, num_in_blocks) matrix.
+void interleave_rows8(const uint64_t* rows, int l, int num_in_blocks, uint64_t* rows8);
+inline size_t interleaved_rows8_size(int l, int num_in_blocks) {
+    return size_t((l + 7) / 8) * 8 * size_t(num_in_blocks);
+}
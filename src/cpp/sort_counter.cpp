@@ -0,0 +1,254 @@
+#include "sort_counter.hpp"
+#include "fingerprint.hpp"
+
+#include <algorithm>
+#include <cstdlib>
+#include <queue>
+#include <stdexcept>
+#include <string>
+#if defined(__unix__) || defined(__APPLE__)
+#include <unistd.h>
+#endif
+
+static inline int key_byte(const Key128& k, int byte) {
+    return byte >= 8 ? int((k.hi >> (8 * (byte - 8))) & 0xFF) : int((k.lo >> (8 * byte)) & 0xFF);
+}
+
+void radix_sort_keys(Key128* a, size_t n, int top_byte)
+{
+    if (n < 64 || top_byte < 0) {
+        std::sort(a, a + n);
+        return;
+    }
+    size_t count[256] = {0};
+    for (size_t i = 0; i < n; ++i) ++count[key_byte(a[i], top_byte)];
+
+    // all keys share this byte: go straight to the next one
+    if (count[key_byte(a[0], top_byte)] == n) {
+        radix_sort_keys(a, n, top_byte - 1);
+        return;
+    }
+
+    size_t head[256], tail[256];
+    size_t pos = 0;
+    for (int d = 0; d < 256; ++d) {
+        head[d] = pos;
+        pos += count[d];
+        tail[d] = pos;
+    }
+    // American flag sort: cycle every key into its bucket
+    for (int d = 0; d < 256; ++d) {
+        while (head[d] < tail[d]) {
+            Key128 v = a[head[d]];
+            int dv = key_byte(v, top_byte);
+            while (dv != d) {
+                std::swap(v, a[head[dv]++]);
+                dv = key_byte(v, top_byte);
+            }
+            a[head[d]++] = v;
+        }
+    }
+    if (top_byte == 0) return;
+    size_t start = 0;
+    for (int d = 0; d < 256; ++d) {
+        if (count[d] > 1) radix_sort_keys(a + start, count[d], top_byte - 1);
+        start += count[d];
+    }
+}
+
+// longest stretch of equal keys in a sorted array; on_run gets every
+// stretch's length
+static uint32_t longest_run(const Key128* a, size_t n, const SortCounter::RunCallback& on_run)
+{
+    uint32_t best = 0, cur = 0;
+    for (size_t i = 0; i < n; ++i) {
+        const bool same = i > 0 && a[i] == a[i - 1];
+        if (!same && cur > 0 && on_run) on_run(cur);
+        cur = same ? cur + 1 : 1;
+        if (cur > best) best = cur;
+    }
+    if (cur > 0 && on_run) on_run(cur);
+    return best;
+}
+
+SortCounter::SortCounter(int l, uint64_t mem_budget, const std::string& tmp_dir, int64_t expected_keys)
+    : top_byte_((std::min(l, 128) - 1) / 8), mem_budget_(mem_budget), tmp_dir_(tmp_dir)
+{
+    if (l <= 0) throw std::invalid_argument("l must be positive");
+    run_capacity_ = size_t(std::max<uint64_t>(mem_budget / sizeof(Key128), 1024));
+    if (expected_keys > 0) run_.reserve(std::min(run_capacity_, size_t(expected_keys)));
+    if (tmp_dir_.empty()) {
+        const char* env = std::getenv("TMPDIR");
+        tmp_dir_ = (env && *env) ? env : "/tmp";
+    }
+}
+
+SortCounter::~SortCounter()
+{
+    for (std::FILE* f : files_) std::fclose(f);
+}
+
+void SortCounter::offer(const uint64_t* y, int n)
+{
+    Key128 k;
+    if (n <= 2) {
+        k.lo = y[0];
+        k.hi = n == 2 ? y[1] : 0;
+    } else {
+        k.lo = fingerprint64(y, n);
+        k.hi = fingerprint64_keyed(y, n, 0xd1b54a32d192ed03ULL);
+    }
+    if (run_.size() == run_capacity_) {
+        spill();
+    } else if (run_.size() == run_.capacity()) {
+        // grow by doubling, but never past the run size of the budget
+        run_.reserve(std::min(run_capacity_, std::max<size_t>(1024, 2 * run_.size())));
+    }
+    run_.push_back(k);
+}
+
+// sort the current run and append it to a new unlinked temp file
+void SortCounter::spill()
+{
+    radix_sort_keys(run_.data(), run_.size(), top_byte_);
+
+    std::string path = tmp_dir_ + "/fasthash_run_XXXXXX";
+    int fd = mkstemp(&path[0]);
+    if (fd < 0) throw std::runtime_error("cannot create temp file in " + tmp_dir_);
+    unlink(path.c_str());  // removed as soon as it is closed
+    std::FILE* f = fdopen(fd, "w+b");
+    if (!f) {
+        close(fd);
+        throw std::runtime_error("cannot open temp file in " + tmp_dir_);
+    }
+    files_.push_back(f);
+    if (std::fwrite(run_.data(), sizeof(Key128), run_.size(), f) != run_.size())
+        throw std::runtime_error("cannot write run to temp file (disk full?)");
+    run_sizes_.push_back(run_.size());
+    run_.clear();
+}
+
+uint32_t SortCounter::max_count(const RunCallback& on_run)
+{
+    if (done_) return max_c_;
+    done_ = true;
+    if (files_.empty()) {
+        radix_sort_keys(run_.data(), run_.size(), top_byte_);
+        max_c_ = longest_run(run_.data(), run_.size(), on_run);
+    } else {
+        if (!run_.empty()) spill();
+        std::vector<Key128>().swap(run_);  // give the run memory to the merge buffers
+        max_c_ = merge_runs(on_run);
+    }
+    return max_c_;
+}
+
+// A sorted run being merged: a spilled run read through a buffer, or an
+// in-memory run (f == nullptr) held entirely in buf.
+struct RunReader {
+    std::FILE* f = nullptr;
+    size_t left = 0;   // keys not yet read from the file
+    size_t buf_keys = 0;
+    std::vector<Key128> buf;
+    size_t pos = 0;
+
+    bool refill() {
+        const size_t n = std::min(buf_keys, left);
+        buf.resize(n);
+        if (n > 0 && std::fread(buf.data(), sizeof(Key128), n, f) != n)
+            throw std::runtime_error("cannot read run from temp file");
+        left -= n;
+        pos = 0;
+        return n > 0;
+    }
+};
+
+// longest stretch of equal keys in the merge of the sorted runs, through a
+// min-heap of run heads; on_run gets every stretch's length
+static uint32_t merge_count(std::vector<RunReader>& readers, const SortCounter::RunCallback& on_run)
+{
+    using Head = std::pair<Key128, size_t>;
+    auto greater = [](const Head& a, const Head& b) { return b.first < a.first; };
+    std::priority_queue<Head, std::vector<Head>, decltype(greater)> heap(greater);
+    for (size_t r = 0; r < readers.size(); ++r) {
+        if (!readers[r].buf.empty()) heap.push({readers[r].buf[0], r});
+    }
+
+    uint32_t best = 0, cur = 0;
+    bool first = true;
+    Key128 prev{0, 0};
+    while (!heap.empty()) {
+        const Head top = heap.top();
+        heap.pop();
+        const bool same = !first && top.first == prev;
+        if (!same && cur > 0 && on_run) on_run(cur);
+        cur = same ? cur + 1 : 1;
+        if (cur > best) best = cur;
+        prev = top.first;
+        first = false;
+
+        RunReader& rd = readers[top.second];
+        if (++rd.pos == rd.buf.size() && !rd.refill()) continue;
+        heap.push({rd.buf[rd.pos], top.second});
+    }
+    if (cur > 0 && on_run) on_run(cur);
+    return best;
+}
+
+// k-way merge of the spilled runs
+uint32_t SortCounter::merge_runs(const RunCallback& on_run)
+{
+    const size_t R = files_.size();
+    const size_t buf_keys = std::max<size_t>(size_t(mem_budget_ / sizeof(Key128) / R), 4096);
+
+    std::vector<RunReader> readers(R);
+    for (size_t r = 0; r < R; ++r) {
+        readers[r].f = files_[r];
+        readers[r].left = run_sizes_[r];
+        readers[r].buf_keys = buf_keys;
+        std::rewind(files_[r]);
+        readers[r].refill();
+    }
+    return merge_count(readers, on_run);
+}
+
+void SortCounter::seal()
+{
+    if (sealed_) return;
+    sealed_ = true;
+    radix_sort_keys(run_.data(), run_.size(), top_byte_);
+}
+
+uint32_t SortCounter::merged_max_count(const std::vector<SortCounter*>& parts, const RunCallback& on_run)
+{
+    size_t num_files = 0;
+    uint64_t file_budget = 0;  // what the parts leave for the merge buffers
+    for (SortCounter* p : parts) {
+        if (p->done_) throw std::logic_error("SortCounter already counted");
+        p->seal();
+        p->done_ = true;
+        num_files += p->files_.size();
+        file_budget += p->mem_budget_ - std::min<uint64_t>(p->mem_budget_, p->run_.size() * sizeof(Key128));
+    }
+    const size_t buf_keys =
+        num_files == 0 ? 0 : std::max<size_t>(size_t(file_budget / sizeof(Key128) / num_files), 4096);
+
+    std::vector<RunReader> readers;
+    for (SortCounter* p : parts) {
+        for (size_t r = 0; r < p->files_.size(); ++r) {
+            RunReader rd;
+            rd.f = p->files_[r];
+            rd.left = p->run_sizes_[r];
+            rd.buf_keys = buf_keys;
+            std::rewind(rd.f);
+            rd.refill();
+            readers.push_back(std::move(rd));
+        }
+        if (!p->run_.empty()) {
+            RunReader rd;
+            rd.buf = std::move(p->run_);  // sorted by seal()
+            readers.push_back(std::move(rd));
+        }
+    }
+    return merge_count(readers, on_run);
+}
@@ -0,0 +1,79 @@
+#pragma once
+#include <cstddef>
+#include <cstdint>
+#include <cstdio>
+#include <functional>
+#include <string>
+#include <vector>
+
+// 128-bit bucket key: h(x) itself when l <= 128, a 128-bit fingerprint of it
+// otherwise (two outputs collide with probability ~2^-128 per pair).
+struct Key128 {
+    uint64_t hi;
+    uint64_t lo;
+    bool operator<(const Key128& o) const { return hi != o.hi ? hi < o.hi : lo < o.lo; }
+    bool operator==(const Key128& o) const { return hi == o.hi && lo == o.lo; }
+    bool operator!=(const Key128& o) const { return !(*this == o); }
+};
+
+// Exact max-load by sorting: keys are appended to a run of fixed size,
+// each full run is radix-sorted in place (MSD, American flag sort). If the
+// stream fits in one run, the max-load is the longest stretch of equal keys
+// in it; otherwise every sorted run is spilled to an unlinked temp file and
+// the runs are k-way merged, counting equal adjacent keys on the fly.
+// Memory: mem_budget bytes for the run (and the merge buffers).
+class SortCounter {
+public:
+    // l: output bits (keys only vary in their low min(l, 128) bits);
+    // tmp_dir: where runs are spilled ("" = $TMPDIR or /tmp);
+    // expected_keys: keys about to be offered, if known (< 0: unknown). The
+    // run starts at min(expected_keys, run size) keys and otherwise doubles
+    // as it fills, so a short stream does not allocate the whole budget.
+    SortCounter(int l, uint64_t mem_budget, const std::string& tmp_dir = "",
+                int64_t expected_keys = -1);
+    ~SortCounter();
+    SortCounter(const SortCounter&) = delete;
+    SortCounter& operator=(const SortCounter&) = delete;
+
+    // y: h(x) as n little-endian blocks
+    void offer(const uint64_t* y, int n);
+
+    // on_run(count) for every distinct key
+    using RunCallback = std::function<void(uint32_t)>;
+
+    // Sorts / merges everything offered so far (first call only, which also
+    // reports every key's count to on_run if given).
+    uint32_t max_count(const RunCallback& on_run = nullptr);
+
+    // Sorts the current run in place, so that several counters filled in
+    // parallel (one per thread) do their sorting in parallel too.
+    void seal();
+
+    // Exact max-load of everything offered to the sealed parts, by a k-way
+    // merge of their in-memory and spilled runs. Consumes the parts.
+    static uint32_t merged_max_count(const std::vector<SortCounter*>& parts,
+                                     const RunCallback& on_run = nullptr);
+
+    size_t num_spilled_runs() const { return files_.size(); }
+
+    // bytes of memory needed to count m keys without spilling
+    static uint64_t in_memory_bytes(int64_t m) { return uint64_t(m) * sizeof(Key128); }
+
+private:
+    void spill();
+    uint32_t merge_runs(const RunCallback& on_run);
+
+    int top_byte_;                 // most significant byte that can differ
+    size_t run_capacity_;          // keys per run
+    uint64_t mem_budget_;
+    std::string tmp_dir_;
+    std::vector<Key128> run_;
+    std::vector<std::FILE*> files_;
+    std::vector<size_t> run_sizes_;
+    bool sealed_ = false;
+    bool done_ = false;
+    uint32_t max_c_ = 0;
+};
+
+// In-place MSD radix sort of keys by bytes top_byte..0 (byte 15 = top of hi).
+void radix_sort_keys(Key128* a, size_t n, int top_byte);
@@ -1,102 +1,251 @@
 #pragma once
 #include <cstdint>
-#include <unordered_map>
 #include <vector>
-#include <queue>
-#include <utility>
 #include <limits>
-#include <algorithm>   // push_heap/pop_heap
+#include <algorithm>
+#include <unordered_map>
 
-// Space-Saving / Frequent algorithm with lazy min-heap
+// Space-Saving / Frequent algorithm on a Stream-Summary (Metwally et al.):
+//  - the k monitored keys live in a fixed entry array;
+//  - entries with the same count are chained in a bucket, and the buckets
+//    form a doubly linked list sorted by count, so the minimum is the head
+//    bucket and an increment moves an entry to the next bucket (or creates
+//    it): O(1) per offer;
+//  - keys are found through a flat open-addressing table (linear probing,
+//    backward-shift deletion), at most half full.
+// The arrays grow with the number of monitored keys and stop at k entries
+// (about 70 bytes per counter), whatever the length of the stream.
 class SpaceSaving {
 public:
-    struct Entry {
-        uint32_t c;   // count estimate
-        uint32_t e;   // error
-        uint32_t ver; // version for lazy heap validity
-    };
-
     explicit SpaceSaving(size_t k) : k_(k) {
-        table_.reserve(k);
-        heap_.reserve(k * 2);
+        buckets_.resize(1);  // slot 0 = none
+        resize_slots(16);
     }
 
     void offer(uint64_t key) {
         if (k_ == 0) return;
 
-        auto it = table_.find(key);
-        if (it != table_.end()) {
-            // increment existing
-            it->second.c += 1;
-            it->second.ver += 1;
-            heap_.push_back(Node{it->second.c, key, it->second.ver});
-            std::push_heap(heap_.begin(), heap_.end(), greaterNode);
-            if (it->second.c > max_c_) max_c_ = it->second.c;
+        size_t pos = find_slot(key);
+        if (slots_[pos].idx != kEmpty) {
+            increment(slots_[pos].idx);
             return;
         }
 
-        if (table_.size() < k_) {
-            // insert new
-            Entry ent{1, 0, 1};
-            table_.emplace(key, ent);
-            heap_.push_back(Node{1, key, 1});
-            std::push_heap(heap_.begin(), heap_.end(), greaterNode);
+        if (size_ < k_) {
+            // insert new with (c=1, e=0)
+            const uint32_t idx = uint32_t(size_++);
+            entries_.push_back(Entry{key, 0, kNone, kNone, kNone});
+            slots_[pos] = Slot{key, idx};
+            if (2 * size_ > slots_.size()) resize_slots(2 * slots_.size());
+            attach_count1(idx);
             if (max_c_ < 1) max_c_ = 1;
             return;
         }
 
-        // table full: replace current min valid
-        auto [cmin, ymin] = pop_min_valid();
-
-        // remove ymin
-        table_.erase(ymin);
-
-        // insert key with c = cmin+1, e = cmin
-        Entry ent{uint32_t(cmin + 1), uint32_t(cmin), 1};
-        table_.emplace(key, ent);
-        heap_.push_back(Node{ent.c, key, ent.ver});
-        std::push_heap(heap_.begin(), heap_.end(), greaterNode);
-        if (ent.c > max_c_) max_c_ = ent.c;
+        // table full: the new key takes over an entry of the minimum bucket,
+        // inheriting c_min as its error, then gets incremented to c_min + 1
+        const uint32_t idx = buckets_[min_bucket_].head - 1;
+        erase_slot(entries_[idx].key);
+        entries_[idx].key = key;
+        entries_[idx].e = buckets_[min_bucket_].c;
+        slots_[find_slot(key)] = Slot{key, idx};
+        increment(idx);
     }
 
     uint32_t max_count() const { return max_c_; }
+    uint32_t min_count() const { return size_ == 0 ? 0 : buckets_[min_bucket_].c; }
+    // bound on the count of a key that is not monitored
+    uint32_t unmonitored_bound() const { return size_ < k_ ? 0 : min_count(); }
+    size_t size() const { return size_; }
+    size_t capacity() const { return k_; }
+
+    // f(key, c, e) for every monitored key
+    template <typename F>
+    void for_each(F&& f) const {
+        for (size_t i = 0; i < size_; ++i) {
+            const Entry& en = entries_[i];
+            f(en.key, buckets_[en.bucket].c, en.e);
+        }
+    }
 
 private:
-    struct Node {
-        uint32_t c;
+    static constexpr uint32_t kNone = 0;  // null bucket / entry link (entries use idx + 1)
+    static constexpr uint32_t kEmpty = std::numeric_limits<uint32_t>::max();
+
+    struct Entry {
         uint64_t key;
-        uint32_t ver;
+        uint32_t e;       // error
+        uint32_t bucket;  // bucket holding this entry
+        uint32_t prev;    // neighbours in the bucket (entry index + 1, 0 = none)
+        uint32_t next;
     };
 
-    static bool greaterNode(const Node& a, const Node& b) {
-        // min-heap behavior using push_heap/pop_heap with "greater" comparator
-        // Actually push_heap/pop_heap expect "less" for max-heap. We invert by comparing (a.c > b.c).
-        // We'll use (a.c > b.c) so the smallest c bubbles to front when used with pop_heap + this comparator.
-        if (a.c != b.c) return a.c > b.c;
-        return a.key > b.key;
+    struct Bucket {
+        uint32_t c;      // count shared by the entries of the bucket
+        uint32_t head;   // first entry (index + 1, 0 = none)
+        uint32_t prev;   // neighbouring buckets by count (0 = none)
+        uint32_t next;
+    };
+
+    struct Slot {
+        uint64_t key;
+        uint32_t idx;    // entry index, kEmpty if the slot is free
+    };
+
+    // --- key index -------------------------------------------------------
+
+    size_t home(uint64_t key) const {
+        return size_t((key * 0x9e3779b97f4a7c15ULL) >> shift_);  // Fibonacci hashing
     }
 
-    std::pair<uint32_t, uint64_t> pop_min_valid() {
-        // pop until valid: node matches current table entry's (c, ver)
-        while (true) {
-            std::pop_heap(heap_.begin(), heap_.end(), greaterNode);
-            Node nd = heap_.back();
-            heap_.pop_back();
-
-            auto it = table_.find(nd.key);
-            if (it != table_.end()) {
-                const Entry& cur = it->second;
-                if (cur.c == nd.c && cur.ver == nd.ver) {
-                    return {nd.c, nd.key};
-                }
+    // (re)build the index with cap slots (a power of two)
+    void resize_slots(size_t cap) {
+        slots_.assign(cap, Slot{0, kEmpty});
+        shift_ = 64 - __builtin_ctzll(cap);
+        for (size_t i = 0; i < size_; ++i) slots_[find_slot(entries_[i].key)] = Slot{entries_[i].key, uint32_t(i)};
+    }
+
+    // slot holding key, or the free slot where it would go
+    size_t find_slot(uint64_t key) const {
+        const size_t mask = slots_.size() - 1;
+        size_t pos = home(key);
+        while (slots_[pos].idx != kEmpty && slots_[pos].key != key) pos = (pos + 1) & mask;
+        return pos;
+    }
+
+    void erase_slot(uint64_t key) {
+        const size_t mask = slots_.size() - 1;
+        size_t hole = find_slot(key);
+        slots_[hole].idx = kEmpty;
+        // shift back the following entries of the cluster that may not stay
+        // behind the hole
+        for (size_t pos = (hole + 1) & mask; slots_[pos].idx != kEmpty; pos = (pos + 1) & mask) {
+            const size_t h = home(slots_[pos].key);
+            const bool stays = (pos > hole) ? (hole < h && h <= pos) : (hole < h || h <= pos);
+            if (!stays) {
+                slots_[hole] = slots_[pos];
+                slots_[pos].idx = kEmpty;
+                hole = pos;
             }
-            // else stale -> continue
         }
     }
 
+    // --- buckets ---------------------------------------------------------
+
+    uint32_t new_bucket(uint32_t c) {
+        uint32_t b = free_bucket_;
+        if (b == kNone) {
+            b = uint32_t(buckets_.size());
+            buckets_.push_back(Bucket{c, kNone, kNone, kNone});
+            return b;
+        }
+        free_bucket_ = buckets_[b].next;
+        buckets_[b] = Bucket{c, kNone, kNone, kNone};
+        return b;
+    }
+
+    void free_bucket(uint32_t b) {
+        const Bucket& bk = buckets_[b];
+        if (bk.prev != kNone) buckets_[bk.prev].next = bk.next;
+        else min_bucket_ = bk.next;
+        if (bk.next != kNone) buckets_[bk.next].prev = bk.prev;
+        buckets_[b].next = free_bucket_;
+        free_bucket_ = b;
+    }
+
+    // link bucket nb right after b (b == kNone: at the head)
+    void link_after(uint32_t b, uint32_t nb) {
+        const uint32_t next = (b == kNone) ? min_bucket_ : buckets_[b].next;
+        buckets_[nb].prev = b;
+        buckets_[nb].next = next;
+        if (next != kNone) buckets_[next].prev = nb;
+        if (b == kNone) min_bucket_ = nb;
+        else buckets_[b].next = nb;
+    }
+
+    void push_entry(uint32_t b, uint32_t idx) {
+        Entry& en = entries_[idx];
+        en.bucket = b;
+        en.prev = kNone;
+        en.next = buckets_[b].head;
+        if (en.next != kNone) entries_[en.next - 1].prev = idx + 1;
+        buckets_[b].head = idx + 1;
+    }
+
+    void unlink_entry(uint32_t idx) {
+        const Entry& en = entries_[idx];
+        if (en.prev != kNone) entries_[en.prev - 1].next = en.next;
+        else buckets_[en.bucket].head = en.next;
+        if (en.next != kNone) entries_[en.next - 1].prev = en.prev;
+    }
+
+    void attach_count1(uint32_t idx) {
+        if (min_bucket_ == kNone || buckets_[min_bucket_].c != 1) link_after(kNone, new_bucket(1));
+        push_entry(min_bucket_, idx);
+    }
+
+    void increment(uint32_t idx) {
+        const uint32_t b = entries_[idx].bucket;
+        const uint32_t c = buckets_[b].c + 1;
+        const uint32_t nb = buckets_[b].next;
+        const bool alone = buckets_[b].head == idx + 1 && entries_[idx].next == kNone;
+
+        if (alone && (nb == kNone || buckets_[nb].c != c)) {
+            buckets_[b].c = c;  // the bucket moves up with its only entry
+        } else {
+            unlink_entry(idx);
+            uint32_t target = nb;
+            if (nb == kNone || buckets_[nb].c != c) {
+                target = new_bucket(c);
+                link_after(b, target);
+            }
+            push_entry(target, idx);
+            if (alone) free_bucket(b);
+        }
+        if (c > max_c_) max_c_ = c;
+    }
+
 private:
     size_t k_;
-    std::unordered_map<uint64_t, Entry> table_;
-    std::vector<Node> heap_;
+    size_t size_ = 0;
+    std::vector<Entry> entries_;
+    std::vector<Bucket> buckets_;
+    std::vector<Slot> slots_;
+    int shift_ = 64;
+    uint32_t free_bucket_ = kNone;
+    uint32_t min_bucket_ = kNone;  // head of the bucket list (smallest count)
     uint32_t max_c_ = 0;
 };
+
+// Merges Space-Saving summaries of disjoint streams (Agarwal et al.): calls
+// f(key, c, e) for every key monitored somewhere, with c the sum over the
+// parts of its count there, or of parts[i]->unmonitored_bound() where it is
+// not monitored, and c - e the sum of its counts minus errors where it is.
+// The true count of the key over all the streams lies in [c - e, c].
+// Returns the bound for a key monitored nowhere.
+template <typename F>
+uint64_t merged_for_each(const std::vector<const SpaceSaving*>& parts, F&& f) {
+    uint64_t base = 0;  // bound for a key monitored nowhere
+    for (const SpaceSaving* p : parts) base += p->unmonitored_bound();
+
+    std::unordered_map<uint64_t, std::pair<uint64_t, uint64_t>> merged;  // key -> (c, c - e)
+    for (const SpaceSaving* p : parts) {
+        const uint64_t b = p->unmonitored_bound();
+        p->for_each([&](uint64_t key, uint32_t c, uint32_t e) {
+            auto& m = merged.emplace(key, std::make_pair(base, uint64_t(0))).first->second;
+            m.first += c - b;
+            m.second += c - e;
+        });
+    }
+    for (const auto& kv : merged) f(kv.first, kv.second.first, kv.second.first - kv.second.second);
+    return base;
+}
+
+// Upper bound on the max count over the union of the streams summarised by
+// parts. Equal to max_count() for a single summary.
+inline uint32_t merged_max_count(const std::vector<const SpaceSaving*>& parts) {
+    uint64_t best = 0;
+    const uint64_t base = merged_for_each(parts, [&](uint64_t, uint64_t c, uint64_t) { best = std::max(best, c); });
+    best = std::max(best, base);
+    return uint32_t(std::min<uint64_t>(best, std::numeric_limits<uint32_t>::max()));
+}
@@ -0,0 +1,163 @@
+#include "structured_sets.hpp"
+#include "space_saving.hpp"
+#include "fingerprint.hpp"
+#include "f2_matrix.hpp"
+
+#include <atomic>
+#include <exception>
+#include <mutex>
+#include <stdexcept>
+#include <thread>
+
+// Gray-code walk of y0 + span(images): element i is y0 ^ XOR of images[j] over
+// the bits j of gray(i) = i ^ (i >> 1); going from i-1 to i flips bit ctz(i).
+static int gray_walk_maxload(std::vector<uint64_t> y,
+                             const std::vector<uint64_t>& images,
+                             int d, int k) {
+    const int OB = int(y.size());
+    SpaceSaving ss(static_cast<size_t>(k));
+    ss.offer(fingerprint64(y.data(), OB));
+    const uint64_t count = uint64_t(1) << d;
+    for (uint64_t i = 1; i < count; ++i) {
+        const uint64_t* img = images.data() + size_t(__builtin_ctzll(i)) * OB;
+        for (int ob = 0; ob < OB; ++ob) y[ob] ^= img[ob];
+        ss.offer(fingerprint64(y.data(), OB));
+    }
+    return int(ss.max_count());
+}
+
+int maxload_affine_subspace(const LinearHash& h,
+                            const std::vector<uint64_t>& x0,
+                            const std::vector<std::vector<uint64_t>>& basis,
+                            int k) {
+    const int B = h.get_num_in_blocks();
+    const int OB = h.get_num_out_blocks();
+    const int d = int(basis.size());
+    if (int(x0.size()) != B) throw std::invalid_argument("x0 size mismatch");
+    if (d > 62) throw std::invalid_argument("subspace dimension must be <= 62");
+    if (k <= 0) return 0;
+
+    std::vector<uint64_t> images(size_t(d) * OB);
+    for (int j = 0; j < d; ++j) {
+        if (int(basis[j].size()) != B) throw std::invalid_argument("basis vector size mismatch");
+        h.hash_into(basis[j].data(), images.data() + size_t(j) * OB);
+    }
+    std::vector<uint64_t> y(OB);
+    h.hash_into(x0.data(), y.data());
+    return gray_walk_maxload(std::move(y), images, d, k);
+}
+
+int maxload_subcube(const LinearHash& h,
+                    const std::vector<uint64_t>& x0,
+                    const std::vector<uint32_t>& free_bits,
+                    int k) {
+    const int B = h.get_num_in_blocks();
+    const int OB = h.get_num_out_blocks();
+    const int d = int(free_bits.size());
+    if (int(x0.size()) != B) throw std::invalid_argument("x0 size mismatch");
+    if (d > 62) throw std::invalid_argument("subcube dimension must be <= 62");
+    if (k <= 0) return 0;
+
+    std::vector<uint64_t> images(size_t(d) * OB);
+    for (int j = 0; j < d; ++j) {
+        h.hash_sparse_into(&free_bits[j], 1, images.data() + size_t(j) * OB);
+    }
+    std::vector<uint64_t> y(OB);
+    h.hash_into(x0.data(), y.data());
+    return gray_walk_maxload(std::move(y), images, d, k);
+}
+
+// Depth-first walk: the node for positions p1 < ... < pw holds
+// y = h(center) ^ col[p1] ^ ... ^ col[pw], one XOR away from its parent.
+static void ball_walk(const LinearHash& h, std::vector<uint64_t>& ys, int OB,
+                      int depth, int radius, uint32_t start, SpaceSaving& ss) {
+    const uint64_t* y = ys.data() + size_t(depth) * OB;
+    ss.offer(fingerprint64(y, OB));
+    if (depth == radius) return;
+    uint64_t* child = ys.data() + size_t(depth + 1) * OB;
+    for (uint32_t p = start; p < uint32_t(h.get_u()); ++p) {
+        h.hash_sparse_into(&p, 1, child);
+        for (int ob = 0; ob < OB; ++ob) child[ob] ^= y[ob];
+        ball_walk(h, ys, OB, depth + 1, radius, p + 1, ss);
+    }
+}
+
+int maxload_hamming_ball(const LinearHash& h,
+                         const std::vector<uint64_t>& center,
+                         int radius,
+                         int k) {
+    const int B = h.get_num_in_blocks();
+    const int OB = h.get_num_out_blocks();
+    if (int(center.size()) != B) throw std::invalid_argument("center size mismatch");
+    if (radius < 0) throw std::invalid_argument("radius must be >= 0");
+    if (k <= 0) return 0;
+    if (radius > h.get_u()) radius = h.get_u();
+
+    std::vector<uint64_t> ys(size_t(radius + 1) * OB);
+    h.hash_into(center.data(), ys.data());
+    SpaceSaving ss(static_cast<size_t>(k));
+    ball_walk(h, ys, OB, 0, radius, 0, ss);
+    return int(ss.max_count());
+}
+
+// rank of the images h(b_j): the rows of (M * basis)^T
+static int image_rank(const LinearHash& h, const std::vector<std::vector<uint64_t>>& basis) {
+    BitMatrix images(int(basis.size()), h.get_l());
+    for (size_t j = 0; j < basis.size(); ++j) h.hash_into(basis[j].data(), images.row(int(j)));
+    return images.eliminate();
+}
+
+static void check_basis(const std::vector<std::vector<uint64_t>>& basis, int u) {
+    const size_t B = size_t(u + 63) / 64;
+    for (const auto& b : basis) {
+        if (b.size() != B) throw std::invalid_argument("basis vector size mismatch");
+    }
+}
+
+int maxload_affine_subspace_exact_log2(const LinearHash& h,
+                                       const std::vector<std::vector<uint64_t>>& basis) {
+    check_basis(basis, h.get_u());
+    const int dim = BitMatrix::from_rows(basis, h.get_u()).rank();
+    return dim - image_rank(h, basis);
+}
+
+std::vector<int> maxload_affine_subspace_exact_log2_trials(
+    int u, int l,
+    const std::vector<std::vector<uint64_t>>& basis,
+    const std::vector<uint64_t>& seeds_h,
+    int num_threads) {
+    if (u <= 0 || l <= 0) throw std::invalid_argument("l and u must be positive");
+    check_basis(basis, u);
+    const int dim = BitMatrix::from_rows(basis, u).rank();
+
+    const size_t T = seeds_h.size();
+    std::vector<int> out(T);
+    if (num_threads <= 0) num_threads = int(std::thread::hardware_concurrency());
+    if (num_threads <= 0) num_threads = 1;
+    num_threads = int(std::max<size_t>(1, std::min(size_t(num_threads), T)));
+
+    std::atomic<size_t> next{0};
+    std::exception_ptr error;  // first failure (e.g. bad_alloc), rethrown after join
+    std::mutex error_mutex;
+    auto worker = [&]() {
+        while (true) {
+            const size_t t = next.fetch_add(1);
+            if (t >= T) break;
+            try {
+                // no lookup tables: only |basis| images are needed
+                const LinearHash h(l, u, seeds_h[t], HashMode::Popcount);
+                out[t] = dim - image_rank(h, basis);
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(error_mutex);
+                if (!error) error = std::current_exception();
+                next.store(T);  // stop handing out trials
+            }
+        }
+    };
+    std::vector<std::thread> threads;
+    threads.reserve(size_t(num_threads));
+    for (int i = 0; i < num_threads; ++i) threads.emplace_back(worker);
+    for (auto& th : threads) th.join();
+    if (error) std::rethrow_exception(error);
+    return out;
+}
@@ -0,0 +1,53 @@
+#pragma once
+#include "linear_hash.hpp"
+
+#include <cstdint>
+#include <vector>
+
+// Max-load of h over structured key sets of F2^u, without materialising S.
+//
+// The sets are walked so that consecutive elements differ by one basis vector
+// (Gray-code order), hence h(x) is updated with a single XOR of a precomputed
+// image: O(ceil(l/64)) per element instead of a full matrix-vector product.
+// Every h(x) goes straight into Space-Saving (k counters), as in a trial.
+//
+// Vectors are little-endian uint64 blocks: ceil(u/64) blocks per x.
+
+// S = x0 + span(basis): 2^d elements (d = basis.size() <= 62), with
+// multiplicity if the basis is not linearly independent.
+int maxload_affine_subspace(const LinearHash& h,
+                            const std::vector<uint64_t>& x0,
+                            const std::vector<std::vector<uint64_t>>& basis,
+                            int k);
+
+// S = {x : x agrees with x0 outside free_bits}: the subspace spanned by the
+// unit vectors e_i, i in free_bits, shifted by x0. Images are columns of M.
+int maxload_subcube(const LinearHash& h,
+                    const std::vector<uint64_t>& x0,
+                    const std::vector<uint32_t>& free_bits,
+                    int k);
+
+// S = {x : dist(x, center) <= radius}: sum_{w<=radius} C(u, w) elements,
+// walked depth-first over the flipped positions (one column XOR per element).
+int maxload_hamming_ball(const LinearHash& h,
+                         const std::vector<uint64_t>& center,
+                         int radius,
+                         int k);
+
+// Exact max-load over the affine subspace S = x0 + span(basis) taken as a set
+// (2^rank(basis) elements), by linear algebra instead of enumeration: h maps
+// S onto an affine subspace of dimension rank(M * basis), and every non-empty
+// bucket holds the same number of keys, so
+//      max-load = 2^(rank(basis) - rank(M * basis))
+// for any x0. Returns the exponent. Both ranks come from BitMatrix::rank;
+// cost O(d * ceil(u/64) * l) for the images plus the eliminations.
+int maxload_affine_subspace_exact_log2(const LinearHash& h,
+                                       const std::vector<std::vector<uint64_t>>& basis);
+
+// Same for the hashes LinearHash(l, u, seeds_h[t]), t = 0..T-1, spread over
+// num_threads threads (0 = all cores). rank(basis) is computed once.
+std::vector<int> maxload_affine_subspace_exact_log2_trials(
+    int u, int l,
+    const std::vector<std::vector<uint64_t>>& basis,
+    const std::vector<uint64_t>& seeds_h,
+    int num_threads);
@@ -1,52 +1,605 @@
 #include "trial_maxload.hpp"
 #include "linear_hash.hpp"
 #include "space_saving.hpp"
+#include "dense_counter.hpp"
+#include "sort_counter.hpp"
 #include "samplers.hpp"
+#include "distinct_keys.hpp"
+#include "rng.hpp"
+#include "fingerprint.hpp"
+#include "load_stats.hpp"
 
 #include <random>
 #include <vector>
+#include <algorithm>
+#include <atomic>
+#include <exception>
+#include <limits>
+#include <memory>
+#include <mutex>
+#include <optional>
 #include <stdexcept>
+#include <thread>
+#include <type_traits>
 
-// 因为SpaceSaving的key类型是uint64_t，但h(x)的输出是l位，当l>64时会跨多个block存储。
-// 需要压缩的根本原因是这两者之间的不匹配：
-//      h(x) 输出: [block0][block1][block2]...  ← l=200时有4个uint64
-//      SpaceSaving.offer(key)                  ← 只接受一个uint64
-// 在之前的python实现中，h(x) 输出: [block0][block1][block2]... 是一串bits，我们可以直接用其表示的整数当key
-// 而这里我们通过fingerprint64，近似实现了: 相同的y产生相同的key，不同的y产生不同的key
-static inline uint64_t fingerprint64(const std::vector<uint64_t>& y) {
-    // 任意长度 uint64 数组 ==> uint64 
-    uint64_t h = 0x9e3779b97f4a7c15ULL;
-    for (uint64_t v : y) {
-        // SplitMix64混淆 --> 让输入的每一个bit都影响输出的所有bit
-        v ^= v >> 30;  // 高位的信息混入低位
-        v *= 0xbf58476d1ce4e5b9ULL;    // v *= 大质数：乘法让每个bit扩散到更高位（进位传播）
-        v ^= v >> 27; v *= 0x94d049bb133111ebULL;
-        v ^= v >> 31;
-        // 把多个64位值合并进一个h，且顺序敏感; 让 h 自身的历史状态参与混合，使得 [a,b] 和 [b,a] 得到不同结果
-        h ^= v + 0x9e3779b97f4a7c15ULL + (h<<6) + (h>>2);
-    }
-    return h;
-}
-
-int run_trial_maxload(const TrialConfig& cfg) {
-    if (cfg.u <= 0 || cfg.l <= 0 || cfg.m < 0) throw std::invalid_argument("bad cfg");
-    if (cfg.k <= 0) return 0;
-
-    LinearHash h(cfg.l, cfg.u, cfg.seed_h);
+// Early termination against TrialConfig::thresholds: every comparison of
+// the final max-load with a threshold is known once the running max reaches
+// the largest one, or once the keys left cannot lift it to the smallest one
+// not reached yet (one key raises the max by at most 1).
+class StopRule {
+public:
+    explicit StopRule(const std::vector<int>& thresholds) : t_(thresholds) {}
 
-    const int B = (cfg.u + 63) / 64;
-    std::vector<uint64_t> x_blocks(B);
+    bool active() const { return !t_.empty(); }
+    bool reached(int64_t max_c) const { return active() && max_c >= t_.back(); }
+    bool decided(int64_t max_c, int64_t left) const {
+        if (!active()) return false;
+        if (max_c >= t_.back()) return true;
+        return max_c + left < *std::upper_bound(t_.begin(), t_.end(), max_c);
+    }
+
+private:
+    std::vector<int> t_;
+};
+
+// keys are sampled and hashed kBatch at a time (batch kernels), then
+// offered in stream order
+static constexpr int64_t kBatch = 64;
+
+struct NoStop {
+    bool operator()(int64_t) const { return false; }
+};
+
+// Key loop specialised on the number of input (BI) and output (BO) blocks;
+// 0 means the size is only known at run time. The buffers are allocated once
+// per call, so the per-key path does no heap allocation. Counter is
+// SpaceSaving (keyed by fingerprint64 of y), DenseCounter / SharedDenseView /
+// PartitionFilter (keyed by y) or SortCounter (keyed by y, or its 128-bit
+// fingerprint if l > 128). stop(n) is asked after each batch of n keys;
+// returns the number of keys offered. seen (cfg.distinct): the keys offered
+// so far, a repeat is drawn again before hashing.
+template <int BI, int BO, typename Rng, typename Counter, typename Stop>
+static int64_t feed_keys(const TrialConfig& cfg, const LinearHash& h,
+                         Rng& rngS, int64_t n_keys, Counter& counter, Stop&& stop,
+                         DistinctKeys* seen = nullptr) {
+    const int B = BI > 0 ? BI : h.get_num_in_blocks();
+    const int OB = BO > 0 ? BO : h.get_num_out_blocks();   // l=500 -> ~8 blocks
+
+    std::vector<uint64_t> xs(size_t(kBatch) * B);
+    std::vector<uint64_t> ys(size_t(kBatch) * OB);
+
+    const BlockSampler sample(cfg.dist, cfg.u);
+
+    for (int64_t i = 0; i < n_keys; i += kBatch) {
+        const int64_t n = std::min(kBatch, n_keys - i);
+        for (int64_t t = 0; t < n; ++t) {
+            sample(rngS, xs.data() + t * B);
+        }
+        if (seen) seen->keep_new(sample, rngS, xs.data(), n);
+        h.hash_batch(xs.data(), size_t(n), ys.data());
+        for (int64_t t = 0; t < n; ++t) {
+            if constexpr (std::is_same<Counter, SpaceSaving>::value) {
+                counter.offer(fingerprint64(ys.data() + t * OB, OB));
+            } else if constexpr (std::is_same<Counter, SortCounter>::value) {
+                counter.offer(ys.data() + t * OB, OB);
+            } else {
+                counter.offer(ys[t]);  // dense (l <= 64): OB == 1
+            }
+        }
+        if (stop(n)) return i + n;
+    }
+    return n_keys;
+}
+
+// S is cut into chunks of kChunkKeys keys, chunk c drawn from its own
+// substream: Xoshiro256ss(seed_S) jumped c times. A thread can start anywhere
+// in S, and S depends on neither the number of threads nor the order in
+// which the chunks are sampled. legacy_rng: the single-threaded S is the one
+// mt19937_64(seed_S) stream, and chunk c of a threaded trial is drawn from
+// mt19937_64(chunk_seed(seed_S, c)).
+static constexpr int64_t kChunkKeys = int64_t(1) << 16;
+
+static uint64_t chunk_seed(uint64_t seed_S, uint64_t c) {
+    return derive_seed(seed_S, c);
+}
+
+// Feeds chunks first, first + step, first + 2 step, ... of S to counter until
+// one is cut short by stop, or halt() is set; returns the number of keys fed.
+template <int BI, int BO, typename Counter, typename Stop, typename Halt>
+static int64_t feed_chunks(const TrialConfig& cfg, const LinearHash& h, Counter& counter, Stop&& stop,
+                           int64_t first, int64_t step, Halt&& halt, DistinctKeys* seen = nullptr) {
+    const int64_t num_chunks = (cfg.m + kChunkKeys - 1) / kChunkKeys;
+    Xoshiro256ss next(cfg.seed_S);  // substream of the next chunk
+    if (!cfg.legacy_rng) {
+        for (int64_t j = 0; j < first; ++j) next.jump();
+    }
+    int64_t fed = 0;
+    for (int64_t c = first; c < num_chunks && !halt(); c += step) {
+        const int64_t len = std::min(kChunkKeys, cfg.m - c * kChunkKeys);
+        int64_t got;
+        if (cfg.legacy_rng) {
+            std::mt19937_64 rng(chunk_seed(cfg.seed_S, uint64_t(c)));
+            got = feed_keys<BI, BO>(cfg, h, rng, len, counter, stop, seen);
+        } else {
+            Xoshiro256ss rng = next;
+            for (int64_t j = 0; j < step; ++j) next.jump();
+            got = feed_keys<BI, BO>(cfg, h, rng, len, counter, stop, seen);
+        }
+        fed += got;
+        if (got < len) break;
+    }
+    return fed;
+}
+
+// One pass over S; floor: max-load already known (earlier passes), which
+// the counter's running max adds to; seen: cfg.distinct, cleared first.
+template <int BI, int BO, typename Counter>
+static int64_t feed_stream(const TrialConfig& cfg, const LinearHash& h, Counter& counter,
+                           const StopRule& rule, DistinctKeys* seen, uint32_t floor = 0) {
+    if (seen) seen->clear();
+    auto feed = [&](auto&& stop) -> int64_t {
+        if (cfg.legacy_rng) {
+            std::mt19937_64 rngS(cfg.seed_S);
+            return feed_keys<BI, BO>(cfg, h, rngS, cfg.m, counter, stop, seen);
+        }
+        return feed_chunks<BI, BO>(cfg, h, counter, stop, 0, 1, [] { return false; }, seen);
+    };
+    if constexpr (std::is_same<Counter, SortCounter>::value) {
+        return feed(NoStop{});  // no running max
+    } else {
+        if (!rule.active()) return feed(NoStop{});
+        int64_t done = 0;
+        return feed([&](int64_t n) {
+            done += n;
+            return rule.decided(std::max(floor, counter.max_count()), cfg.m - done);
+        });
+    }
+}
+
+// Bucket loads of a counter, for the trial's LoadStats.
+template <typename C>
+static void add_loads(const DenseCounter<C>& counter, LoadStatsBuilder& stats) {
+    counter.for_each_count([&](uint32_t c) { stats.add(c); });
+}
+
+template <typename C>
+static void add_loads(const AtomicDenseCounter<C>& counter, LoadStatsBuilder& stats) {
+    counter.for_each_count([&](uint32_t c) { stats.add(c); });
+}
+
+static void add_loads(const SpaceSaving& ss, LoadStatsBuilder& stats) {
+    ss.for_each([&](uint64_t, uint32_t c, uint32_t e) { stats.add(c, e); });
+    stats.set_unmonitored_bound(ss.unmonitored_bound());
+}
+
+// Max-load bounds of a Space-Saving trial (TrialResult::max_lb / max_err /
+// exact): the true max-load lies in [max (c - e), max c], so it is certified
+// when both ends meet, e.g. when the table never filled up.
+static void set_bounds(const SpaceSaving& ss, TrialResult& res) {
+    const uint32_t ub = ss.max_count();
+    uint32_t lb = 0, err = ub;
+    ss.for_each([&](uint64_t, uint32_t c, uint32_t e) {
+        lb = std::max(lb, c - e);
+        if (c == ub) err = std::min(err, e);
+    });
+    res.max_lb = int(lb);
+    res.max_err = int(err);
+    res.exact = lb == ub;
+}
+
+// The set of S's keys for cfg.distinct (none otherwise).
+static std::optional<DistinctKeys> distinct_keys(const TrialConfig& cfg) {
+    if (!cfg.distinct) return std::nullopt;
+    return DistinctKeys(cfg.u, cfg.m);
+}
+
+static void set_dedup(const std::optional<DistinctKeys>& seen, TrialResult& res) {
+    if (!seen) return;
+    res.draws = int64_t(seen->draws());
+    res.duplicates = int64_t(seen->duplicates());
+    res.dedup_seconds = seen->seconds();
+}
+
+static SortCounter::RunCallback run_callback(LoadStatsBuilder* stats) {
+    if (!stats) return nullptr;
+    return [stats](uint32_t c) { stats->add(c); };
+}
+
+// Single-threaded trial: one pass over S.
+template <int BI, int BO, typename Counter>
+static TrialResult trial_loop(const TrialConfig& cfg, const LinearHash& h, Counter& counter,
+                              LoadStatsBuilder* stats) {
+    const StopRule rule(cfg.thresholds);
+    std::optional<DistinctKeys> seen = distinct_keys(cfg);
+    TrialResult res;
+    res.keys = feed_stream<BI, BO>(cfg, h, counter, rule, seen ? &*seen : nullptr);
+    set_dedup(seen, res);
+    if constexpr (std::is_same<Counter, SortCounter>::value) {
+        res.max_load = int(counter.max_count(run_callback(stats)));
+    } else {
+        res.max_load = int(counter.max_count());
+        if (stats) add_loads(counter, *stats);
+    }
+    if constexpr (std::is_same<Counter, SpaceSaving>::value) set_bounds(counter, res);
+    res.stopped = res.keys < cfg.m;
+    return res;
+}
+
+// Threaded trial: the chunks of S are shared out between the threads.
+static int num_trial_threads(const TrialConfig& cfg) {
+    const int64_t num_chunks = (cfg.m + kChunkKeys - 1) / kChunkKeys;
+    return int(std::max<int64_t>(1, std::min<int64_t>(cfg.threads, num_chunks)));
+}
+
+// Thread t feeds chunks t, t + T, t + 2T, ... to *parts[t] (T = parts.size())
+// and returns the number of keys fed. With an active rule the threads stop
+// together once it decides on the max of floor and the parts' running
+// maxima; keys_bound: whether the keys left bound the growth of that max
+// (true for a shared dense counter, not for merged Space-Saving summaries).
+template <int BI, int BO, typename Counter>
+static int64_t threaded_feed(const TrialConfig& cfg, const LinearHash& h,
+                             const std::vector<std::unique_ptr<Counter>>& parts,
+                             const StopRule& rule, bool keys_bound, uint32_t floor = 0) {
+    const int64_t T = int64_t(parts.size());
+    std::exception_ptr error;  // first failure, rethrown after join
+    std::mutex error_mutex;
+
+    std::atomic<int64_t> fed{0};
+    std::atomic<int64_t> done{0};  // keys of the batches offered so far, over all threads
+    std::atomic<uint32_t> max_c{floor};
+    std::atomic<bool> stop{false};
+    const int64_t unbounded = std::numeric_limits<int32_t>::max();
+
+    auto worker = [&](int64_t t) {
+        Counter& counter = *parts[t];
+        auto check = [&](int64_t n) {
+            const int64_t d = done.fetch_add(n, std::memory_order_relaxed) + n;
+            const uint32_t c = counter.max_count();
+            uint32_t cur = max_c.load(std::memory_order_relaxed);
+            while (c > cur && !max_c.compare_exchange_weak(cur, c, std::memory_order_relaxed)) {}
+            if (stop.load(std::memory_order_relaxed)) return true;
+            if (rule.decided(std::max(c, cur), keys_bound ? cfg.m - d : unbounded)) {
+                stop.store(true, std::memory_order_relaxed);
+                return true;
+            }
+            return false;
+        };
+        try {
+            auto halt = [&] { return stop.load(std::memory_order_relaxed); };
+            int64_t local;
+            if constexpr (std::is_same<Counter, SortCounter>::value) {
+                local = feed_chunks<BI, BO>(cfg, h, counter, NoStop{}, t, T, halt);
+            } else {
+                local = rule.active() ? feed_chunks<BI, BO>(cfg, h, counter, check, t, T, halt)
+                                      : feed_chunks<BI, BO>(cfg, h, counter, NoStop{}, t, T, halt);
+            }
+            fed.fetch_add(local);
+            if constexpr (std::is_same<Counter, SortCounter>::value) counter.seal();
+        } catch (...) {
+            std::lock_guard<std::mutex> lock(error_mutex);
+            if (!error) error = std::current_exception();
+        }
+    };
+
+    std::vector<std::thread> threads;
+    threads.reserve(size_t(T));
+    for (int64_t t = 0; t < T; ++t) threads.emplace_back(worker, t);
+    for (auto& th : threads) th.join();
+    if (error) std::rethrow_exception(error);
+    return fed.load();
+}
+
+// One pass of the output-partitioned count: only the keys whose top
+// part_bits bits equal `part` reach the dense counter (DenseCounter or
+// SharedDenseView), indexed by the remaining l - part_bits low bits.
+template <typename Inner>
+class PartitionFilter {
+public:
+    PartitionFilter(Inner& counter, int l, int part_bits, uint64_t part)
+        : counter_(counter), shift_(l - part_bits), part_(part),
+          mask_(shift_ >= 64 ? ~0ULL : (uint64_t(1) << shift_) - 1) {}
+
+    void offer(uint64_t y) {
+        if ((y >> shift_) == part_) counter_.offer(y & mask_);
+    }
+    uint32_t max_count() const { return counter_.max_count(); }
+
+private:
+    Inner& counter_;
+    int shift_;
+    uint64_t part_;
+    uint64_t mask_;
+};
+
+enum class CounterKind { SpaceSaving, Dense8, Dense16, Sort, Partitioned };
+
+struct CounterPlan {
+    CounterKind kind;
+    bool wide = false;   // dense / partitioned: uint16 rather than uint8 counters
+    int part_bits = 0;   // partitioned: 2^part_bits passes over S
+};
+
+// Auto never plans more passes than this (each pass re-samples and re-hashes S)
+static constexpr int kMaxAutoPartBits = 4;
+
+// Dense counters are uint8 unless the mean load m / 2^l is high enough that
+// many buckets would spill past 255.
+static CounterPlan choose_counter(const TrialConfig& cfg) {
+    if (cfg.counter == CounterMode::SpaceSaving) return {CounterKind::SpaceSaving};
+    if (cfg.counter == CounterMode::Sort) return {CounterKind::Sort};
+
+    const bool wide = (cfg.l < 64) && (cfg.m >> cfg.l) >= 64;
+    auto dense_bytes = [&](int bits) {
+        return bits > 40 ? ~uint64_t(0)
+                         : uint64_t(wide ? DenseCounter<uint16_t>::array_bytes(bits)
+                                         : DenseCounter<uint8_t>::array_bytes(bits));
+    };
+
+    if (cfg.counter == CounterMode::Dense) {
+        if (cfg.l > 32) throw std::invalid_argument("dense counter needs l <= 32");
+        return {wide ? CounterKind::Dense16 : CounterKind::Dense8, wide};
+    }
+    if (cfg.counter == CounterMode::Partitioned) {
+        if (cfg.l > 64) throw std::invalid_argument("partitioned counter needs l <= 64");
+        int b = 0;
+        while (b < cfg.l && dense_bytes(cfg.l - b) > cfg.mem_budget) ++b;
+        return {CounterKind::Partitioned, wide, b};
+    }
+
+    // Auto: dense, then an in-memory sort, then a few dense passes
+    if (cfg.l <= 32 && dense_bytes(cfg.l) <= cfg.mem_budget)
+        return {wide ? CounterKind::Dense16 : CounterKind::Dense8, wide};
+    if (SortCounter::in_memory_bytes(cfg.m) <= cfg.mem_budget) return {CounterKind::Sort};
+    if (cfg.l <= 64) {
+        for (int b = 1; b <= kMaxAutoPartBits && b < cfg.l; ++b) {
+            if (dense_bytes(cfg.l - b) <= cfg.mem_budget) return {CounterKind::Partitioned, wide, b};
+        }
+    }
+    return {CounterKind::SpaceSaving};
+}
+
+// cfg.distinct: the set of S's keys is paid for out of mem_budget, and the
+// counters get the rest
+static TrialConfig counter_config(const TrialConfig& cfg) {
+    if (!cfg.distinct) return cfg;
+    const uint64_t set_bytes = DistinctKeys::bytes_for(cfg.m);
+    if (set_bytes > cfg.mem_budget)
+        throw std::invalid_argument("distinct keys need " + std::to_string(set_bytes) +
+                                    " bytes, over mem_budget = " + std::to_string(cfg.mem_budget));
+    TrialConfig c = cfg;
+    c.mem_budget -= set_bytes;
+    return c;
+}
+
+const char* trial_counter_name(const TrialConfig& trial) {
+    switch (choose_counter(counter_config(trial)).kind) {
+        case CounterKind::Dense8:      return "dense8";
+        case CounterKind::Dense16:     return "dense16";
+        case CounterKind::Sort:        return "sort";
+        case CounterKind::Partitioned: return "partitioned";
+        default:                       return "space_saving";
+    }
+}
+
+// Max over the 2^part_bits passes; S is regenerated from seed_S each time.
+// The trial ends early once the largest threshold is reached; a pass ends
+// early once its buckets cannot reach the smallest threshold not reached.
+template <int BI, int BO, typename C>
+static TrialResult run_partitioned(const TrialConfig& cfg, const LinearHash& h, int part_bits,
+                                   LoadStatsBuilder* stats) {
+    const StopRule rule(cfg.thresholds);
+    // one array for all the passes: a fresh calloc would fault its pages in
+    // again on every pass
+    DenseCounter<C> dense(cfg.l - part_bits, /*reusable=*/true);
+    std::optional<DistinctKeys> seen = distinct_keys(cfg);
+    TrialResult res;
+    for (uint64_t p = 0; p < (uint64_t(1) << part_bits) && !rule.reached(res.max_load); ++p) {
+        if (p > 0) dense.clear();
+        PartitionFilter<DenseCounter<C>> counter(dense, cfg.l, part_bits, p);
+        res.keys += feed_stream<BI, BO>(cfg, h, counter, rule, seen ? &*seen : nullptr,
+                                        uint32_t(res.max_load));
+        res.max_load = std::max(res.max_load, int(counter.max_count()));
+        if (stats) add_loads(dense, *stats);
+    }
+    set_dedup(seen, res);
+    res.stopped = res.keys < (cfg.m << part_bits);
+    return res;
+}
+
+// Threaded dense count (part_bits > 0: partitioned) in one shared array.
+template <int BI, int BO, typename C>
+static TrialResult run_shared_dense(const TrialConfig& cfg, const LinearHash& h, int part_bits,
+                                    LoadStatsBuilder* stats) {
+    const StopRule rule(cfg.thresholds);
+    const int T = num_trial_threads(cfg);
+    AtomicDenseCounter<C> shared(cfg.l - part_bits);
+    TrialResult res;
+    for (uint64_t p = 0; p < (uint64_t(1) << part_bits) && !rule.reached(res.max_load); ++p) {
+        if (p > 0) shared.clear();
+        std::vector<std::unique_ptr<SharedDenseView<C>>> views;
+        std::vector<std::unique_ptr<PartitionFilter<SharedDenseView<C>>>> parts;
+        for (int t = 0; t < T; ++t) {
+            views.push_back(std::make_unique<SharedDenseView<C>>(shared));
+            parts.push_back(std::make_unique<PartitionFilter<SharedDenseView<C>>>(*views.back(), cfg.l,
+                                                                                  part_bits, p));
+        }
+        res.keys += threaded_feed<BI, BO>(cfg, h, parts, rule, /*keys_bound=*/true, uint32_t(res.max_load));
+        for (const auto& v : views) res.max_load = std::max(res.max_load, int(v->max_count()));
+        if (stats) add_loads(shared, *stats);
+    }
+    res.stopped = res.keys < (cfg.m << part_bits);
+    return res;
+}
+
+// Trial split across cfg.threads threads: the dense counters are shared, the
+// sort runs and Space-Saving summaries are per thread and merged at the end.
+template <int BI, int BO>
+static TrialResult run_threaded(const TrialConfig& cfg, const LinearHash& h, const CounterPlan& plan,
+                                LoadStatsBuilder* stats) {
+    const StopRule rule(cfg.thresholds);
+    const int T = num_trial_threads(cfg);
+    TrialResult res;
+    switch (plan.kind) {
+        case CounterKind::Dense8:
+        case CounterKind::Dense16:
+        case CounterKind::Partitioned:
+            return plan.wide ? run_shared_dense<BI, BO, uint16_t>(cfg, h, plan.part_bits, stats)
+                             : run_shared_dense<BI, BO, uint8_t>(cfg, h, plan.part_bits, stats);
+        case CounterKind::Sort: {
+            std::vector<std::unique_ptr<SortCounter>> parts;
+            for (int t = 0; t < T; ++t)
+                parts.push_back(std::make_unique<SortCounter>(cfg.l, cfg.mem_budget / uint64_t(T), cfg.tmp_dir));
+            res.keys = threaded_feed<BI, BO>(cfg, h, parts, rule, false);
+            std::vector<SortCounter*> ptrs;
+            for (const auto& p : parts) ptrs.push_back(p.get());
+            res.max_load = int(SortCounter::merged_max_count(ptrs, run_callback(stats)));
+            break;
+        }
+        default: {
+            if (cfg.k <= 0) {
+                res.exact = cfg.m == 0;
+                return res;
+            }
+            std::vector<std::unique_ptr<SpaceSaving>> parts;
+            for (int t = 0; t < T; ++t) parts.push_back(std::make_unique<SpaceSaving>(size_t(cfg.k)));
+            // the merged bound is at least every part's max, but may jump by
+            // more than 1 per key: only the largest threshold stops early
+            res.keys = threaded_feed<BI, BO>(cfg, h, parts, rule, /*keys_bound=*/false);
+            std::vector<const SpaceSaving*> ptrs;
+            for (const auto& p : parts) ptrs.push_back(p.get());
+            // bounds as in set_bounds(), on the merged summary
+            uint64_t best = 0, best_err = 0, lb = 0;
+            const uint64_t base = merged_for_each(ptrs, [&](uint64_t, uint64_t c, uint64_t e) {
+                if (c > best || (c == best && e < best_err)) {
+                    best = c;
+                    best_err = e;
+                }
+                lb = std::max(lb, c - e);
+                if (stats) stats->add(uint32_t(c), uint32_t(e));
+            });
+            if (base > best) {
+                best = base;      // a key monitored nowhere
+                best_err = base;
+            }
+            if (stats) stats->set_unmonitored_bound(uint32_t(base));
+            res.max_load = int(best);
+            res.max_lb = int(lb);
+            res.max_err = int(best_err);
+            res.exact = lb == best;
+            break;
+        }
+    }
+    res.stopped = res.keys < cfg.m;
+    return res;
+}
+
+template <int BI, int BO>
+static TrialResult run_with_counter(const TrialConfig& cfg, const LinearHash& h, LoadStatsBuilder* stats) {
+    const CounterPlan plan = choose_counter(cfg);
+    if (cfg.threads > 1 && !cfg.distinct) return run_threaded<BI, BO>(cfg, h, plan, stats);
+    switch (plan.kind) {
+        case CounterKind::Dense8: {
+            DenseCounter<uint8_t> counter(cfg.l);
+            return trial_loop<BI, BO>(cfg, h, counter, stats);
+        }
+        case CounterKind::Dense16: {
+            DenseCounter<uint16_t> counter(cfg.l);
+            return trial_loop<BI, BO>(cfg, h, counter, stats);
+        }
+        case CounterKind::Sort: {
+            SortCounter counter(cfg.l, cfg.mem_budget, cfg.tmp_dir, cfg.m);
+            return trial_loop<BI, BO>(cfg, h, counter, stats);
+        }
+        case CounterKind::Partitioned:
+            return plan.wide ? run_partitioned<BI, BO, uint16_t>(cfg, h, plan.part_bits, stats)
+                             : run_partitioned<BI, BO, uint8_t>(cfg, h, plan.part_bits, stats);
+        default: {
+            if (cfg.k <= 0) {
+                TrialResult res;
+                res.exact = cfg.m == 0;
+                return res;
+            }
+            SpaceSaving ss(size_t(cfg.k));
+            return trial_loop<BI, BO>(cfg, h, ss, stats);
+        }
+    }
+}
 
-    std::mt19937_64 rngS(cfg.seed_S);
-    DistSpec dist{cfg.dist};
+template <int BI>
+static TrialResult dispatch_out_blocks(const TrialConfig& cfg, const LinearHash& h, LoadStatsBuilder* stats) {
+    switch (h.get_num_out_blocks()) {
+        case 1: return run_with_counter<BI, 1>(cfg, h, stats);
+        case 2: return run_with_counter<BI, 2>(cfg, h, stats);
+        case 4: return run_with_counter<BI, 4>(cfg, h, stats);
+        case 8: return run_with_counter<BI, 8>(cfg, h, stats);
+        default: return run_with_counter<BI, 0>(cfg, h, stats);
+    }
+}
+
+static TrialResult dispatch_in_blocks(const TrialConfig& cfg, const LinearHash& h, LoadStatsBuilder* stats) {
+    switch (h.get_num_in_blocks()) {
+        case 1:  return dispatch_out_blocks<1>(cfg, h, stats);
+        case 2:  return dispatch_out_blocks<2>(cfg, h, stats);
+        case 4:  return dispatch_out_blocks<4>(cfg, h, stats);
+        case 8:  return dispatch_out_blocks<8>(cfg, h, stats);
+        case 16: return dispatch_out_blocks<16>(cfg, h, stats);
+        case 47: return dispatch_out_blocks<47>(cfg, h, stats);  // u = 3000
+        default: return dispatch_out_blocks<0>(cfg, h, stats);
+    }
+}
+
+TrialResult run_trial_maxload(const TrialConfig& trial) {
+    if (trial.u <= 0 || trial.l <= 0 || trial.m < 0) throw std::invalid_argument("bad cfg");
+    if (!std::is_sorted(trial.thresholds.begin(), trial.thresholds.end()))
+        throw std::invalid_argument("thresholds must be in ascending order");
+    if (trial.top_n < 0) throw std::invalid_argument("top_n must be >= 0");
+    BlockSampler(trial.dist, trial.u);  // validate before building the matrix
+    const TrialConfig cfg = counter_config(trial);
+    choose_counter(cfg);
 
-    SpaceSaving ss(size_t(cfg.k));
+    std::optional<LoadStatsBuilder> stats;
+    if (cfg.stats) stats.emplace(size_t(cfg.top_n));
 
-    for (int64_t i = 0; i < cfg.m; ++i) {
-        sample_blocks(rngS, x_blocks, cfg.u, dist);
-        auto y_blocks = h.hash(x_blocks);          // l=500 -> ~8 blocks
-        uint64_t key = fingerprint64(y_blocks);
-        ss.offer(key);
+    // m keys cannot reach the smallest threshold: nothing to count
+    const StopRule rule(cfg.thresholds);
+    TrialResult res;
+    if (rule.decided(0, cfg.m)) {
+        res.stopped = cfg.m > 0;
+    } else {
+        LinearHash h(cfg.l, cfg.u, cfg.seed_h, HashMode::Auto,
+                     cfg.legacy_rng ? MatrixGen::Sequential : MatrixGen::Counter);
+        res = dispatch_in_blocks(cfg, h, stats ? &*stats : nullptr);
+    }
+    if (res.exact) res.max_lb = res.max_load;
+    if (!cfg.distinct) res.draws = res.keys;
+    res.reached = rule.reached(res.max_load);
+    if (stats) res.stats = stats->finish(cfg.l, res.keys);
+    return res;
+}
+
+void sample_trial_keys(const TrialConfig& cfg, int64_t n, uint64_t* out) {
+    const BlockSampler sample(cfg.dist, cfg.u);
+    const int B = (cfg.u + 63) / 64;
+    std::optional<DistinctKeys> seen;
+    if (cfg.distinct) seen.emplace(cfg.u, n);
+    // keys [begin, end) from rng, in the batches of feed_keys (a repeat is
+    // drawn again after its batch)
+    auto draw = [&](auto& rng, int64_t begin, int64_t end) {
+        for (int64_t i = begin; i < end; i += kBatch) {
+            const int64_t len = std::min(kBatch, end - i);
+            for (int64_t t = 0; t < len; ++t) sample(rng, out + (i + t) * B);
+            if (seen) seen->keep_new(sample, rng, out + i * B, len);
+        }
+    };
+    if (cfg.legacy_rng) {
+        std::mt19937_64 rng(cfg.seed_S);
+        draw(rng, 0, n);
+        return;
+    }
+    Xoshiro256ss next(cfg.seed_S);
+    for (int64_t c0 = 0; c0 < n; c0 += kChunkKeys) {
+        Xoshiro256ss rng = next;
+        next.jump();
+        draw(rng, c0, std::min(n, c0 + kChunkKeys));
     }
-    return int(ss.max_count());
 }
@@ -1,6 +1,25 @@
 #pragma once
+#include "load_stats.hpp"
+#include "samplers.hpp"
+
 #include <cstdint>
+#include <optional>
 #include <string>
+#include <vector>
+
+// How the bucket loads of a trial are counted:
+//  - SpaceSaving: k counters, approximate (upper bound on the max-load)
+//  - Dense:       one compact counter per bucket (l <= 32), exact
+//  - Sort:        keys sorted in runs of mem_budget bytes, spilled to temp
+//                 files and merged if they do not fit, exact (any l)
+//  - Partitioned: P = 2^b passes over S regenerated from seed_S; pass p
+//                 counts exactly, in a dense array of 2^l / P counters, the
+//                 keys whose top b bits of h(x) equal p (l <= 64); the
+//                 smallest P whose array fits in mem_budget is used
+//  - Auto:        Dense when its array fits in mem_budget, else Sort when the
+//                 m keys fit in mem_budget, else Partitioned with at most 16
+//                 passes, else SpaceSaving
+enum class CounterMode { Auto, Dense, SpaceSaving, Sort, Partitioned };
 
 struct TrialConfig {
     int u;
@@ -9,7 +28,58 @@ struct TrialConfig {
     uint64_t seed_S;
     uint64_t seed_h;
     int k;
-    std::string dist; // "uniform"
+    DistSpec dist;  // distribution of S, with its parameters
+    CounterMode counter = CounterMode::Auto;
+    uint64_t mem_budget = uint64_t(1) << 30;  // bytes available to this trial's counters
+    std::string tmp_dir;                      // Sort spills ("" = $TMPDIR or /tmp)
+    // threads sharing this trial's stream: S is drawn in chunks of 2^16
+    // keys, chunk c from Xoshiro256ss(seed_S) jumped c times, so S is the
+    // same for any number of threads
+    int threads = 1;
+    // ascending max-load thresholds of interest (empty: count the whole of
+    // S); the trial stops once max-load >= T is decided for every T
+    std::vector<int> thresholds;
+    // also gather the trial's LoadStats, with its top_n largest loads
+    bool stats = false;
+    int top_n = 0;
+    // the generators used before xoshiro256**, for continuity with older
+    // results: S from one mt19937_64(seed_S) stream (threads > 1: chunk c
+    // from mt19937_64(derive_seed(seed_S, c)), another S) and M from
+    // mt19937_64(seed_h) (MatrixGen::Sequential; else MatrixGen::Counter)
+    bool legacy_rng = false;
+    // S as a set: every key drawn again is replaced by a fresh draw, until m
+    // distinct keys (DistinctKeys, u <= 128 exact, else 128-bit fingerprints,
+    // taken out of mem_budget). Which repeats get replaced depends on all the
+    // keys drawn before, so S is drawn by one thread (threads is ignored)
+    bool distinct = false;
+};
+
+// Outcome of one trial. With thresholds, counting stops as soon as the
+// running max reaches the largest threshold, or the keys left cannot lift it
+// to the smallest threshold not reached yet (Sort counts to the end); then
+// max_load is only a lower bound, but compares to every threshold as the
+// full count would.
+struct TrialResult {
+    int max_load = 0;      // Space-Saving: an upper bound, max c
+    int max_lb = 0;        // lower bound on the max-load (max of c - e for Space-Saving)
+    int max_err = 0;       // Space-Saving: error e of the bucket holding max_load
+    bool exact = true;     // max_load is exact: exact counter, or max_lb == max_load
+    int64_t keys = 0;      // keys of S counted (over all the passes)
+    bool stopped = false;  // counting stopped before the end of S
+    bool reached = false;  // max_load >= thresholds.back()
+    int64_t draws = 0;     // keys sampled; distinct: with the repeats drawn again
+    int64_t duplicates = 0;      // distinct: repeats dropped
+    double dedup_seconds = 0.0;  // distinct: time spent on the set and the redraws
+    std::optional<LoadStats> stats;  // cfg.stats: loads of the keys counted
 };
 
-int run_trial_maxload(const TrialConfig& cfg);
+TrialResult run_trial_maxload(const TrialConfig& cfg);
+
+// Counter the trial will use ("dense8", "dense16", "sort", "partitioned" or
+// "space_saving"); throws std::invalid_argument if Dense is forced with
+// l > 32, or Partitioned with l > 64.
+const char* trial_counter_name(const TrialConfig& cfg);
+
+// The first n keys of the trial's S (cfg.dist, cfg.seed_S, cfg.legacy_rng,
+// cfg.distinct), written to out as n rows of ceil(u/64) blocks.
+void sample_trial_keys(const TrialConfig& cfg, int64_t n, uint64_t* out);
@@ -31,8 +31,30 @@
 
 from __future__ import annotations
 
-from typing import Dict, Iterable, Iterator, Tuple, Any, List
+from collections import Counter
+from typing import Dict, Iterable, Iterator, Tuple, Any, List, Optional, Callable
+import bisect
 import heapq
+import itertools
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional: exact counting falls back to a dict
+    np = None
+
+
+def _decided(thresholds: List[int], max_c: int, left: Optional[int]) -> bool:
+    """
+    Toutes les comparaisons max-load >= T (thresholds triés) sont-elles connues ?
+    Oui dès que max_c atteint le plus grand seuil, ou quand les left clés restantes
+    (None : inconnu) ne peuvent plus porter max_c au plus petit seuil non atteint
+    (une clé augmente le max d'au plus 1).
+    """
+    if max_c >= thresholds[-1]:
+        return True
+    if left is None:
+        return False
+    return max_c + left < thresholds[bisect.bisect_right(thresholds, max_c)]
 
 
 def _chunked(iterable: Iterable[int], chunk_size: int) -> Iterator[List[int]]:
@@ -46,18 +68,133 @@ def _chunked(iterable: Iterable[int], chunk_size: int) -> Iterator[List[int]]:
     if buf:
         yield buf
 
+
+def _is_blocks(S: Any) -> bool:
+    """S est-il un tableau numpy (N, ceil(u/64)) de clés empaquetées ?"""
+    return np is not None and isinstance(S, np.ndarray) and S.ndim == 2
+
+
+def _row_to_int(row: Any) -> int:
+    """Ligne de blocs uint64 (petit-boutiste) -> int."""
+    return int.from_bytes(np.asarray(row, dtype="<u8").tobytes(), "little")
+
+
+class _ExactCounter:
+    """
+    Comptage exact des bacs, par chunk de sorties y:
+      - "dense"  : tableau de 2^l compteurs uint32 (np.bincount / np.unique par chunk);
+      - "sorted" : clés et compteurs triés (uint64, l <= 64), fusionnés par np.unique;
+                   les chunks sont mis en attente et fusionnés quand ils pèsent autant
+                   que le tableau courant (coût amorti O(N log N));
+      - "dict"   : collections.Counter (l > 64 ou sans numpy).
+    add() renvoie False dès que la mémoire estimée dépasse mem_budget (octets).
+    """
+
+    # octets par clé distincte, temporaires de fusion compris
+    _SORTED_BYTES = 48
+    _DICT_BYTES = 120
+
+    def __init__(self, l: int, mem_budget: int) -> None:
+        self.l = l
+        self.mem_budget = mem_budget
+        self._max = 0  # max courant (exact sauf en "sorted" avec des chunks en attente)
+        if np is not None and l <= 64 and 4 * (1 << l) <= mem_budget:
+            self.mode = "dense"
+            self.counts = np.zeros(1 << l, dtype=np.uint32)
+        elif np is not None and l <= 64:
+            self.mode = "sorted"
+            self.keys = np.zeros(0, dtype=np.uint64)
+            self.vals = np.zeros(0, dtype=np.int64)
+            self.pending: List[Tuple[Any, Any]] = []
+            self.pending_len = 0
+        else:
+            self.mode = "dict"
+            self.counter: Counter = Counter()
+
+    def add(self, ys) -> bool:
+        if self.mode == "dict":
+            keys = [int(y) for y in ys]
+            self.counter.update(keys)
+            self._max = max([self._max] + [self.counter[y] for y in keys])
+            return len(self.counter) * self._DICT_BYTES <= self.mem_budget
+
+        arr = np.asarray(ys, dtype=np.uint64)
+        if self.mode == "dense":
+            if len(self.counts) <= 4 * len(arr):
+                self.counts += np.bincount(arr.astype(np.int64), minlength=len(self.counts)).astype(np.uint32)
+                self._max = int(self.counts.max())
+            elif len(arr):
+                uk, uc = np.unique(arr, return_counts=True)
+                self.counts[uk] += uc.astype(np.uint32)
+                self._max = max(self._max, int(self.counts[uk].max()))
+            return True
+
+        uk, uc = np.unique(arr, return_counts=True)
+        self.pending.append((uk, uc))
+        self.pending_len += len(uk)
+        if self.pending_len >= max(len(self.keys), 1 << 16):
+            self._flush()
+        return (len(self.keys) + self.pending_len) * self._SORTED_BYTES <= self.mem_budget
+
+    def _flush(self) -> None:
+        if not self.pending:
+            return
+        all_k = np.concatenate([self.keys] + [k for k, _ in self.pending])
+        all_c = np.concatenate([self.vals] + [c.astype(np.int64) for _, c in self.pending])
+        self.keys, inv = np.unique(all_k, return_inverse=True)
+        self.vals = np.zeros(len(self.keys), dtype=np.int64)
+        np.add.at(self.vals, inv.reshape(-1), all_c)
+        self.pending = []
+        self.pending_len = 0
+        self._max = int(self.vals.max()) if len(self.vals) else 0
+
+    def running_max(self) -> Optional[int]:
+        """Max courant s'il est connu sans fusion (None en "sorted" avec des chunks en attente)."""
+        if self.mode == "sorted" and self.pending:
+            return None
+        return self._max
+
+    def max(self) -> int:
+        if self.mode == "dict":
+            return max(self.counter.values(), default=0)
+        if self.mode == "dense":
+            return int(self.counts.max()) if len(self.counts) else 0
+        self._flush()
+        return int(self.vals.max()) if len(self.vals) else 0
+
+    def top(self, k: int) -> List[Tuple[int, int]]:
+        """Les k bacs les plus chargés, [(y, c)] par c décroissant."""
+        if self.mode == "dict":
+            return self.counter.most_common(k)
+        if self.mode == "dense":
+            keys = np.flatnonzero(self.counts)
+            vals = self.counts[keys]
+        else:
+            self._flush()
+            keys, vals = self.keys, self.vals
+        if len(keys) > k:
+            sel = np.argpartition(vals, len(vals) - k)[len(vals) - k:]
+            keys, vals = keys[sel], vals[sel]
+        order = np.argsort(vals, kind="stable")[::-1]
+        return [(int(y), int(c)) for y, c in zip(keys[order].tolist(), vals[order].tolist())]
+
+
 """
  把 “精确统计 2^l 个桶的计数” 换成 “只追踪最可能成为最大桶的少数候选桶”，用的是经典的 Space-Saving / Frequent algorithm(重频项近似) 
 
  思路：当 l 很大（桶数 2^l 爆炸）时，我们不再维护完整的 counts, 而是维护一个大小为 k 的候选表 table,并用最小堆在满员时“踢掉”当前估计最小的桶。
     这非常契合项目里“l 很大导致运算/内存不可承受”的痛点：项目要求是评估 max-load(最大桶负载) 的行为, 而不是必须输出每个桶的精确计数分布。
     该方案就是把 max-load 的估计做成 流式(single pass)、内存 O(k)
+
+ 只要内存放得下（桶数组或不同的 y），max_load 先走精确计数（按 chunk 用 numpy 聚合），
+ 超出 mem_budget 时才把已有计数的前 k 个交给 Space-Saving 继续处理剩下的流。
 """
 class Maxload:
     """
     M(S,h) = max_y |{x in S : h(x)=y}|
     - h : objet avec une méthode h(x:int)->int;
-        optionally method h_many(xs:list[int])->list[int] for batch hashing
+        optionally method h_many(xs:list[int])->list[int] for batch hashing,
+        and h_many_blocks(xs_blocks) for keys packed in uint64 arrays
     """
 
     def __init__(self, u: int, l: int, h: Any) -> None:
@@ -65,31 +202,142 @@ class Maxload:
         self.l = l
         self.h = h
 
+    def _hashed_chunks(self, S: Iterable[Any], chunk_size: int) -> Iterator[Any]:
+        """
+        Sorties h(x) de S, par chunk (h_many si disponible).
+        S peut aussi être un tableau (N, ceil(u/64)) uint64 de clés empaquetées, ou un
+        itérable de tels tableaux (sampling.iter_samples_batch, un chunk par tableau) :
+        ils passent par h.h_many_blocks, sans entiers Python.
+        """
+        if _is_blocks(S):
+            S = [S[i:i + chunk_size] for i in range(0, len(S), chunk_size)]  # type: ignore[index, arg-type]
+        else:
+            it = iter(S)
+            first = next(it, None)
+            if first is None:
+                return
+            S = itertools.chain([first], it)
+            if not _is_blocks(first):
+                yield from self._hashed_int_chunks(S, chunk_size)
+                return
+        for xs_blocks in S:
+            yield self._hash_blocks(xs_blocks)
+
+    def _hashed_int_chunks(self, S: Iterable[int], chunk_size: int) -> Iterator[List[int]]:
+        h_many = getattr(self.h, "h_many", None)
+        for xs_chunk in _chunked(S, chunk_size):
+            if callable(h_many):
+                yield h_many(xs_chunk)  # type: ignore[misc]
+            else:
+                yield [self.h.h(x) for x in xs_chunk]
+
+    def _hash_blocks(self, xs_blocks: Any) -> Any:
+        """(N, ceil(u/64)) uint64 -> sorties (tableau numpy si l <= 64, sinon liste d'int)."""
+        h_many_blocks = getattr(self.h, "h_many_blocks", None)
+        if callable(h_many_blocks):
+            ys = h_many_blocks(xs_blocks)
+            if ys.ndim == 1:
+                return ys
+            return [_row_to_int(row) for row in ys]
+        xs = [_row_to_int(row) for row in xs_blocks]
+        return next(self._hashed_int_chunks(xs, max(len(xs), 1)), [])
+
     def max_load(
-        self, S: Iterable[int], k: int = 50_000, *, chunk_size: int = 16_384,
-    ) -> Tuple[int, Dict[int, Tuple[int, int]]]:
+        self, S: Iterable[Any], k: int = 50_000, *, chunk_size: int = 16_384,
+        exact: Optional[bool] = None, mem_budget: int = 1 << 30,
+        thresholds: Optional[Iterable[int]] = None, details: bool = False,
+    ) -> Tuple[Any, ...]:
         """
-        Space-Saving + min-heap (tas min) avec suppression paresseuse (lazy deletion).
+        Comptage exact tant qu'il tient dans mem_budget (octets), sinon Space-Saving.
+        S : des int de u bits, un tableau (N, ceil(u/64)) uint64 ou un itérable de tels
+            tableaux (sampling.get_samples_batch / iter_samples_batch), haché par blocs.
         chunk_size = 8192 / 16384 / 32768 ...
             固定 u/l/k, 跑 4096/8192/16384/32768/65536, 看 wall time, 选最小的那个
 
+        exact:
+          - None  : exact tant que la mémoire le permet; au dépassement, les k plus gros
+                    compteurs deviennent la table Space-Saving initiale (e=0) et le reste
+                    du flux passe par Space-Saving;
+          - True  : exact uniquement (MemoryError si mem_budget est dépassé);
+          - False : Space-Saving seul.
+
+        thresholds: seuils T de max-load qui nous intéressent. Le comptage s'arrête (entre
+          deux chunks) dès que max-load >= T est tranché pour tous les T : le plus grand est
+          atteint, ou (si len(S) est connu) les clés restantes ne suffisent plus pour le
+          prochain. Le max-load renvoyé n'est alors qu'une borne inférieure, mais se compare
+          à chaque T comme le comptage complet.
+
+        Retour:
+          - max-load exact, ou ub_tracked (max des c parmi les y suivis) après repli
+          - snapshot: {y: (c, e)} (au plus k bacs; e = 0 pour les comptages exacts)
+          - si details: {"keys": clés comptées, "stopped": arrêt anticipé,
+                         "reached": plus grand seuil atteint}
+        """
+        ts = sorted(set(thresholds)) if thresholds else []
+        total = len(S) if ts and hasattr(S, "__len__") else None  # type: ignore[arg-type]
+        info = {"keys": 0, "stopped": False, "reached": False}
+
+        def finish(ml: int, snap: Dict[int, Tuple[int, int]]) -> Tuple[Any, ...]:
+            info["reached"] = bool(ts) and ml >= ts[-1]
+            return (ml, snap, info) if details else (ml, snap)
+
+        def stop(max_c: int) -> bool:
+            if not ts:
+                return False
+            left = None if total is None else total - info["keys"]
+            if _decided(ts, max_c, left):
+                info["stopped"] = left != 0
+                return True
+            return False
+
+        if k <= 0 or (total is not None and stop(0)):
+            return finish(0, {})
+
+        def counted(chunks: Iterator[List[int]]) -> Iterator[List[int]]:
+            for ys_chunk in chunks:
+                info["keys"] += len(ys_chunk)
+                yield ys_chunk
+
+        chunks = counted(self._hashed_chunks(S, chunk_size))
+        if exact is False:
+            return finish(*self._space_saving(chunks, k, stop=stop))
+
+        counter = _ExactCounter(self.l, mem_budget)
+        for ys_chunk in chunks:
+            if not counter.add(ys_chunk):
+                if exact:
+                    raise MemoryError(f"exact counting needs more than mem_budget={mem_budget} bytes")
+                return finish(*self._space_saving(chunks, k, seed=counter.top(k), stop=stop))
+            mc = counter.running_max()
+            if mc is not None and stop(mc):
+                break
+
+        return finish(counter.max(), {y: (c, 0) for y, c in counter.top(k)})
+
+    def _space_saving(
+        self, chunks: Iterable[List[int]], k: int, seed: Optional[List[Tuple[int, int]]] = None,
+        stop: Optional[Callable[[int], bool]] = None,
+    ) -> Tuple[int, Dict[int, Tuple[int, int]]]:
+        """
+        Space-Saving + min-heap (tas min) avec suppression paresseuse (lazy deletion).
+        seed: comptages exacts [(y, c)] (au plus k) qui initialisent la table avec e = 0.
+        stop(max_c): appelé après chaque chunk avec le max courant des c; True arrête le flux.
+
         On maintient:
           - table[y] = (c, e) : c = compteur, e = erreur
           - heap contient des tuples (c, y) et peut contenir des entrées obsolètes.
             Une entrée (c,y) est valide ssi y est encore dans table ET table[y].c == c.
 
         Complexité (amortie): O(N log k).
-
-        Retour:
-          - ub_tracked: max des c parmi les y suivis (borne sup parmi candidats)
-          - snapshot: {y: (c, e)}
         """
-        if k <= 0:
-            return 0, {}
-
         table: Dict[int, Tuple[int, int]] = {}   # y -> (c, e)
         heap: List[Tuple[int, int]] = []         # (c, y) (lazy)
 
+        for y, c in seed or ():
+            table[y] = (c, 0)
+            heap.append((c, y))
+        heapq.heapify(heap)
+
         def push_state(y: int) -> None:
             """Empile l'état courant de y."""
             c, _e = table[y]
@@ -130,21 +378,18 @@ class Maxload:
             table[y] = (c_min + 1, c_min)
             push_state(y)
 
-        # --- hash stream generation (single vs batch) ---
-        h_many = getattr(self.h, "h_many", None)
-        use_batch = callable(h_many)
-
-        if use_batch:
-            # Batch path: iterate S in chunks, call h_many once per chunk
-            for xs_chunk in _chunked(S, chunk_size):
-                ys_chunk = h_many(xs_chunk)  # type: ignore[misc]
-                for y in ys_chunk:
-                    process_y(int(y))
-        else:
-            # Single path
-            for x in S:
-                y = self.h.h(x)
+        ub_tracked = max((c for c, _e in table.values()), default=0)
+        for ys_chunk in chunks:
+            for y in ys_chunk:
                 process_y(int(y))
+            if stop is not None:
+                # le max ne peut venir que d'un y du chunk encore suivi
+                for y in ys_chunk:
+                    cur = table.get(int(y))
+                    if cur is not None and cur[0] > ub_tracked:
+                        ub_tracked = cur[0]
+                if stop(ub_tracked):
+                    break
 
         ub_tracked = 0
         for c, _e in table.values():
@@ -2,11 +2,12 @@ import math
 import random
 import time
 from src.hashing import sampling
-from src.hashing.linear_f2 import hash_f2
+from src.hashing.linear_f2 import derive_seed, hash_f2, pack_ints_to_u64_array
 from src.experiments.maxload import Maxload
-import matplotlib.pyplot as plt
-
-import fasthash
+try:
+    import fasthash
+except ImportError:  # pure-Python fallback
+    fasthash = None
 
 #r * logn/loglogn
 def threshold(l: int, r: float) -> int:
@@ -14,36 +15,100 @@ def threshold(l: int, r: float) -> int:
     return math.ceil(r * math.log(n) / math.log(math.log(n)))
 
 
-def make_S(m: int, u: int, rng: random.Random, dist: str, **params) -> list[int]:
-    # m -> number of s
-    return [sampling.get_sample_x(u=u, rng=rng, dist=dist, **params) for _ in range(m)]
+def make_S(m: int, u: int, rng: random.Random, dist: str, *, distinct: bool = False,
+           legacy_rng: bool = False, dedup_stats: dict | None = None, **params) -> list[int]:
+    # m -> number of s; distinct: S as a set, every repeat is drawn again
+    # legacy_rng: bernoulli / Markov bit by bit, the S of older versions for the same rng
+    if distinct:
+        return list(sampling.iter_distinct_samples(u, m, dist, rng, dedup_stats=dedup_stats,
+                                                   legacy_rng=legacy_rng, **params))
+    return [sampling.get_sample_x(u=u, rng=rng, dist=dist, legacy_rng=legacy_rng, **params) for _ in range(m)]
 
-def make_S_iter(m: int, u: int, seed: int, dist: str, **params):
+def make_S_iter(m: int, u: int, seed: int, dist: str, *, distinct: bool = False,
+                legacy_rng: bool = False, dedup_stats: dict | None = None, **params):
     rng = random.Random(seed)
+    if distinct:
+        yield from sampling.iter_distinct_samples(u, m, dist, rng, dedup_stats=dedup_stats,
+                                                  legacy_rng=legacy_rng, **params)
+        return
     for _ in range(m):
-        yield sampling.get_sample_x(u=u, rng=rng, dist=dist, **params)
+        yield sampling.get_sample_x(u=u, rng=rng, dist=dist, legacy_rng=legacy_rng, **params)
+
+def dedup_report(stats: dict) -> str:
+    return (f"dedup: {stats['duplicates']} repeats in {stats['draws']} draws, "
+            f"{stats['dedup_seconds']:.2f}s")
 
 
 # for trails h, calculate the number of probability exceed threshold.
 def estimate_prob_fixed_S(S: list[int], u: int, l: int, r: float, trials: int, seed: int = 0) -> float:
+    """
+    The trials share S: their matrices are stacked and S is swept once for all
+    of them (fasthash.maxload_fixed_S_multi, exact counter) instead of once per
+    trial. S may also be given already packed, as an (m, ceil(u/64)) uint64 array.
+    Without fasthash, one Maxload per trial (exact while it fits in memory).
+    """
     rng = random.Random(seed)
     T = threshold(l, r)
-    exceed = 0.0
-
-    for _ in range(trials):
-        h = hash_f2(l=l, u=u, seed=rng.randrange(1 << 30))
-        # ml = Maxload(u=u, l=l, h=h).max_load(S)
-        # ml, _ = Maxload(u=u, l=l, h=h).max_load(S, k=50_000)
-        ml, _ = Maxload(u=u, l=l, h=h).max_load(S, k=50_000, chunk_size=16384)
+    seeds_h = [rng.randrange(1 << 30) for _ in range(trials)]
 
+    if fasthash is not None:
+        S_blocks = S if hasattr(S, "shape") else pack_ints_to_u64_array(S, u)
+        maxloads = fasthash.maxload_fixed_S_multi(S_blocks, u, l, seeds_h, counter="auto")
+    else:
+        maxloads = [Maxload(u=u, l=l, h=hash_f2(l=l, u=u, seed=s, has_cpp=False))
+                    .max_load(S, k=50_000, chunk_size=16384)[0] for s in seeds_h]
 
+    exceed = sum(1.0 for ml in maxloads if ml >= T)
+    return exceed / trials
 
-        if ml >= T:
-            exceed += 1.0
+def run_trials_certified(u: int, l: int, m: int, dist: str, seeds_S: list[int], seeds_h: list[int],
+                         thresholds: list[int], *, k: int = 50_000, num_threads: int = 10,
+                         counter: str = "auto", mem_budget: int = 0, dist_params: dict | None = None,
+                         legacy_rng: bool = False, distinct: bool = False,
+                         dedup_stats: dict | None = None) -> tuple[list[int], int]:
+    """
+    Max-loads of the trials (fasthash.run_trials_maxload), with every comparison to a
+    threshold certified: a Space-Saving trial whose bounds [max_lb, max_load] straddle a
+    threshold is rerun with counter="auto" in the same mem_budget (same seeds, hence the
+    same S and h): fewer trials run at once, so each gets a larger share and usually an
+    exact counter; one still undecided is rerun with the sort counter, which spills to
+    disk. mem_budget: bytes for all concurrent trials (0 = half the RAM). dist_params:
+    parameters of dist (p, k, p0, p1 as in sampling.get_sample_x), drawn by the C++
+    samplers. legacy_rng: the mt19937_64 streams of older versions for S and M. distinct:
+    S as a set of m distinct keys; dedup_stats (a dict) then receives the draws, duplicates
+    and dedup_seconds summed over the first run's trials.
+    Returns (max-loads, number of trials rerun).
+    """
+    def run(idx: list[int], counter: str) -> list[dict]:
+        return fasthash.run_trials_maxload(u, l, m, dist, [seeds_S[i] for i in idx], [seeds_h[i] for i in idx],
+                                           k=k, num_threads=num_threads, counter=counter,
+                                           mem_budget=mem_budget, thresholds=thresholds, details=True,
+                                           dist_params=dist_params or {}, legacy_rng=legacy_rng,
+                                           distinct=distinct)
+
+    def undecided(r: dict) -> bool:
+        return any(r["max_lb"] < T <= r["max_load"] for T in thresholds)
+
+    res = run(list(range(len(seeds_S))), counter)
+    if distinct and dedup_stats is not None:
+        for key in ("draws", "duplicates", "dedup_seconds"):
+            dedup_stats[key] = sum(r[key] for r in res)
+    mls = [r["max_load"] for r in res]
+    redo = [i for i, r in enumerate(res) if undecided(r)]
+    todo = redo
+    for rerun_counter in ("auto", "sort"):
+        if not todo:
+            break
+        rerun = run(todo, rerun_counter)
+        for i, r in zip(todo, rerun):
+            mls[i] = r["max_load"]
+        todo = [i for i, r in zip(todo, rerun) if undecided(r)]
+    return mls, len(redo)
 
-    return exceed / trials
 
 def plot_profile_over_l(results, r_values):
+    import matplotlib.pyplot as plt  # only the plots need matplotlib
+
     plt.figure(figsize=(7, 5))
 
     
@@ -73,6 +138,8 @@ def plot_profile_over_l(results, r_values):
 
 
 def plot_tail_probability(r_values, probs):
+    import matplotlib.pyplot as plt  # only the plots need matplotlib
+
     theory = [1 / (r * r) for r in r_values]
 
     plt.figure()
@@ -98,6 +165,8 @@ def run_experiment_grid(
     dist: str,
     dist_params: dict,
     seed: int = 0,
+    distinct: bool = False,
+    legacy_rng: bool = False,
 ):
     """
     - u_values: groupe of u
@@ -105,6 +174,10 @@ def run_experiment_grid(
     - r_values: groupe of r
     - m = m_factor * 2^l == number of the blocks of the hashtable
     - dist / dist_params: the generation of the S
+    - distinct: S as a set of m distinct keys (repeats are drawn again)
+    - legacy_rng: S is drawn in one numpy batch (sampling.get_samples_batch) unless
+      True: then key by key from random.Random(seed) (make_S), much slower but the
+      same S as older versions for the same seed
     - trials: 
     """
 
@@ -118,19 +191,22 @@ def run_experiment_grid(
             m = int(m_factor * n)
 
             print(f"\n=== u={u}, l={l}, m={m}, dist={dist} ===")
-            #fix S, the same S for the whole round
-            S = make_S(
-                m=m,
-                u=u,
-                rng=rng,
-                dist=dist,
-                **dist_params,
-            )
+            #fix S, the same S for the whole round, drawn packed for every r
+            dedup = {}
+            if legacy_rng:
+                S = make_S(m=m, u=u, rng=rng, dist=dist, distinct=distinct, legacy_rng=True,
+                           dedup_stats=dedup, **dist_params)
+                S_blocks = pack_ints_to_u64_array(S, u)
+            else:
+                S_blocks = sampling.get_samples_batch(u, m, dist, rng, distinct=distinct, dedup_stats=dedup,
+                                                      **dist_params)
+            if distinct:
+                print("  " + dedup_report(dedup))
 
             curve = {}
             for r in r_values:
                 p_hat = estimate_prob_fixed_S(
-                    S=S,
+                    S=S_blocks,
                     u=u,
                     l=l,
                     r=r,
@@ -154,8 +230,14 @@ def run_experiment_grid_not_fixed_S(
     dist: str,
     dist_params: dict,
     seed: int = 0,
+    distinct: bool = False,
+    legacy_rng: bool = False,
 ):
-
+    """
+    As run_experiment_grid, with a new S and h for every trial, drawn in numpy batches
+    (sampling.iter_samples_batch); legacy_rng=True: S drawn key by key from
+    random.Random(seed_S) (make_S_iter), the S of older versions.
+    """
     rng = random.Random(seed)
     results = {}
 
@@ -169,6 +251,7 @@ def run_experiment_grid_not_fixed_S(
             # 初始化统计
             exceed = {r: 0.0 for r in r_values}
             thresholds = {r: threshold(l, r) for r in r_values}
+            dedup = {"draws": 0, "duplicates": 0, "dedup_seconds": 0.0}
 
             for t in range(trials):
 
@@ -176,30 +259,38 @@ def run_experiment_grid_not_fixed_S(
                 seed_S = rng.randrange(1 << 30)
                 seed_h = rng.randrange(1 << 30)
 
-                # 生成新的 S（generator）
-                S_iter = make_S_iter(
-                    m=m,
-                    u=u,
-                    seed=seed_S,
-                    dist=dist,
-                    **dist_params,
-                )
+                # 生成新的 S（按块生成的 uint64 数组，不经过 Python int）
+                # distinct: S 作为集合，重复的 key 重新抽样
+                trial_dedup = {}
+                if legacy_rng:
+                    S_iter = make_S_iter(m, u, seed_S, dist, distinct=distinct, legacy_rng=True,
+                                         dedup_stats=trial_dedup, **dist_params)
+                else:
+                    S_iter = sampling.iter_samples_batch(u, m, dist, seed_S, chunk_size=65536, distinct=distinct,
+                                                         dedup_stats=trial_dedup, **dist_params)
 
                 # 新 hash
                 h = hash_f2(l=l, u=u, seed=seed_h)
 
-                # 只算一次 max-load
+                # 只算一次 max-load（超过最大的阈值后就停止）
                 ml, _ = Maxload(u=u, l=l, h=h).max_load(
                     S_iter,
                     k=50_000,
                     chunk_size=65536,  # 4096/8192/16384/32768/65536
+                    thresholds=thresholds.values(),
                 )
+                S_iter.close()  # 提前停止时也结束生成器（填好 trial_dedup）
+                for key in trial_dedup:
+                    dedup[key] += trial_dedup[key]
 
                 # 对所有 r 判阈值
                 for r in r_values:
                     if ml >= thresholds[r]:
                         exceed[r] += 1.0
 
+            if distinct:
+                print("  " + dedup_report(dedup))
+
             # 计算概率
             curve = {}
             for r in r_values:
@@ -222,7 +313,16 @@ def run_experiment_grid_Cpp(
     dist: str,
     dist_params: dict,
     seed: int = 0,
+    legacy_rng: bool = False,
+    distinct: bool = False,
 ):
+    """
+    Trial t of the grid point (u, l) takes seed_S = derive_seed(seed, u, l, t, 0) and
+    seed_h = derive_seed(seed, u, l, t, 1): every trial can be rerun on its own, whatever
+    the rest of the grid. legacy_rng: the random.Random(seed).randrange(1 << 30) seeds and
+    mt19937_64 streams of older versions, to reproduce their results. distinct: S as a set
+    of m distinct keys, deduplicated in C++ (the time spent is printed).
+    """
     rng = random.Random(seed)
     results = {}
 
@@ -235,13 +335,24 @@ def run_experiment_grid_Cpp(
 
             thresholds = {r: threshold(l, r) for r in r_values}
 
-            seeds_S = [rng.randrange(1<<30) for _ in range(trials)]
-            seeds_h = [rng.randrange(1<<30) for _ in range(trials)]
+            if legacy_rng:
+                seeds_S = [rng.randrange(1<<30) for _ in range(trials)]
+                seeds_h = [rng.randrange(1<<30) for _ in range(trials)]
+            else:
+                seeds_S = [derive_seed(seed, u, l, t, 0) for t in range(trials)]
+                seeds_h = [derive_seed(seed, u, l, t, 1) for t in range(trials)]
 
+            dedup = {}
             start = time.time()
-            mls = fasthash.run_trials_maxload(u, l, m, dist, seeds_S, seeds_h, k=50_000, num_threads=10)
+            # trials stop as soon as every threshold is decided; uncertain
+            # Space-Saving trials are rerun exactly
+            mls, reruns = run_trials_certified(u, l, m, dist, seeds_S, seeds_h, list(thresholds.values()),
+                                               k=50_000, num_threads=10, dist_params=dist_params,
+                                               legacy_rng=legacy_rng, distinct=distinct, dedup_stats=dedup)
             elapsed = time.time() - start
-            print(f"time: {elapsed:.2f}s, per_trial: {elapsed/trials*1000:.2f}ms")
+            print(f"time: {elapsed:.2f}s, per_trial: {elapsed/trials*1000:.2f}ms, exact reruns: {reruns}")
+            if distinct:
+                print("  " + dedup_report(dedup))
 
             curve = {}
             for r in r_values:
@@ -1,17 +1,118 @@
-from typing import Optional
+from typing import Iterable, Optional
 from src.hashing import sampling
 import random
 
+_MASK64 = (1 << 64) - 1
+_GENS = ("sequential", "counter")
+
+def _splitmix64_mix(z: int) -> int:
+    """SplitMix64 finalizer (same as splitmix64_mix in linear_hash.hpp)."""
+    z = (z + 0x9E3779B97F4A7C15) & _MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return z ^ (z >> 31)
+
+def matrix_block(seed: int, i: int, b: int) -> int:
+    """Counter-based generator: 64-bit block b of row i of M, a pure function of (seed, i, b)."""
+    return _splitmix64_mix(_splitmix64_mix(seed & _MASK64) ^ ((i << 32) | b))
+
+def derive_seed(root: int, *path: int) -> int:
+    """
+    Seed of the node path under root, 64 bits: derive_seed(root, i) is
+    splitmix64_mix(splitmix64_mix(root) ^ i) (derive_seed in rng.hpp), and a
+    longer path folds it, derive_seed(root, a, b) = derive_seed(derive_seed(root, a), b).
+    E.g. trial t of the grid point (u, l): derive_seed(seed, u, l, t, 0) for S and
+    derive_seed(seed, u, l, t, 1) for h.
+    """
+    s = root & _MASK64
+    for i in path:
+        s = _splitmix64_mix(_splitmix64_mix(s) ^ (i & _MASK64))
+    return s
+
 class HashF2Python :
     l : int
     u : int
     M : list[int]  # M with l int, each int has u bits
 
-    def __init__(self, l: int, u: int, seed: Optional[int] = None) -> None:
+    def __init__(self, l: int, u: int, seed: Optional[int] = None, gen: str = "sequential") -> None:
+        """
+        gen: "sequential" draws the rows one after the other from random.Random(seed);
+             "counter" defines block b of row i as matrix_block(seed, i, b) (the same
+             matrix as fasthash.LinearHash(..., gen="counter")), so rows are only
+             generated when needed.
+        """
+        if gen not in _GENS:
+            raise ValueError(f"Unknown gen '{gen}'. Supported: {list(_GENS)}.")
         self.l = l
         self.u = u
-        rng = random.Random(seed)
-        self.M = [sampling.get_sample_x(u, rng, "uniform") for _ in range(l)]
+        self.gen = gen
+        self.seed = seed
+        self._cols: Optional[list[int]] = None
+        if gen == "sequential":
+            rng = random.Random(seed)
+            self._M: Optional[list[int]] = [sampling.get_sample_x(u, rng, "uniform") for _ in range(l)]
+        else:
+            self.seed = random.getrandbits(64) if seed is None else seed & _MASK64
+            self._M = None  # built on first use
+
+    @property
+    def M(self) -> list[int]:
+        if self._M is None:
+            self._M = [self.row(i) for i in range(self.l)]
+        return self._M
+
+    def row(self, i: int) -> int:
+        """Row i of M as a u-bit int (counter mode: generated without the other rows)."""
+        if self._M is not None:
+            return self._M[i]
+        num_blocks = (self.u + 63) // 64
+        x = 0
+        for b in range(num_blocks):
+            x |= matrix_block(self.seed, i, b) << (64 * b)
+        return x & ((1 << self.u) - 1)
+
+    def _column(self, k: int) -> int:
+        """Column k of M (h(e_k)) straight from the counter generator."""
+        b, bit = divmod(k, 64)
+        res = 0
+        for i in range(self.l):
+            res |= ((matrix_block(self.seed, i, b) >> bit) & 1) << i
+        return res
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.gen == "counter":
+            # the seed is enough to regenerate M
+            state["_M"] = None
+            state["_cols"] = None
+        return state
+
+    @property
+    def cols(self) -> list[int]:
+        """Columns of M (cols[k] = h(e_k), an l-bit int), built on first use."""
+        if self._cols is None:
+            cols = [0] * self.u
+            for i, row in enumerate(self.M):
+                bit = 1 << i
+                while row:
+                    low = row & -row
+                    cols[low.bit_length() - 1] |= bit
+                    row ^= low
+            self._cols = cols
+        return self._cols
+
+    # sparse
+    def h_sparse(self, indices: Iterable[int]) -> int:
+        """ h(x) for x given by the indices of its set bits: XOR of the columns of M """
+        # counter mode with M not built yet: only generate the touched columns
+        lazy = self._M is None and self._cols is None
+        cols = None if lazy else self.cols
+        res = 0
+        for k in indices:
+            if not (0 <= k < self.u):
+                raise ValueError(f"bit index must be in [0, {self.u}), got {k}.")
+            res ^= self._column(k) if lazy else cols[k]
+        return res
 
     # single
     def h(self, x: int) -> int :
@@ -19,11 +120,23 @@ class HashF2Python :
         # check if x has u bits
         if not (0 <= x < (1 << self.u)):
             raise ValueError(f"x must be an int with {self.u} bits, got {x.bit_length()}.")
-        
+
+        # low weight x: XOR of the columns at the set bits (~3 big-int ops per bit
+        # instead of one AND + bit_count per row)
+        if 3 * x.bit_count() < self.l:
+            cols = self.cols
+            res = 0
+            while x:
+                low = x & -x
+                res ^= cols[low.bit_length() - 1]
+                x ^= low
+            return res
+
         # M · x
         res = 0
+        M = self.M
         for i in range(self.l):
-            M_i = self.M[i]
+            M_i = M[i]
             prod = (M_i & x).bit_count() & 1  # dot product over F2
             res |= (prod << i)
         return res
@@ -32,11 +145,125 @@ class HashF2Python :
     def h_many(self, xs: list[int]) -> list[int]:
         return [self.h(x) for x in xs]
 
+class HashF2Numpy:
+    """
+    Same matrix (and outputs) as HashF2Python for the same seed, evaluated with
+    NumPy: M is packed as an (l, B) uint64 array (B = ceil(u/64)) and batches of
+    keys as (N, B) arrays; each row costs B vectorized AND + XOR steps over the
+    batch, followed by one popcount for the parity.
+    """
+
+    def __init__(self, l: int, u: int, seed: Optional[int] = None, gen: str = "sequential") -> None:
+        import numpy as np
+        self._np = np
+        self.l = l
+        self.u = u
+        self.num_in_blocks = (u + 63) // 64
+        self.num_out_blocks = (l + 63) // 64
+        self.M = HashF2Python(l=l, u=u, seed=seed, gen=gen).M
+        self.M_blocks = self.pack(self.M)  # (l, B) uint64
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_np"]  # modules do not pickle
+        return state
+
+    def __setstate__(self, state):
+        import numpy as np
+        self.__dict__.update(state)
+        self._np = np
+
+    def pack(self, xs: list[int]):
+        """Pack u-bit ints into an (N, ceil(u/64)) little-endian uint64 array."""
+        return pack_ints_to_u64_array(xs, self.u)
+
+    def _parity(self, v):
+        """Parity of each uint64 in v (0/1 as uint64)."""
+        np = self._np
+        if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+            return np.bitwise_count(v).astype(np.uint64) & np.uint64(1)
+        for shift in (32, 16, 8, 4, 2, 1):
+            v = v ^ (v >> np.uint64(shift))
+        return v & np.uint64(1)
+
+    # batch on packed blocks
+    def h_many_blocks(self, xs_blocks):
+        """
+        (N, ceil(u/64)) uint64 -> (N,) uint32 if l <= 32, (N,) uint64 if l <= 64, else
+        (N, ceil(l/64)) uint64 (the dtypes of HashF2Cpp.h_many_blocks).
+        """
+        np = self._np
+        X = np.asarray(xs_blocks, dtype=np.uint64).reshape(-1, self.num_in_blocks)
+        # block-major copy: XT[b] is block b of every key, so each step below is
+        # one AND + XOR over the whole batch
+        XT = np.ascontiguousarray(X.T)
+        out = np.zeros((X.shape[0], self.num_out_blocks), dtype=np.uint64)
+        for i in range(self.l):
+            row = self.M_blocks[i]
+            acc = XT[0] & row[0]
+            for b in range(1, self.num_in_blocks):
+                acc ^= XT[b] & row[b]
+            out[:, i // 64] |= self._parity(acc) << np.uint64(i % 64)
+        if self.l <= 32:
+            return out[:, 0].astype(np.uint32)
+        return out[:, 0] if self.num_out_blocks == 1 else out
+
+    # batch
+    def h_many(self, xs: list[int]) -> list[int]:
+        if len(xs) == 0:
+            return []
+        ys = self.h_many_blocks(self.pack(xs))
+        if self.num_out_blocks == 1:
+            return [int(y) for y in ys.tolist()]
+        return [blocks_to_int(row) for row in ys.tolist()]
+
+    # single
+    def h(self, x: int) -> int:
+        return self.h_many([x])[0]
+
 class HashF2Cpp:
 
-    def __init__(self, l: int, u: int, seed: int):
+    def __init__(self, l: int, u: int, seed: int, mode: str = "auto", gen: str = "sequential"):
+        """
+        mode: "popcount", "table" (precomputed byte tables) or "auto".
+        gen: "sequential" (mt19937_64) or "counter" (same M as HashF2Python(..., gen="counter")).
+        Instances pickle through to_bytes(), so M is copied rather than regenerated.
+        """
+        import fasthash
+        self._core = fasthash.LinearHash(l, u, int(seed), mode, gen)
+
+    # serialization
+    def to_bytes(self) -> bytes:
+        return self._core.to_bytes()
+
+    @classmethod
+    def from_bytes(cls, data) -> "HashF2Cpp":
+        """data: to_bytes() output, or any buffer holding it (bytes, memoryview, ...)."""
         import fasthash
-        self._core = fasthash.LinearHash(l, u, int(seed))
+        obj = cls.__new__(cls)
+        obj._core = fasthash.LinearHash.from_bytes(data)
+        return obj
+
+    def to_shared_memory(self, name: Optional[str] = None):
+        """
+        Copy to_bytes() into a new multiprocessing.shared_memory block and return it;
+        workers call HashF2Cpp.from_shared_memory(shm.name). The caller owns the block
+        (close() and unlink() it when done).
+        """
+        from multiprocessing import shared_memory
+        data = self.to_bytes()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=len(data))
+        shm.buf[:len(data)] = data
+        return shm
+
+    @classmethod
+    def from_shared_memory(cls, name: str) -> "HashF2Cpp":
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            return cls.from_bytes(shm.buf)
+        finally:
+            shm.close()
 
     # single
     def h(self, x: int) -> int:
@@ -45,6 +272,15 @@ class HashF2Cpp:
     # batch
     def h_many(self, xs: list[int]) -> list[int]:
         return self._core.hash_many_int(xs)
+
+    # sparse: x given by the indices of its set bits
+    def h_sparse(self, indices: Iterable[int]) -> int:
+        return int(self._core.hash_sparse(list(indices)))
+
+    # batch on packed blocks (numpy), no Python int conversion
+    def h_many_blocks(self, xs_blocks, out=None):
+        """xs_blocks: (N, ceil(u/64)) uint64 array -> (N,) uint32/uint64 or (N, ceil(l/64)) uint64."""
+        return self._core.hash_many_blocks(xs_blocks, out)
     
 def blocks_to_int(blocks):
     x = 0
@@ -64,11 +300,35 @@ def pack_int_to_u64_blocks(x: int, u: int) -> list[int]:
         x >>= 64
     return blocks
 
-def hash_f2(l: int, u: int, seed: int, has_cpp: bool = True):
+def pack_ints_to_u64_array(xs: list[int], u: int):
+    """Pack u-bit python ints into an (N, ceil(u/64)) little-endian uint64 numpy array."""
+    import numpy as np
+    num_blocks = (u + 63) // 64
+    limit = 1 << u
+    for x in xs:
+        if not (0 <= x < limit):
+            raise ValueError(f"x must be an int with {u} bits, got {x.bit_length()}.")
+    buf = b"".join(x.to_bytes(8 * num_blocks, "little") for x in xs)
+    return np.frombuffer(buf, dtype="<u8").reshape(len(xs), num_blocks).astype(np.uint64)
+
+_BACKENDS = {
+    "cpp": HashF2Cpp,
+    "numpy": HashF2Numpy,
+    "python": HashF2Python,
+}
+
+def hash_f2(l: int, u: int, seed: int, has_cpp: bool = True, backend: Optional[str] = None,
+            gen: str = "sequential"):
     """
     Return an object with method h(x:int)->int
     Prefer C++ backend if available and supported, else fall back to Python version.
+    backend: force one of "cpp", "numpy" (vectorized, same outputs as "python") or "python".
+    gen: "sequential" or "counter"; with "counter" every backend builds the same M.
     """
+    if backend is not None:
+        if backend not in _BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'. Supported: {list(_BACKENDS.keys())}.")
+        return _BACKENDS[backend](l=l, u=u, seed=seed, gen=gen)
     if has_cpp:
-        return HashF2Cpp(l=l, u=u, seed=seed)
-    return HashF2Python(l=l, u=u, seed=seed)
\ No newline at end of file
+        return HashF2Cpp(l=l, u=u, seed=seed, gen=gen)
+    return HashF2Python(l=l, u=u, seed=seed, gen=gen)
\ No newline at end of file
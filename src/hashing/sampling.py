@@ -1,5 +1,12 @@
-from typing import Callable, Dict, Any
+from typing import Callable, Dict, Any, Iterator, Optional
+import math
 import random
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by the batch samplers (and DistinctKeys' table)
+    np = None
 
 # ---------------------------
 #      Sampling functions
@@ -17,19 +24,57 @@ def sample_uniform(u: int, rng: random.Random) -> int:
     _check_u(u)
     return rng.getrandbits(u)
 
+def _bernoulli_digits(p: float) -> tuple[int, int]:
+    """
+    rng.random() < p holds with probability q / 2^53, q = ceil(p * 2^53): returns
+    (q, position of its lowest set bit), the digits the word-parallel sampler walks.
+    """
+    q = math.ceil(p * (1 << 53))
+    return q, ((q & -q).bit_length() - 1 if q else 53)
+
+def _bernoulli_word(u: int, q: int, tz: int, rng: random.Random) -> int:
+    """u independent bits equal to 1 with probability q / 2^53 (see sample_bernoulli)."""
+    if q == 0:
+        return 0
+    if q == 1 << 53:
+        return (1 << u) - 1
+    x = 0
+    for j in range(tz, 53):
+        r = rng.getrandbits(u)
+        x = (x | r) if (q >> j) & 1 else (x & r)
+    return x
+
+# One digit of _bernoulli_word (a getrandbits(u) call and an OR or AND on the word)
+# takes about as long as three rng.random() < p draws of the per-bit loop for u up to
+# a couple of 64-bit words, and more beyond.
+_BERNOULLI_DIGIT_BITS = 3
+
 def sample_bernoulli(u: int, p: float, rng: random.Random) -> int:
     """
     Independent bits: P(bit=1)=p, P(bit=0)=1-p
     Returns x as an int bitmask with u bits.
+
+    Word-parallel: a bit drawn as rng.random() < p is 1 with probability q / 2^53,
+    q = ceil(p * 2^53), a binary fraction 0.d1 d2 ... d53. Folding u-bit words
+    r_j = rng.getrandbits(u) from the last digit to the first, x = (x | r_j) if
+    d_j else (x & r_j), sets each bit with exactly that probability: at most 53
+    getrandbits calls (one for p = 1/2) instead of u calls to rng.random().
+    When u is below the digits to walk (53 - tz for q = m * 2^tz, m odd; all 53 for
+    most p) times _BERNOULLI_DIGIT_BITS, the u calls are cheaper and are made
+    instead: same distribution, bit by bit.
     """
     _check_u(u)
     if not (0.0 <= p <= 1.0):
         raise ValueError(f"p must be in [0,1], got {p}.")
-    x = 0
-    for i in range(u):
-        if rng.random() < p:
-            x |= (1 << i)
-    return x
+    q, tz = _bernoulli_digits(p)
+    if u < _BERNOULLI_DIGIT_BITS * (53 - tz):
+        rand = rng.random
+        x = 0
+        for i in range(u):
+            if rand() < p:
+                x |= 1 << i
+        return x
+    return _bernoulli_word(u, q, tz, rng)
 
 def sample_Hamming_weight(u: int, k: int, rng: random.Random) -> int:
     """
@@ -52,6 +97,54 @@ def sample_Hamming_weight(u: int, k: int, rng: random.Random) -> int:
         x |= (1 << i)
     return x
 
+def _markov_runs(u: int, bit: int, p0: float, p1: float, rng: random.Random) -> int:
+    """
+    The chain stays on a 1 with probability p0 and on a 0 with probability 1 - p1,
+    so its runs of equal bits have geometric lengths: one draw per run, and x is
+    assembled once from the runs.
+    """
+    stay = (1.0 - p1, p0)
+    inv_log = tuple(1.0 / math.log(q) if 0.0 < q < 1.0 else 0.0 for q in stay)
+    rand, log = rng.random, math.log
+    runs = []  # runs of equal bits, from bit 0 up
+    i = 0
+    while i < u:
+        q = stay[bit]
+        if 0.0 < q < 1.0:
+            n = min(u - i, 1 + int(log(1.0 - rand()) * inv_log[bit]))  # P(n > j) = q^j
+        else:
+            n = 1 if q <= 0.0 else u - i
+        runs.append("01"[bit] * n)
+        i += n
+        bit ^= 1
+    return int("".join(reversed(runs)), 2)
+
+def _markov_words(u: int, bit: int, d0: tuple[int, int], d1: tuple[int, int], rng: random.Random) -> int:
+    """
+    Word-parallel chain: A, B are Bernoulli(p0), Bernoulli(p1) words, and bit i is
+    A_i after a 1, B_i after a 0. Where A_i == B_i that is A_i whatever bit i-1; where
+    A_i = 1, B_i = 0 bit i copies bit i-1, and where A_i = 0, B_i = 1 it flips it. So
+    bit i is the XOR of the last set bit j <= i and of the flips in (j, i]: a prefix
+    XOR restarting at each set bit, in log2(u) doubling steps.
+    """
+    full = (1 << u) - 1
+    A = _bernoulli_word(u, *d0, rng)
+    B = _bernoulli_word(u, *d1, rng)
+    heads = (~(A ^ B) & full) | 1          # bits set whatever the previous one (and bit 0)
+    x = ((A & heads) | (~A & B)) & ~1 | bit  # their values and the flips; bit 0 is given
+    w = 1
+    while w < u:
+        # x_i: XOR over [max(i - 2w + 1, last head), i]; heads_i: a head in [i - 2w + 1, i]
+        x ^= (x << w) & ~heads
+        heads |= heads << w
+        w <<= 1
+    return x & full
+
+# A run of _markov_runs takes about a dozen interpreter operations (random(), the
+# subtraction, log, multiply, int, min, the string repeat and append, the index and
+# bit updates), each about the cost of one 64-bit word operation of _markov_words.
+_MARKOV_RUN_OPS = 12
+
 def sample_Markov(u: int, p0: float, p1: float, rng: random.Random) -> int:
     """
     Markov chain over bits:
@@ -60,35 +153,31 @@ def sample_Markov(u: int, p0: float, p1: float, rng: random.Random) -> int:
     P(bit_i=0 | bit_{i-1}) = p1
 
     Returns x as an int with u bits.
+
+    No draw per bit: after the first bit (rng.random() < 0.5), long runs are drawn
+    as geometric run lengths (_markov_runs), else the whole chain is resolved
+    word-parallel (_markov_words), whichever takes fewer operations. The word path
+    takes p0, p1 as multiples of 2^-53 (as rng.random() < p), so its transition
+    probabilities can differ from p0, p1 by up to 2^-53.
     """
     _check_u(u)
     if not (0.0 <= p0 <= 1.0):
         raise ValueError(f"p must be in [0,1], got {p0}.")
     if not (0.0 <= p1 <= 1.0):
         raise ValueError(f"p must be in [0,1], got {p1}.")
-    x = 0
     # first bit
-    if rng.random() < 0.5:
-        x |= 1
-        prev_bit = 1
-    else:
-        prev_bit = 0
-    # remaining bits
-    for i in range(1, u):
-        r = rng.random()
-        if prev_bit == 1:
-            if r <= p0:
-                x |= (1 << i)
-                prev_bit = 1
-            else:
-                prev_bit = 0
-        else:
-            if r <= p1:
-                x |= (1 << i)
-                prev_bit = 1
-            else:
-                prev_bit = 0
-    return x
+    bit = 1 if rng.random() < 0.5 else 0
+    if u == 1:
+        return bit
+    d0, d1 = _bernoulli_digits(p0), _bernoulli_digits(p1)
+    # expected runs (stationary switch rate) against u-bit word operations (one
+    # getrandbits per digit, two shifts per doubling step), both in 64-bit words
+    leave = (1.0 - p0) + p1
+    runs = 1.0 + (u - 1) * (2.0 * (1.0 - p0) * p1 / leave if leave else 0.0)
+    word_ops = (53 - d0[1]) + (53 - d1[1]) + 2 * (u - 1).bit_length()
+    if _MARKOV_RUN_OPS * runs < word_ops * ((u + 63) // 64):
+        return _markov_runs(u, bit, p0, p1, rng)
+    return _markov_words(u, bit, d0, d1, rng)
 
 # ---------------------------
 #         Dispatcher
@@ -103,12 +192,505 @@ _SAMPLERS: Dict[str, Sampler] = {
     "Markov": sample_Markov
 }
 
-def get_sample_x(u: int, rng: random.Random, dist: str, **params: Any) -> int:
+def _sample_bernoulli_bitwise(u: int, p: float, rng: random.Random) -> int:
+    """sample_bernoulli of older versions: one rng.random() per bit."""
+    _check_u(u)
+    if not (0.0 <= p <= 1.0):
+        raise ValueError(f"p must be in [0,1], got {p}.")
+    x = 0
+    for i in range(u):
+        if rng.random() < p:
+            x |= (1 << i)
+    return x
+
+def _sample_Markov_bitwise(u: int, p0: float, p1: float, rng: random.Random) -> int:
+    """sample_Markov of older versions: one rng.random() per bit."""
+    _check_u(u)
+    if not (0.0 <= p0 <= 1.0):
+        raise ValueError(f"p must be in [0,1], got {p0}.")
+    if not (0.0 <= p1 <= 1.0):
+        raise ValueError(f"p must be in [0,1], got {p1}.")
+    prev_bit = 1 if rng.random() < 0.5 else 0
+    x = prev_bit
+    for i in range(1, u):
+        prev_bit = 1 if rng.random() <= (p0 if prev_bit else p1) else 0
+        x |= prev_bit << i
+    return x
+
+# the random streams of older versions (uniform and Hamming_weight never changed)
+_LEGACY_SAMPLERS: Dict[str, Sampler] = {
+    **_SAMPLERS,
+    "bernoulli": _sample_bernoulli_bitwise,
+    "Markov": _sample_Markov_bitwise,
+}
+
+def get_sample_x(u: int, rng: random.Random, dist: str, *, legacy_rng: bool = False, **params: Any) -> int:
     """
     Unified entry point for sampling x according to different distributions.
-    dist: one of {"uniform","bernoulli","Hamming_weight"}.
+    dist: one of {"uniform","bernoulli","Hamming_weight","Markov"}.
     params: distribution parameters (e.g., p=..., k=...).
+    legacy_rng: draw bernoulli and Markov bit by bit as older versions did, so that a
+    seed gives the same x as they did (slower).
+    """
+    samplers = _LEGACY_SAMPLERS if legacy_rng else _SAMPLERS
+    if dist not in samplers:
+        raise ValueError(f"Unknown distribution '{dist}'. Supported: {list(samplers.keys())}.")
+    return samplers[dist](u=u, rng=rng, **params)
+
+
+# ---------------------------
+#   Batch sampling (numpy)
+# ---------------------------
+# n keys at once as an (n, ceil(u/64)) uint64 array: bit i of x is bit i % 64 of
+# block i // 64 (the layout of linear_f2.pack_ints_to_u64_array), bits past u are
+# zero. The keys follow the same distributions as the samplers above, but not the
+# same random stream. The arrays go straight to h_many_blocks / Maxload.max_load.
+
+# float draws per call for the bit-by-bit samplers (64 MiB)
+_BATCH_ELEMS = 1 << 23
+
+def _np_rng(rng):
+    """numpy Generator from rng: a Generator, a random.Random (draws its seed) or a seed."""
+    if np is None:
+        raise ImportError("batch sampling needs numpy")
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if isinstance(rng, random.Random):
+        return np.random.default_rng(rng.getrandbits(128))
+    return np.random.default_rng(rng)
+
+def _check_n(n: int) -> None:
+    if not isinstance(n, int) or n < 0:
+        raise ValueError(f"n must be a non-negative integer, got {n}.")
+
+def _mask_last_block(X, u: int):
+    excess = 64 * X.shape[1] - u
+    if excess:
+        X[:, -1] &= np.uint64((1 << (64 - excess)) - 1)
+    return X
+
+def _pack_bits(bits):
+    """(n, u) bool -> (n, ceil(u/64)) uint64."""
+    n, u = bits.shape
+    pad = -u % 64
+    if pad:
+        bits = np.pad(bits, ((0, 0), (0, pad)))
+    packed = np.ascontiguousarray(np.packbits(bits, axis=1, bitorder="little"))
+    return packed.view("<u8").astype(np.uint64, copy=False)
+
+def _random_words(rng, n: int, B: int):
+    return rng.integers(0, 1 << 64, size=(n, B), dtype=np.uint64)
+
+def batch_uniform(u: int, n: int, rng) -> "np.ndarray":
+    """n keys uniform over F2^u."""
+    _check_u(u)
+    _check_n(n)
+    return _mask_last_block(_random_words(_np_rng(rng), n, (u + 63) // 64), u)
+
+def _bernoulli_words(rng, n: int, B: int, q: int, tz: int):
+    """(n, B) random words, each bit 1 with probability q / 2^53 (see batch_bernoulli)."""
+    if q == 1 << 53:
+        return np.full((n, B), ~np.uint64(0))
+    X = np.zeros((n, B), dtype=np.uint64)
+    if q == 0:
+        return X
+    for j in range(tz, 53):
+        if (q >> j) & 1:
+            X |= _random_words(rng, n, B)
+        else:
+            X &= _random_words(rng, n, B)
+    return X
+
+def _shift_up(X, w: int):
+    """Bit i of every row of X moved to bit i + w, across the blocks (zeros shifted in)."""
+    q, s = divmod(w, 64)
+    Y = np.zeros_like(X)
+    if q < X.shape[1]:
+        Y[:, q:] = X[:, :X.shape[1] - q]
+    if s:
+        Z = Y << np.uint64(s)
+        Z[:, 1:] |= Y[:, :-1] >> np.uint64(64 - s)
+        Y = Z
+    return Y
+
+def batch_bernoulli(u: int, n: int, p: float, rng) -> "np.ndarray":
+    """
+    n keys with independent bits, P(bit=1)=p. Word-parallel, as sample_bernoulli: p is
+    taken as q / 2^53, q = ceil(p * 2^53) (_bernoulli_digits), and each word is built
+    from random words r_j, least significant digit first, as w = (w | r_j) if d_j else
+    (w & r_j) (BlockSampler in samplers.hpp does the same with 32 digits).
+    """
+    _check_u(u)
+    _check_n(n)
+    if not (0.0 <= p <= 1.0):
+        raise ValueError(f"p must be in [0,1], got {p}.")
+    return _mask_last_block(_bernoulli_words(_np_rng(rng), n, (u + 63) // 64, *_bernoulli_digits(p)), u)
+
+def batch_Hamming_weight(u: int, n: int, k: int, rng) -> "np.ndarray":
+    """
+    n keys uniform among the vectors of Hamming weight k: Floyd's selection of k
+    distinct positions (of the u - k zeros if k > u/2), one step for all the rows
+    at once (as BlockSampler in samplers.hpp).
+    """
+    _check_u(u)
+    _check_n(n)
+    if not (0 <= k <= u):
+        raise ValueError(f"k must be in [0,u], got k={k}, u={u}.")
+    rng = _np_rng(rng)
+    pick_ones = 2 * k <= u
+    n_pick = k if pick_ones else u - k
+    out = np.empty((n, (u + 63) // 64), dtype=np.uint64)
+    step = max(1, _BATCH_ELEMS // u)
+    for i in range(0, n, step):
+        rows = min(step, n - i)
+        bits = np.zeros((rows, u), dtype=bool)
+        r = np.arange(rows)
+        # for j = u - n_pick .. u - 1: a random t <= j, or j if t is taken
+        for j in range(u - n_pick, u):
+            t = rng.integers(0, j + 1, size=rows)
+            bits[r, np.where(bits[r, t], j, t)] = True
+        out[i:i + rows] = _pack_bits(bits if pick_ones else ~bits)
+    return out
+
+def batch_Markov(u: int, n: int, p0: float, p1: float, rng) -> "np.ndarray":
+    """
+    n Markov chains of u bits (as sample_Markov): P(bit_0=1)=0.5, then bit_i = 1 with
+    probability p0 after a 1 and p1 after a 0. Word-parallel, as _markov_words: with
+    Bernoulli(p0), Bernoulli(p1) words A, B, bit i is B_i where A_i == B_i (a head) and
+    bit i-1 XOR B_i elsewhere, resolved by a prefix XOR restarting at each head in
+    log2(u) doubling steps, each on all the rows' blocks at once.
+    """
+    _check_u(u)
+    _check_n(n)
+    if not (0.0 <= p0 <= 1.0):
+        raise ValueError(f"p must be in [0,1], got {p0}.")
+    if not (0.0 <= p1 <= 1.0):
+        raise ValueError(f"p must be in [0,1], got {p1}.")
+    rng = _np_rng(rng)
+    B = (u + 63) // 64
+    d0, d1 = _bernoulli_digits(p0), _bernoulli_digits(p1)
+    out = np.empty((n, B), dtype=np.uint64)
+    step = max(1, _BATCH_ELEMS // (8 * B))  # a few (rows, B) word arrays of 8 MiB
+    for i in range(0, n, step):
+        rows = min(step, n - i)
+        A = _bernoulli_words(rng, rows, B, *d0)
+        x = _bernoulli_words(rng, rows, B, *d1)
+        heads = ~(A ^ x)
+        heads[:, 0] |= np.uint64(1)  # bit 0 is drawn on its own
+        x[:, 0] = (x[:, 0] & ~np.uint64(1)) | (rng.random(rows) < 0.5).astype(np.uint64)
+        w = 1
+        while w < u:
+            # bit i: XOR over [max(i - 2w + 1, last head), i]; heads: a head in [i - 2w + 1, i]
+            x ^= _shift_up(x, w) & ~heads
+            heads |= _shift_up(heads, w)
+            w <<= 1
+        out[i:i + rows] = _mask_last_block(x, u)
+    return out
+
+_BATCH_SAMPLERS: Dict[str, Callable[..., Any]] = {
+    "uniform": batch_uniform,
+    "bernoulli": batch_bernoulli,
+    "Hamming_weight": batch_Hamming_weight,
+    "Markov": batch_Markov,
+}
+
+def get_samples_batch(u: int, n: int, dist: str, rng, *, distinct: bool = False,
+                      dedup_stats: Optional[dict] = None, **params: Any) -> "np.ndarray":
+    """
+    n keys of dist (same names and params as get_sample_x) as an (n, ceil(u/64)) uint64
+    array, generated with vectorized numpy ops. rng: a numpy Generator, a random.Random
+    (its next 128 bits seed a Generator) or a seed.
+    distinct / dedup_stats: n distinct keys, as in iter_samples_batch.
+    """
+    if dist not in _BATCH_SAMPLERS:
+        raise ValueError(f"Unknown distribution '{dist}'. Supported: {list(_BATCH_SAMPLERS.keys())}.")
+    if distinct:
+        chunks = list(iter_samples_batch(u, n, dist, rng, chunk_size=max(n, 1), distinct=True,
+                                         dedup_stats=dedup_stats, **params))
+        return np.concatenate(chunks) if chunks else np.zeros((0, (u + 63) // 64), dtype=np.uint64)
+    return _BATCH_SAMPLERS[dist](u=u, n=n, rng=_np_rng(rng), **params)
+
+def iter_samples_batch(u: int, m: int, dist: str, rng, chunk_size: int = 1 << 16, *,
+                       distinct: bool = False, dedup_stats: Optional[dict] = None,
+                       **params: Any) -> Iterator["np.ndarray"]:
+    """
+    Streaming form of get_samples_batch: m keys in (chunk, ceil(u/64)) arrays of at most
+    chunk_size rows, drawn from one Generator. The parameters are checked on the call.
+    distinct: S as a set, m distinct keys (see DistinctKeys), every repeat replaced by a
+    fresh draw; dedup_stats (a dict) receives DistinctKeys.stats() when the stream ends.
+    """
+    _check_n(m)
+    if chunk_size <= 0:
+        raise ValueError(f"chunk_size must be positive, got {chunk_size}.")
+    gen = _np_rng(rng)
+    get_samples_batch(u, 0, dist, gen, **params)
+
+    def chunks() -> Iterator["np.ndarray"]:
+        for i in range(0, m, chunk_size):
+            yield get_samples_batch(u, min(chunk_size, m - i), dist, gen, **params)
+
+    def distinct_chunks(seen: DistinctKeys) -> Iterator["np.ndarray"]:
+        left = m
+        try:
+            while left:
+                # a few spare rows, so that the last repeats do not cost a call each
+                X = get_samples_batch(u, min(chunk_size, max(left, 64)), dist, gen, **params)
+                X = X[seen.new_rows(X, left)]
+                left -= len(X)
+                if len(X):
+                    yield X
+        finally:
+            if dedup_stats is not None:
+                dedup_stats.update(seen.stats())
+
+    return distinct_chunks(DistinctKeys(u, m)) if distinct else chunks()
+
+
+# ---------------------------
+#  Distinct keys (S as a set)
+# ---------------------------
+
+def _mix64(v):
+    """SplitMix64's mixing of every word of v (uint64 array, wrapping), as fingerprint.hpp."""
+    v = v ^ (v >> np.uint64(30))
+    v *= np.uint64(0xBF58476D1CE4E5B9)
+    v ^= v >> np.uint64(27)
+    v *= np.uint64(0x94D049BB133111EB)
+    v ^= v >> np.uint64(31)
+    return v
+
+def _fingerprint64_rows(X, seed: int, keyed: bool):
+    """fingerprint64_seeded (keyed: fingerprint64_keyed) of every row of X, as fingerprint.hpp."""
+    s = np.uint64(seed)
+    h = np.full(len(X), s, dtype=np.uint64)
+    for j in range(X.shape[1]):
+        v = _mix64(X[:, j] ^ s if keyed else X[:, j])
+        h ^= v + np.uint64(0x9E3779B97F4A7C15) + (h << np.uint64(6)) + (h >> np.uint64(2))
+    return h
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+def _mix64_int(v: int) -> int:
+    """_mix64 of one word, on Python ints."""
+    v ^= v >> 30
+    v = (v * 0xBF58476D1CE4E5B9) & _MASK64
+    v ^= v >> 27
+    v = (v * 0x94D049BB133111EB) & _MASK64
+    return v ^ (v >> 31)
+
+def _fingerprint128_int(x: int, B: int) -> tuple[int, int]:
+    """fingerprint64 and fingerprint64_keyed(.., 0xd1b5..) of the B words of x (as
+    _fingerprint64_rows), in one pass on Python ints."""
+    K = 0xD1B54A32D192ED03
+    lo, hi = _GOLDEN, K
+    for j in range(B):
+        w = (x >> (64 * j)) & _MASK64
+        lo ^= (_mix64_int(w) + _GOLDEN + ((lo << 6) & _MASK64) + (lo >> 2)) & _MASK64
+        hi ^= (_mix64_int(w ^ K) + _GOLDEN + ((hi << 6) & _MASK64) + (hi >> 2)) & _MASK64
+    return lo, hi
+
+class DistinctKeys:
+    """
+    The keys drawn so far, to give S set semantics: a repeat is dropped and drawn again.
+    Mirrors DistinctKeys in src/cpp/distinct_keys.hpp: a key is a 128-bit value, its
+    ceil(u/64) little-endian words when u <= 128, else fingerprint64 and
+    fingerprint64_keyed of them (two keys collide with probability about 2^-128); the
+    values live in one numpy open-addressing table (linear probing) of 16-byte slots,
+    allocated for max_keys keys at most 3/4 full: bytes_for(max_keys) in all, checked
+    against mem_budget upfront (MemoryError). add() computes the key and probes with
+    Python ints, new_rows() does both on whole arrays. Without numpy the keys go into a
+    Python set of 128-bit ints instead (about _SET_KEY_BYTES bytes per key, same check),
+    for add() only. Once max_draws draws (default 64 max_keys + 2^20) did not bring
+    max_keys distinct keys, the distribution has too few likely keys (RuntimeError).
+    draws, duplicates and seconds (time spent in the set) report the cost of the dedup.
+    """
+
+    # a 128-bit int (44 bytes) and its set entry at the set's load factor
+    _SET_KEY_BYTES = 100
+
+    def __init__(self, u: int, max_keys: int, mem_budget: int = 1 << 30,
+                 max_draws: Optional[int] = None) -> None:
+        _check_u(u)
+        _check_n(max_keys)
+        if self.bytes_for(max_keys) > mem_budget:
+            raise MemoryError(f"{max_keys} distinct keys need {self.bytes_for(max_keys)} bytes, "
+                              f"over mem_budget = {mem_budget}.")
+        self.B = (u + 63) // 64
+        self.max_keys = max_keys
+        self.max_draws = 64 * max_keys + (1 << 20) if max_draws is None else max_draws
+        self._exact = u <= 128
+        self._has_zero = False
+        self._set: Optional[set] = None
+        if np is None:
+            self._set = set()
+        else:
+            cap = self._capacity(max_keys)
+            self._lo = np.zeros(cap, dtype=np.uint64)  # (0, 0) = free
+            self._hi = np.zeros(cap, dtype=np.uint64)
+            self._shift = np.uint64(65 - cap.bit_length())
+        self._size = 0
+        self.draws = 0
+        self.duplicates = 0
+        self.seconds = 0.0
+
+    @staticmethod
+    def _capacity(max_keys: int) -> int:
+        cap = 16
+        while 3 * cap < 4 * max_keys:
+            cap *= 2
+        return cap
+
+    @classmethod
+    def bytes_for(cls, max_keys: int) -> int:
+        if np is None:
+            return cls._SET_KEY_BYTES * max_keys
+        return 16 * cls._capacity(max_keys)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _keys(self, X):
+        if self._exact:
+            return X[:, 0].copy(), (X[:, 1].copy() if self.B > 1 else np.zeros(len(X), dtype=np.uint64))
+        return (_fingerprint64_rows(X, 0x9E3779B97F4A7C15, False),
+                _fingerprint64_rows(X, 0xD1B54A32D192ED03, True))
+
+    def _home(self, lo, hi):
+        # splitmix64_mix(lo ^ splitmix64_mix(hi)) >> shift, as distinct_keys.hpp
+        golden = np.uint64(0x9E3779B97F4A7C15)
+        return (_mix64((lo ^ _mix64(hi + golden)) + golden) >> self._shift).astype(np.intp)
+
+    def _key_int(self, x: int) -> tuple[int, int]:
+        if self._exact:
+            return x & _MASK64, x >> 64
+        return _fingerprint128_int(x, self.B)
+
+    def _insert_int(self, lo: int, hi: int) -> bool:
+        """_insert of one key, probing slot by slot."""
+        if self._set is not None:
+            key = lo | hi << 64
+            if key in self._set:
+                return False
+            self._set.add(key)
+            self._size += 1
+            return True
+        if not (lo | hi):
+            if self._has_zero:
+                return False
+            self._has_zero = True
+            self._size += 1
+            return True
+        mask = len(self._lo) - 1
+        # _home: splitmix64_mix(lo ^ splitmix64_mix(hi)) >> shift
+        inner = _mix64_int((hi + _GOLDEN) & _MASK64)
+        pos = _mix64_int(((lo ^ inner) + _GOLDEN) & _MASK64) >> int(self._shift)
+        while True:
+            slo, shi = int(self._lo[pos]), int(self._hi[pos])
+            if slo == lo and shi == hi:
+                return False
+            if not (slo | shi):
+                break
+            pos = (pos + 1) & mask
+        if 4 * (self._size + 1) > 3 * len(self._lo):
+            raise ValueError("DistinctKeys: more keys than max_keys.")
+        self._lo[pos] = lo
+        self._hi[pos] = hi
+        self._size += 1
+        return True
+
+    def _insert(self, lo, hi):
+        """
+        Inserts the keys (lo, hi) in order; returns the mask of those that were new (a key
+        repeated in (lo, hi) is new at its first occurrence only). The keys probe all at
+        once: a free slot goes to the first key reaching it, equal keys stop on it.
+        """
+        new = np.zeros(len(lo), dtype=bool)
+        zero = np.flatnonzero((lo | hi) == 0)
+        if len(zero) and not self._has_zero:
+            self._has_zero = True
+            self._size += 1
+            new[zero[0]] = True
+        idx = np.flatnonzero((lo | hi) != 0)
+        pos = self._home(lo[idx], hi[idx])
+        mask = len(self._lo) - 1
+        while len(idx):
+            klo, khi = lo[idx], hi[idx]
+            slo, shi = self._lo[pos], self._hi[pos]
+            free = np.flatnonzero((slo | shi) == 0)
+            if len(free):
+                win = free[np.unique(pos[free], return_index=True)[1]]
+                if 4 * (self._size + len(win)) > 3 * len(self._lo):
+                    raise ValueError("DistinctKeys: more keys than max_keys.")
+                self._lo[pos[win]] = klo[win]
+                self._hi[pos[win]] = khi[win]
+                self._size += len(win)
+                new[idx[win]] = True
+                slo[free], shi[free] = self._lo[pos[free]], self._hi[pos[free]]
+            on = (slo != klo) | (shi != khi)  # probe on past the other keys
+            idx, pos = idx[on], (pos[on] + 1) & mask
+        return new
+
+    def _check_draws(self) -> None:
+        if self.draws >= self.max_draws and self._size < self.max_keys:
+            raise RuntimeError(f"distinct keys: {self._size} distinct in {self.draws} draws, "
+                               "the distribution has too few likely keys.")
+
+    def add(self, x: int) -> bool:
+        """Counts the draw x (an int of u bits); True if it is new, and now in the set."""
+        t0 = time.perf_counter()
+        new = self._insert_int(*self._key_int(x))
+        if not new:
+            self.duplicates += 1
+        self.draws += 1
+        self.seconds += time.perf_counter() - t0
+        if not new:
+            self._check_draws()
+        return new
+
+    def new_rows(self, X, limit: Optional[int] = None) -> "np.ndarray":
+        """
+        Counts the draws X ((n, ceil(u/64)) uint64), in row order, up to the limit-th new
+        key; returns the indices of the new rows, which are now in the set.
+        """
+        t0 = time.perf_counter()
+        X = np.asarray(X, dtype=np.uint64)
+        lo, hi = self._keys(X)
+        if limit is None:
+            keep = np.flatnonzero(self._insert(lo, hi))
+            n = len(X)
+        else:
+            # prefixes no longer than the keys still wanted: the last one ends on the
+            # limit-th new key
+            parts, found, n = [], 0, 0
+            while n < len(X) and found < limit:
+                end = min(len(X), n + limit - found)
+                parts.append(np.flatnonzero(self._insert(lo[n:end], hi[n:end])) + n)
+                found += len(parts[-1])
+                n = end
+            keep = np.concatenate(parts) if parts else np.zeros(0, dtype=np.intp)
+        self.draws += n
+        self.duplicates += n - len(keep)
+        self.seconds += time.perf_counter() - t0
+        self._check_draws()
+        return keep.astype(np.intp)
+
+    def stats(self) -> dict:
+        return {"draws": self.draws, "duplicates": self.duplicates, "dedup_seconds": self.seconds}
+
+def iter_distinct_samples(u: int, m: int, dist: str, rng: random.Random, *,
+                          dedup_stats: Optional[dict] = None, **params: Any) -> Iterator[int]:
+    """
+    m distinct keys of dist (get_sample_x), every repeat replaced by a fresh draw from
+    rng; dedup_stats (a dict) receives DistinctKeys.stats() when the stream ends.
     """
-    if dist not in _SAMPLERS:
-        raise ValueError(f"Unknown distribution '{dist}'. Supported: {list(_SAMPLERS.keys())}.")
-    return _SAMPLERS[dist](u=u, rng=rng, **params)
+    _check_n(m)
+    seen = DistinctKeys(u, m)
+    try:
+        while len(seen) < m:
+            x = get_sample_x(u=u, rng=rng, dist=dist, **params)
+            if seen.add(x):
+                yield x
+    finally:
+        if dedup_stats is not None:
+            dedup_stats.update(seen.stats())
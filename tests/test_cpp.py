@@ -3,10 +3,18 @@ import unittest
 
 import fasthash
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional for the int-based API
+    np = None
+
 from src.hashing.linear_f2 import (
+    HashF2Cpp,
     HashF2Python,
     pack_int_to_u64_blocks,
+    pack_ints_to_u64_array,
     blocks_to_int,
+    derive_seed,
 )
 
 
@@ -66,6 +74,592 @@ class TestLinearHashCpp(unittest.TestCase):
 
         self.assertEqual(y1, y2)
 
+    def test_hash_many_int_matches_single_hash(self):
+        # covers the bit-sliced batch kernel (partial last batch of 64)
+        # and the per-key row loop (tiny u)
+        for l, u in [(30, 3000), (100, 200), (64, 64), (5, 8)]:
+            h = fasthash.LinearHash(l, u, 2024)
+            xs = [random.getrandbits(u) for _ in range(150)]
+            ys = h.hash_many_int(xs)
+            self.assertEqual(len(ys), len(xs))
+            for x, y in zip(xs, ys):
+                self.assertEqual(y, h.hash_int(x))
+                self.assertEqual(y, blocks_to_int(h.hash(pack_int_to_u64_blocks(x, u))))
+
+    def test_table_mode_matches_popcount_mode(self):
+        for l, u in [(30, 3000), (200, 300), (20, 64), (7, 13)]:
+            hp = fasthash.LinearHash(l, u, 5, mode="popcount")
+            ht = fasthash.LinearHash(l, u, 5, mode="table")
+            self.assertEqual(hp.mode, "popcount")
+            self.assertEqual(ht.mode, "table")
+            self.assertIn(ht.table_bits, (8, 16))
+            xs = [random.getrandbits(u) for _ in range(100)]
+            self.assertEqual(hp.hash_many_int(xs), ht.hash_many_int(xs))
+            for x in xs[:10]:
+                self.assertEqual(hp.hash_int(x), ht.hash_int(x))
+
+    def test_simd_kernels_agree(self):
+        features = fasthash.cpu_features()
+        default = features["kernel"]
+        self.assertIn(default, ("scalar", "avx2", "avx512"))
+        kernels = ["scalar"]
+        if features["avx2"]:
+            kernels.append("avx2")
+        if features["avx512f"] and features["avx512vpopcntdq"]:
+            kernels.append("avx512")
+        try:
+            for l, u in [(30, 3000), (70, 200), (9, 64)]:
+                xs = [random.getrandbits(u) for _ in range(80)]
+                expected = fasthash.LinearHash(l, u, 8, mode="table").hash_many_int(xs)
+                for name in kernels:
+                    fasthash.set_simd_kernel(name)
+                    h = fasthash.LinearHash(l, u, 8, mode="popcount")
+                    self.assertEqual(h.simd_kernel, name)
+                    self.assertEqual([h.hash_int(x) for x in xs], expected)
+        finally:
+            fasthash.set_simd_kernel(default)
+
+    def test_sparse_inputs_match_dense_kernels(self):
+        for l, u in [(30, 3000), (130, 500), (10, 64)]:
+            hp = fasthash.LinearHash(l, u, 21, mode="popcount")
+            ht = fasthash.LinearHash(l, u, 21, mode="table")
+            rng = random.Random(l)
+            for k in (0, 1, 3, 10, u // 2):
+                positions = rng.sample(range(u), k)
+                x = sum(1 << p for p in positions)
+                y = ht.hash_int(x)
+                self.assertEqual(hp.hash_int(x), y)
+                self.assertEqual(hp.hash_sparse(positions), y)
+            # batches mixing sparse and dense keys
+            xs = [1 << rng.randrange(u) if t % 3 else rng.getrandbits(u) for t in range(130)]
+            self.assertEqual(hp.hash_many_int(xs), ht.hash_many_int(xs))
+        with self.assertRaises(ValueError):
+            fasthash.LinearHash(10, 64, 1).hash_sparse([64])
+
+    def test_invalid_mode_raises(self):
+        with self.assertRaises(ValueError):
+            fasthash.LinearHash(10, 20, 1, mode="bogus")
+
+    def test_counter_gen_matches_python_matrix(self):
+        for l, u in [(10, 64), (70, 130), (30, 3000)]:
+            h_cpp = fasthash.LinearHash(l, u, 77, gen="counter")
+            h_py = HashF2Python(l, u, seed=77, gen="counter")
+            self.assertEqual(h_cpp.gen, "counter")
+            rng = random.Random(l)
+            for _ in range(20):
+                x = rng.getrandbits(u)
+                self.assertEqual(h_cpp.hash_int(x), h_py.h(x))
+
+    def test_to_bytes_and_pickle_roundtrip(self):
+        import pickle
+        for gen in ("sequential", "counter"):
+            h = fasthash.LinearHash(40, 200, 3, mode="popcount", gen=gen)
+            data = h.to_bytes()
+            self.assertEqual(len(data), 32 + 40 * 4 * 8)
+            for h2 in (fasthash.LinearHash.from_bytes(data),
+                       fasthash.LinearHash.from_bytes(memoryview(data)),
+                       pickle.loads(pickle.dumps(h))):
+                self.assertEqual((h2.seed, h2.gen, h2.mode), (3, gen, "popcount"))
+                self.assertEqual(h2.to_bytes(), data)
+        with self.assertRaises(ValueError):
+            fasthash.LinearHash.from_bytes(data[:-8])
+        with self.assertRaises(ValueError):
+            fasthash.LinearHash.from_bytes(b"XXXX" + data[4:])
+
+    def test_shared_memory_roundtrip(self):
+        h = HashF2Cpp(30, 300, 8, gen="counter")
+        shm = h.to_shared_memory()
+        try:
+            h2 = HashF2Cpp.from_shared_memory(shm.name)
+        finally:
+            shm.close()
+            shm.unlink()
+        xs = [random.getrandbits(300) for _ in range(50)]
+        self.assertEqual(h2.h_many(xs), h.h_many(xs))
+
+
+class TestStructuredSets(unittest.TestCase):
+
+    @staticmethod
+    def exact_maxload(h, xs):
+        counts = {}
+        for y in h.hash_many_int(xs):
+            counts[y] = counts.get(y, 0) + 1
+        return max(counts.values())
+
+    def test_subspace_matches_enumeration(self):
+        l, u = 6, 100
+        h = fasthash.LinearHash(l, u, 4)
+        rng = random.Random(0)
+        x0 = rng.getrandbits(u)
+        basis = [rng.getrandbits(u) for _ in range(9)]
+        xs = []
+        for mask in range(1 << len(basis)):
+            x = x0
+            for j, b in enumerate(basis):
+                if (mask >> j) & 1:
+                    x ^= b
+            xs.append(x)
+        self.assertEqual(fasthash.maxload_subspace(h, x0, basis), self.exact_maxload(h, xs))
+        # on a linear subspace every non-empty bucket holds 2^(d - rank) keys
+        ml = fasthash.maxload_subspace(h, 0, basis[:4])
+        self.assertIn(ml, (1, 2, 4, 8, 16))
+
+    def test_subcube_matches_enumeration(self):
+        l, u = 5, 70
+        h = fasthash.LinearHash(l, u, 9)
+        x0 = (1 << 69) | 0b1011
+        free = [0, 3, 17, 64, 65, 69, 40]
+        xs = []
+        for mask in range(1 << len(free)):
+            x = x0
+            for j, b in enumerate(free):
+                x &= ~(1 << b)
+                x |= ((mask >> j) & 1) << b
+            xs.append(x)
+        self.assertEqual(fasthash.maxload_subcube(h, x0, free), self.exact_maxload(h, xs))
+
+    def test_hamming_ball_matches_enumeration(self):
+        from itertools import combinations
+        l, u = 7, 40
+        h = fasthash.LinearHash(l, u, 13)
+        center = random.Random(1).getrandbits(u)
+        xs = []
+        for w in range(3):
+            for pos in combinations(range(u), w):
+                x = center
+                for p in pos:
+                    x ^= 1 << p
+                xs.append(x)
+        self.assertEqual(fasthash.maxload_hamming_ball(h, center, 2), self.exact_maxload(h, xs))
+        self.assertEqual(fasthash.maxload_hamming_ball(h, center, 0), 1)
+
+
+def f2_rank(rows):
+    """Reference rank over F2 (rows as ints)."""
+    rank = 0
+    rows = list(rows)
+    while rows:
+        pivot = rows.pop()
+        if pivot == 0:
+            continue
+        rank += 1
+        low = pivot & -pivot
+        rows = [r ^ pivot if r & low else r for r in rows]
+    return rank
+
+
+class TestSubspaceExact(unittest.TestCase):
+
+    def test_bitmatrix_rank_matches_reference(self):
+        rng = random.Random(1)
+        for nrows, ncols in [(0, 5), (5, 0), (3, 3), (20, 9), (40, 130), (130, 40), (200, 200)]:
+            rows = [rng.getrandbits(ncols) if ncols else 0 for _ in range(nrows)]
+            # add dependent rows and duplicates
+            if nrows > 4:
+                rows[-1] = rows[0] ^ rows[1]
+                rows[-2] = rows[2]
+            m = fasthash.BitMatrix(rows, ncols)
+            self.assertEqual((m.nrows, m.ncols), (nrows, ncols))
+            self.assertEqual(m.rank(), f2_rank(rows))
+            if nrows:
+                self.assertEqual(m.row(0), rows[0])
+        # rank-deficient: 100 combinations of 5 vectors
+        basis = [rng.getrandbits(300) for _ in range(5)]
+        rows = []
+        for _ in range(100):
+            r = 0
+            for b in basis:
+                if rng.random() < 0.5:
+                    r ^= b
+            rows.append(r)
+        self.assertEqual(fasthash.BitMatrix(rows, 300).rank(), f2_rank(rows))
+
+    def test_exact_matches_enumeration_of_the_set(self):
+        l, u = 4, 90
+        rng = random.Random(3)
+        x0 = rng.getrandbits(u)
+        basis = [rng.getrandbits(u) for _ in range(6)]
+        basis.append(basis[0] ^ basis[1])  # dependent: S has 2^6 distinct elements
+        xs = set()
+        for mask in range(1 << len(basis)):
+            x = x0
+            for j, b in enumerate(basis):
+                if (mask >> j) & 1:
+                    x ^= b
+            xs.add(x)
+        for seed in range(5):
+            h = fasthash.LinearHash(l, u, seed)
+            counts = {}
+            for y in h.hash_many_int(sorted(xs)):
+                counts[y] = counts.get(y, 0) + 1
+            self.assertEqual(fasthash.maxload_subspace_exact(h, basis), max(counts.values()))
+
+    def test_trials_and_large_subspaces(self):
+        l, u = 20, 3000
+        rng = random.Random(5)
+        basis = [rng.getrandbits(u) for _ in range(40)]
+        seeds = list(range(8))
+        got = fasthash.maxload_subspace_exact_trials(u, l, basis, seeds, num_threads=3)
+        self.assertEqual(got, [fasthash.maxload_subspace_exact(fasthash.LinearHash(l, u, s), basis)
+                               for s in seeds])
+        # 2^40 keys into at most 2^20 buckets
+        self.assertTrue(all(ml >= 1 << 20 for ml in got))
+        # unit vectors: same as the subcube walk
+        h = fasthash.LinearHash(6, 64, 2)
+        cube = [1 << i for i in range(10)]
+        self.assertEqual(fasthash.maxload_subspace_exact(h, cube),
+                         fasthash.maxload_subcube(h, 0, list(range(10))))
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestHashManyBlocks(unittest.TestCase):
+
+    def _random_blocks(self, n, u, seed):
+        rng = random.Random(seed)
+        xs = [rng.getrandbits(u) for _ in range(n)]
+        arr = np.array([pack_int_to_u64_blocks(x, u) for x in xs], dtype=np.uint64)
+        return xs, arr
+
+    def test_matches_hash_many_int_and_dtypes(self):
+        for l, u, dtype in [(20, 3000, np.uint32), (64, 100, np.uint64), (130, 70, np.uint64)]:
+            h = fasthash.LinearHash(l, u, 11)
+            xs, arr = self._random_blocks(100, u, l)
+            ys = h.hash_many_blocks(arr)
+            self.assertEqual(ys.dtype, dtype)
+            expected = h.hash_many_int(xs)
+            if l <= 64:
+                self.assertEqual(ys.shape, (100,))
+                self.assertEqual([int(y) for y in ys], expected)
+            else:
+                self.assertEqual(ys.shape, (100, (l + 63) // 64))
+                self.assertEqual([blocks_to_int(int(b) for b in row) for row in ys], expected)
+
+    def test_out_parameter_and_flat_buffer(self):
+        l, u = 30, 128
+        h = fasthash.LinearHash(l, u, 3)
+        xs, arr = self._random_blocks(70, u, 1)
+        out = np.zeros(70, dtype=np.uint32)
+        res = h.hash_many_blocks(arr.reshape(-1), out=out)
+        self.assertTrue(np.shares_memory(res, out))
+        self.assertEqual([int(y) for y in out], h.hash_many_int(xs))
+
+    def test_bad_shapes_raise(self):
+        h = fasthash.LinearHash(30, 128, 3)
+        with self.assertRaises(ValueError):
+            h.hash_many_blocks(np.zeros((4, 3), dtype=np.uint64))
+        with self.assertRaises(ValueError):
+            h.hash_many_blocks(np.zeros((4, 2), dtype=np.uint64), out=np.zeros(4, dtype=np.uint64))
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestMaxloadFixedSMulti(unittest.TestCase):
+
+    def _exact_maxload(self, l, u, seed, S):
+        h = fasthash.LinearHash(l, u, seed)
+        counts = {}
+        for y in h.hash_many_int(S):
+            counts[y] = counts.get(y, 0) + 1
+        return max(counts.values())
+
+    def test_matches_separate_trials(self):
+        # l=70 straddles output blocks; l=30 with 40 seeds spans several stacked groups
+        for l, u, T in [(5, 100, 6), (70, 130, 3), (30, 200, 40)]:
+            rng = random.Random(l)
+            S = [rng.getrandbits(u) for _ in range(500)]
+            seeds = [rng.randrange(1 << 30) for _ in range(T)]
+            want = [self._exact_maxload(l, u, s, S) for s in seeds]
+            for counter in ["auto", "sort", "space_saving"] + (["dense"] if l <= 32 else []):
+                got = fasthash.maxload_fixed_S_multi(pack_ints_to_u64_array(S, u), u, l, seeds,
+                                                     counter=counter)
+                self.assertEqual(got, want, counter)
+
+    def test_space_saving_details_bound_the_max_load(self):
+        l, u = 12, 64
+        rng = random.Random(3)
+        S = [rng.getrandbits(u) for _ in range(4000)]
+        seeds = [rng.randrange(1 << 30) for _ in range(8)]
+        got = fasthash.maxload_fixed_S_multi(pack_ints_to_u64_array(S, u), u, l, seeds,
+                                             k=64, counter="space_saving", details=True)
+        for d, s in zip(got, seeds):
+            self.assertLessEqual(d["max_lb"], self._exact_maxload(l, u, s, S))
+            self.assertLessEqual(self._exact_maxload(l, u, s, S), d["max_load"])
+            self.assertEqual(d["max_exact"], d["max_lb"] == d["max_load"])
+        exact = fasthash.maxload_fixed_S_multi(pack_ints_to_u64_array(S, u), u, l, seeds, details=True)
+        self.assertTrue(all(d["max_exact"] and d["max_lb"] == d["max_load"] for d in exact))
+
+    def test_sort_counter_spills_under_a_small_budget(self):
+        l, u = 40, 64
+        rng = random.Random(4)
+        S = [rng.getrandbits(8) for _ in range(3000)]  # many repeats
+        seeds = [1, 2, 3]
+        got = fasthash.maxload_fixed_S_multi(pack_ints_to_u64_array(S, u), u, l, seeds,
+                                             counter="sort", mem_budget=1 << 12, num_threads=1)
+        self.assertEqual(got, [self._exact_maxload(l, u, s, S) for s in seeds])
+
+    def test_threads_do_not_change_result(self):
+        l, u = 4, 64
+        rng = random.Random(0)
+        S = pack_ints_to_u64_array([rng.getrandbits(u) for _ in range(3000)], u)
+        seeds = list(range(600))
+        self.assertEqual(fasthash.maxload_fixed_S_multi(S, u, l, seeds, num_threads=1),
+                         fasthash.maxload_fixed_S_multi(S, u, l, seeds, num_threads=4))
+
+    def test_bad_shape_raises(self):
+        with self.assertRaises(ValueError):
+            fasthash.maxload_fixed_S_multi(np.zeros((4, 3), dtype=np.uint64), 128, 10, [1])
+        with self.assertRaises(ValueError):
+            fasthash.maxload_fixed_S_multi(np.zeros((4, 1), dtype=np.uint64), 64, 40, [1], counter="dense")
+
+
+@unittest.skipIf(np is None, "numpy not installed")
+class TestSamplers(unittest.TestCase):
+
+    def _bits(self, u, n, dist, seed=1, **params):
+        X = fasthash.sample_blocks(u, n, dist, seed, params)
+        self.assertEqual(X.shape, (n, (u + 63) // 64))
+        return np.unpackbits(X.view(np.uint8), axis=1, bitorder="little")[:, :u].astype(np.int64)
+
+    def test_bernoulli_mean(self):
+        u, n = 130, 4000
+        # 0.5 / 0.75: few binary digits; 0.3: 32 digits; 0.01 / 0.99: geometric jumps;
+        # 1e-12 / 1 - 1e-12: below 32 digits, geometric jumps whatever u
+        for p in (0.0, 1e-12, 0.01, 0.3, 0.5, 0.75, 0.99, 1 - 1e-12, 1.0):
+            bits = self._bits(u, n, "bernoulli", p=p)
+            self.assertAlmostEqual(bits.mean(), p, delta=5 * (p * (1 - p) / (u * n)) ** 0.5 + 1e-12)
+
+    def test_hamming_weight_exact_and_uniform(self):
+        u = 100
+        for k in (0, 1, 30, 70, 99, 100):
+            self.assertTrue((self._bits(u, 300, "Hamming_weight", k=k).sum(axis=1) == k).all())
+        freq = self._bits(u, 20000, "Hamming_weight", k=70).mean(axis=0)
+        self.assertLess(np.abs(freq - 0.7).max(), 0.02)
+
+    def test_markov_transitions(self):
+        for p0, p1 in [(0.9, 0.2), (0.3, 0.05), (0.0, 1.0), (1.0, 0.0)]:
+            bits = self._bits(200, 3000, "Markov", p0=p0, p1=p1)
+            prev, nxt = bits[:, :-1], bits[:, 1:]
+            self.assertAlmostEqual(bits[:, 0].mean(), 0.5, delta=0.05)
+            self.assertAlmostEqual(nxt[prev == 1].mean(), p0, delta=0.01)
+            self.assertAlmostEqual(nxt[prev == 0].mean(), p1, delta=0.01)
+
+    def test_trials_hash_the_sampled_keys(self):
+        u, l, m = 150, 6, 2000
+        for dist, params in [("uniform", {}), ("bernoulli", {"p": 0.1}), ("Hamming_weight", {"k": 3}),
+                             ("Markov", {"p0": 0.8, "p1": 0.1})]:
+            got = fasthash.run_trials_maxload(u, l, m, dist, [7], [9], counter="dense", dist_params=params)
+            ys = fasthash.LinearHash(l, u, 9, gen="counter").hash_many_blocks(
+                fasthash.sample_blocks(u, m, dist, 7, params))
+            self.assertEqual(got, [int(np.bincount(ys).max())])
+
+    def test_legacy_rng_streams(self):
+        # legacy: S from one mt19937_64(seed_S) stream and M from gen="sequential"
+        u, l, m = 100, 8, 3 << 16
+        S = fasthash.sample_blocks(u, m, "uniform", 7, legacy_rng=True)
+        ys = fasthash.LinearHash(l, u, 9).hash_many_blocks(S)
+        self.assertEqual(fasthash.run_trials_maxload(u, l, m, "uniform", [7], [9], counter="dense", legacy_rng=True),
+                         [int(np.bincount(ys).max())])
+        self.assertFalse((S == fasthash.sample_blocks(u, m, "uniform", 7)).all())
+        # chunks of 2^16 keys: a prefix of S is the same S cut short
+        prefix = fasthash.sample_blocks(u, 70000, "uniform", 7)
+        self.assertTrue((prefix == fasthash.sample_blocks(u, m, "uniform", 7)[:70000]).all())
+
+    def test_derive_seed_matches_python(self):
+        for root, i in [(0, 0), (123, 5), ((1 << 64) - 1, 1 << 63)]:
+            self.assertEqual(fasthash.derive_seed(root, i), derive_seed(root, i))
+        self.assertEqual(derive_seed(1, 2, 3), derive_seed(derive_seed(1, 2), 3))
+        self.assertEqual(derive_seed(9), 9)
+
+    def test_bad_params_raise(self):
+        for dist, params in [("bernoulli", {"p": 1.5}), ("Hamming_weight", {"k": 101}), ("Markov", {"p0": -0.1}),
+                             ("uniform", {"q": 1}), ("binomial", {})]:
+            with self.assertRaises(ValueError):
+                fasthash.sample_blocks(100, 1, dist, 0, params)
+            with self.assertRaises(ValueError):
+                fasthash.run_trials_maxload(100, 8, 10, dist, [1], [2], dist_params=params)
+
+    def test_distinct_keys(self):
+        # 100 keys of weight 1 among u = 100: S is every unit vector once
+        u, l, params = 100, 12, {"k": 1}
+        S = fasthash.sample_blocks(u, 100, "Hamming_weight", 7, params, distinct=True)
+        self.assertEqual(len({row.tobytes() for row in S}), 100)
+        self.assertTrue((fasthash.sample_blocks(u, 100, "Hamming_weight", 7, params)[:5] == S[:5]).all())
+        ys = fasthash.LinearHash(l, u, 9, gen="counter").hash_many_blocks(S)
+        # the set takes 4 KiB of the budget: 4 partitioned passes, each drawing S again
+        for counter, passes in [("dense", 1), ("partitioned", 4), ("sort", 1)]:
+            r, = fasthash.run_trials_maxload(u, l, 100, "Hamming_weight", [7], [9], counter=counter, details=True,
+                                            dist_params=params, distinct=True, mem_budget=5 << 10)
+            self.assertEqual(r["max_load"], int(np.bincount(ys).max()))
+            self.assertEqual(r["keys"], 100 * passes)
+            self.assertEqual(r["draws"], r["keys"] + r["duplicates"])
+            self.assertGreater(r["duplicates"], 0)
+            self.assertGreaterEqual(r["dedup_seconds"], 0.0)
+        # one thread draws a distinct S
+        self.assertEqual(fasthash.run_trials_maxload(u, l, 100, "Hamming_weight", [7], [9], dist_params=params,
+                                                     distinct=True, threads_per_trial=2),
+                         [int(np.bincount(ys).max())])
+        # 101 distinct keys do not exist; the set must fit in the budget
+        with self.assertRaises(RuntimeError):
+            fasthash.run_trials_maxload(u, l, 101, "Hamming_weight", [7], [9], dist_params=params, distinct=True)
+        with self.assertRaises(ValueError):
+            fasthash.run_trials_maxload(u, l, 1 << 16, "uniform", [7], [9], distinct=True, mem_budget=1 << 16)
+
+
+class TestTrialCounters(unittest.TestCase):
+
+    def run_trials(self, u, l, m, num_threads=2, **kw):
+        return fasthash.run_trials_maxload(u, l, m, "uniform", [1, 2, 3], [4, 5, 6], num_threads=num_threads, **kw)
+
+    def test_dense_matches_exact_space_saving(self):
+        # k >= number of buckets: Space-Saving is exact too
+        for u, l, m in [(100, 8, 3000),     # dense8
+                        (64, 4, 5000),      # dense16 (mean load >= 64)
+                        (2, 8, 8000)]:      # 4 distinct keys: uint8 counters spill
+            dense = self.run_trials(u, l, m, counter="dense")
+            exact = self.run_trials(u, l, m, counter="space_saving", k=1 << l)
+            self.assertEqual(dense, exact)
+        self.assertGreater(max(self.run_trials(2, 8, 8000, counter="dense")), 255)
+
+    def test_sort_matches_exact_counts(self):
+        # l <= 32 against the dense counter; l = 70 (two words) and l = 200
+        # (128-bit fingerprints) against Space-Saving with k >= m
+        for u, l, m in [(100, 12, 5000), (2, 12, 3000), (100, 70, 3000), (300, 200, 3000)]:
+            expected = (self.run_trials(u, l, m, counter="dense") if l <= 32 else
+                        self.run_trials(u, l, m, counter="space_saving", k=m))
+            self.assertEqual(self.run_trials(u, l, m, counter="sort"), expected)
+            # runs of 1024 keys spilled to temp files and merged
+            self.assertEqual(self.run_trials(u, l, m, counter="sort", mem_budget=1), expected)
+
+    def test_partitioned_matches_exact_counts(self):
+        # mem_budget forces 4 passes for l = 14 (and 2^5 for l = 34: 2 threads
+        # share the budget) over the regenerated S
+        for u, l, m, budget in [(100, 14, 5000, 1 << 13), (2, 14, 3000, 1 << 13), (100, 34, 3000, 1 << 30)]:
+            expected = (self.run_trials(u, l, m, counter="dense") if l <= 32 else
+                        self.run_trials(u, l, m, counter="sort"))
+            self.assertEqual(self.run_trials(u, l, m, counter="partitioned", mem_budget=budget), expected)
+
+    def test_threads_per_trial(self):
+        # 5 chunks of 2^16 keys, each from its own jumped xoshiro256**
+        # substream: S is the same for 1, 2 and 3 threads, so the exact
+        # counters agree
+        u, l, m = 100, 14, 5 << 16
+        for counter, kw in [("dense", {}), ("partitioned", {"mem_budget": 1 << 13}), ("sort", {}),
+                            ("sort", {"mem_budget": 1})]:
+            two = self.run_trials(u, l, m, counter=counter, threads_per_trial=2, **kw)
+            three = self.run_trials(u, l, m, counter=counter, num_threads=3, threads_per_trial=3, **kw)
+            self.assertEqual(two, three)
+            self.assertEqual(two, self.run_trials(u, l, m, counter=counter, **kw))
+            self.assertEqual(two, self.run_trials(u, l, m, counter="dense", threads_per_trial=2))
+        # legacy_rng: chunk-seeded mt19937_64 substreams, the same for 2 and 3 threads
+        self.assertEqual(self.run_trials(u, l, m, counter="dense", threads_per_trial=2, legacy_rng=True),
+                         self.run_trials(u, l, m, counter="sort", num_threads=3, threads_per_trial=3,
+                                         legacy_rng=True))
+        # merged Space-Saving summaries bound the exact max-load from above,
+        # and are exact when k covers every bucket
+        exact = self.run_trials(u, l, m, counter="dense", threads_per_trial=2)
+        ss = self.run_trials(u, l, m, counter="space_saving", k=1000, threads_per_trial=2)
+        self.assertTrue(all(s >= e for s, e in zip(ss, exact)))
+        self.assertEqual(self.run_trials(u, 8, 1 << 17, counter="space_saving", k=256, threads_per_trial=2),
+                         self.run_trials(u, 8, 1 << 17, counter="dense", num_threads=3, threads_per_trial=3))
+        with self.assertRaises(ValueError):
+            self.run_trials(u, l, 10, threads_per_trial=0)
+
+    def test_thresholds_stop_early(self):
+        u, l, m = 100, 12, 3 << 16
+        for counter, kw in [("dense", {}), ("partitioned", {"mem_budget": 1 << 11}), ("sort", {}),
+                            ("space_saving", {"k": 1000})]:
+            for tpt in (1, 2):
+                full = self.run_trials(u, l, m, counter=counter, threads_per_trial=tpt, **kw)
+                ts = [min(full) - 1, max(full), max(full) + 1, 10 * max(full)]
+                res = self.run_trials(u, l, m, counter=counter, threads_per_trial=tpt, thresholds=ts,
+                                      details=True, **kw)
+                for f, r in zip(full, res):
+                    self.assertEqual([r["max_load"] >= t for t in ts], [f >= t for t in ts])
+                    self.assertEqual(r["reached"], r["max_load"] >= max(ts))
+                    if not r["stopped"]:
+                        self.assertGreaterEqual(r["keys"], m)  # all of S (every pass)
+
+        # reaching the largest threshold ends the trial, the rest of S is skipped
+        res = self.run_trials(u, l, m, counter="dense", thresholds=[3], details=True)
+        self.assertTrue(all(r["reached"] and r["stopped"] and r["keys"] < m // 100 for r in res))
+        # too few keys for the threshold: nothing is counted
+        res = self.run_trials(u, l, 100, thresholds=[101], details=True)
+        self.assertEqual([(r["keys"], r["reached"]) for r in res], [(0, False)] * 3)
+
+    def test_space_saving_bounds(self):
+        u, l, m = 100, 10, 1 << 17
+        for tpt in (1, 2):
+            exact = self.run_trials(u, l, m, counter="dense", threads_per_trial=tpt)
+            for k in (50, 300, 1 << l):
+                res = self.run_trials(u, l, m, counter="space_saving", k=k, threads_per_trial=tpt, details=True)
+                for r, e in zip(res, exact):
+                    self.assertLessEqual(r["max_lb"], e)
+                    self.assertGreaterEqual(r["max_load"], e)
+                    self.assertLessEqual(r["max_load"] - r["max_err"], r["max_lb"])
+                    self.assertEqual(r["max_exact"], r["max_lb"] == r["max_load"])
+                    if k == 1 << l:  # the table never fills up
+                        self.assertTrue(r["max_exact"])
+                        self.assertEqual((r["max_load"], r["max_err"]), (e, 0))
+        for r, e in zip(self.run_trials(u, l, m, counter="sort", threads_per_trial=2, details=True), exact):
+            self.assertEqual((r["max_load"], r["max_lb"], r["max_err"], r["max_exact"]), (e, e, 0, True))
+
+    @unittest.skipIf(np is None, "numpy not installed")
+    def test_load_stats(self):
+        u, l, m = 100, 10, 1 << 17
+        for tpt in (1, 2):
+            exact = self.run_trials(u, l, m, counter="dense", threads_per_trial=tpt, stats=True, top_n=5)
+            for r in exact:
+                hist = r["hist"]
+                self.assertTrue(r["exact"])
+                self.assertEqual(hist.dtype, np.uint64)
+                self.assertEqual(int(hist.sum()), 1 << l)
+                self.assertEqual(int((np.arange(len(hist)) * hist).sum()), m)
+                self.assertEqual(len(hist) - 1, r["max_load"])
+                self.assertEqual(r["sum_sq"][0], int((np.arange(len(hist)) ** 2 * hist).sum()))
+                self.assertEqual(r["sum_sq"][0], r["sum_sq"][1])
+                self.assertEqual(r["max_load_bounds"], (r["max_load"], r["max_load"]))
+                self.assertEqual(r["top"][0], r["max_load"])
+                self.assertEqual(list(r["top"]), sorted(r["top"], reverse=True))
+                self.assertEqual(list(r["top_err"]), [0] * 5)
+
+            def key(r):
+                return (r["max_load"], r["hist"].tolist(), r["top"].tolist(), r["sum_sq"])
+
+            for counter, kw in [("sort", {}), ("sort", {"mem_budget": 1}), ("partitioned", {"mem_budget": 1 << 8}),
+                                ("space_saving", {"k": 1 << l})]:
+                got = self.run_trials(u, l, m, counter=counter, threads_per_trial=tpt, stats=True, top_n=5, **kw)
+                self.assertEqual([key(r) for r in got], [key(r) for r in exact])
+
+            # Space-Saving with k < 2^l: the bounds hold the exact values
+            approx = self.run_trials(u, l, m, counter="space_saving", k=300, threads_per_trial=tpt, stats=True)
+            for a, e in zip(approx, exact):
+                self.assertFalse(a["exact"])
+                self.assertLessEqual(a["sum_sq"][0], e["sum_sq"][0])
+                self.assertGreaterEqual(a["sum_sq"][1], e["sum_sq"][0])
+                self.assertLessEqual(a["max_load_bounds"][0], e["max_load"])
+                self.assertGreaterEqual(a["max_load_bounds"][1], e["max_load"])
+                self.assertEqual(a["max_load"], a["max_load_bounds"][1])
+
+    def test_counter_choice(self):
+        self.assertEqual(fasthash.trial_counter(20, 1 << 20), "dense8")
+        self.assertEqual(fasthash.trial_counter(10, 1 << 20), "dense16")
+        self.assertEqual(fasthash.trial_counter(40, 1 << 20), "sort")
+        self.assertEqual(fasthash.trial_counter(40, 1 << 20, mem_budget=1000), "space_saving")
+        self.assertEqual(fasthash.trial_counter(20, 1 << 20, mem_budget=1000), "space_saving")
+        self.assertEqual(fasthash.trial_counter(20, 1 << 10, mem_budget=1 << 16), "sort")
+        self.assertEqual(fasthash.trial_counter(20, 1 << 20, "dense", mem_budget=1000), "dense8")
+        self.assertEqual(fasthash.trial_counter(36, 1 << 40, mem_budget=1 << 32), "partitioned")
+        self.assertEqual(fasthash.trial_counter(36, 1 << 40, mem_budget=1 << 30), "space_saving")
+        self.assertEqual(fasthash.trial_counter(20, 1 << 20, "partitioned", mem_budget=1000), "partitioned")
+        with self.assertRaises(ValueError):
+            fasthash.trial_counter(70, 10, "partitioned")
+        with self.assertRaises(ValueError):
+            fasthash.trial_counter(40, 10, "dense")
+        with self.assertRaises(ValueError):
+            self.run_trials(100, 40, 10, counter="dense")
+        with self.assertRaises(ValueError):
+            self.run_trials(100, 8, 10, counter="bogus")
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
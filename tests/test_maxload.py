@@ -0,0 +1,105 @@
+# tests/test_maxload.py
+
+# Unit tests for Maxload in src/experiments/maxload.py
+
+import random
+from collections import Counter
+
+import pytest
+
+from src.experiments import maxload as maxload_mod
+from src.experiments.maxload import Maxload
+from src.hashing.linear_f2 import hash_f2
+
+
+def exact_counts(h, S):
+    return Counter(h.h(x) for x in S)
+
+
+def make_case(l, u, m, seed=0):
+    rng = random.Random(seed)
+    S = [rng.getrandbits(u) for _ in range(m)]
+    h = hash_f2(l=l, u=u, seed=seed, backend="python")
+    return h, S
+
+
+# dense array (l=10), sorted arrays (l=40, or 2^l over budget), dict (l > 64)
+@pytest.mark.parametrize("l,mem_budget", [(10, 1 << 30), (40, 1 << 30), (70, 1 << 30), (20, 1 << 20)])
+def test_exact_path_matches_counter(l, mem_budget):
+    h, S = make_case(l, 100, 3000)
+    truth = exact_counts(h, S)
+    ml, snap = Maxload(u=100, l=l, h=h).max_load(S, k=5, chunk_size=256, mem_budget=mem_budget)
+    assert ml == max(truth.values())
+    assert len(snap) == min(5, len(truth))
+    for y, (c, e) in snap.items():
+        assert (c, e) == (truth[y], 0)
+
+
+def test_exact_path_without_numpy(monkeypatch):
+    monkeypatch.setattr(maxload_mod, "np", None)
+    h, S = make_case(8, 50, 2000)
+    ml, _ = Maxload(u=50, l=8, h=h).max_load(S, chunk_size=100)
+    assert ml == max(exact_counts(h, S).values())
+
+
+def test_falls_back_to_space_saving_when_memory_exceeded():
+    h, S = make_case(40, 100, 3000)
+    true_max = max(exact_counts(h, S).values())
+    # about 20 distinct keys fit: exact for the first chunk only
+    ml, snap = Maxload(u=100, l=40, h=h).max_load(S, k=50, chunk_size=16, mem_budget=1000)
+    assert ml >= true_max
+    assert len(snap) <= 50
+    with pytest.raises(MemoryError):
+        Maxload(u=100, l=40, h=h).max_load(S, k=50, chunk_size=16, exact=True, mem_budget=1000)
+
+
+def test_space_saving_only_is_exact_when_k_covers_all_buckets():
+    h, S = make_case(6, 100, 2000)
+    ml, snap = Maxload(u=100, l=6, h=h).max_load(S, k=64, exact=False)
+    truth = exact_counts(h, S)
+    assert ml == max(truth.values())
+    assert {y: c for y, (c, _e) in snap.items()} == dict(truth)
+
+
+@pytest.mark.parametrize("exact,l,mem_budget", [(None, 10, 1 << 30), (None, 40, 1 << 30), (None, 70, 1 << 30),
+                                                (False, 10, 1 << 30), (None, 40, 1000)])
+def test_thresholds_decide_like_full_count(exact, l, mem_budget):
+    h, S = make_case(l, 100, 3000)
+    ml = Maxload(u=100, l=l, h=h)
+    full, _ = ml.max_load(S, k=50, chunk_size=64, exact=exact, mem_budget=mem_budget)
+    ts = [1, full, full + 1, 3 * full]
+    got, _snap, info = ml.max_load(S, k=50, chunk_size=64, exact=exact, mem_budget=mem_budget,
+                                   thresholds=ts, details=True)
+    assert [got >= t for t in ts] == [full >= t for t in ts]
+    assert info["reached"] == (got >= max(ts))
+    assert info["stopped"] == (info["keys"] < len(S))
+
+
+def test_thresholds_stop_early():
+    h, S = make_case(4, 100, 3000)
+    got, _snap, info = Maxload(u=100, l=4, h=h).max_load(S, chunk_size=64, thresholds=[5], details=True)
+    assert got >= 5 and info["reached"] and info["stopped"] and info["keys"] == 64
+    # without len(S), only reaching the largest threshold can stop the count
+    _got, _snap, info = Maxload(u=100, l=4, h=h).max_load(iter(S), chunk_size=64, thresholds=[10 ** 6],
+                                                          details=True)
+    assert not info["stopped"] and info["keys"] == len(S)
+    # len(S) below the smallest threshold: nothing to count
+    assert Maxload(u=100, l=4, h=h).max_load(S, thresholds=[len(S) + 1]) == (0, {})
+
+
+def test_packed_blocks_match_int_keys():
+    np = pytest.importorskip("numpy")
+    from src.hashing.sampling import get_samples_batch
+    u, m = 100, 3000
+    for l, backend in [(10, "cpp"), (40, "cpp"), (70, "cpp"), (10, "python")]:
+        h = hash_f2(l=l, u=u, seed=3, backend=backend)
+        X = get_samples_batch(u, m, "bernoulli", 4, p=0.2)
+        S = [int.from_bytes(row.astype("<u8").tobytes(), "little") for row in X]
+        ml = Maxload(u=u, l=l, h=h)
+        truth = ml.max_load(S, chunk_size=256)
+        assert ml.max_load(X, chunk_size=256) == truth
+        assert ml.max_load(iter(np.array_split(X, 7)))[0] == truth[0]
+        assert ml.max_load(X, k=50, exact=False)[0] == ml.max_load(S, k=50, exact=False)[0]
+    got, _snap, info = Maxload(u=u, l=4, h=hash_f2(l=4, u=u, seed=3)).max_load(
+        X, chunk_size=64, thresholds=[5], details=True)
+    assert got >= 5 and info["stopped"] and info["keys"] == 64
@@ -3,6 +3,8 @@
 # Tests for the hash_f2 class in src/hashing/linear_f2.py
 # This test is generated by ChatGPT based on the provided code snippet.
 
+import pickle
+
 import pytest
 from src.hashing.linear_f2 import hash_f2
 
@@ -117,3 +119,96 @@ def test_different_seeds_usually_give_different_M():
     h2 = hash_f2(l=l, u=u, seed=2, has_cpp=False)
 
     assert h1.M != h2.M
+
+
+def test_sparse_path_matches_row_parities():
+    l, u = 40, 300
+    h = hash_f2(l=l, u=u, seed=77, has_cpp=False)
+    positions = [0, 5, 63, 64, 299]
+    x = 0
+    for k in positions:
+        x |= 1 << k
+    # low weight x goes through the columns of M; check against the rows
+    expected = 0
+    for i, row in enumerate(h.M):
+        expected |= parity_naive(row & x) << i
+    assert h.h(x) == expected
+    assert h.h_sparse(positions) == expected
+    assert h.h_sparse([]) == 0
+    for k in (0, 150, u - 1):
+        assert h.h(1 << k) == h.cols[k]
+
+
+def test_h_sparse_rejects_out_of_range_index():
+    h = hash_f2(l=8, u=16, seed=1, has_cpp=False)
+    with pytest.raises(ValueError):
+        h.h_sparse([16])
+
+
+@pytest.mark.parametrize("l,u", [(12, 20), (30, 200), (64, 64), (100, 130)])
+def test_numpy_backend_matches_python_backend(l, u):
+    np = pytest.importorskip("numpy")
+    hp = hash_f2(l=l, u=u, seed=555, backend="python")
+    hn = hash_f2(l=l, u=u, seed=555, backend="numpy")
+    assert hn.M == hp.M
+
+    import random
+    rng = random.Random(1)
+    xs = [0, 1, (1 << u) - 1] + [rng.getrandbits(u) for _ in range(50)]
+    assert hn.h_many(xs) == hp.h_many(xs)
+    assert hn.h(xs[5]) == hp.h(xs[5])
+
+    ys = hn.h_many_blocks(hn.pack(xs))
+    assert ys.dtype == (np.uint32 if l <= 32 else np.uint64)
+    assert ys.shape[0] == len(xs)
+
+
+@pytest.mark.parametrize("l,u", [(12, 20), (32, 100), (33, 100), (64, 64), (100, 130)])
+def test_numpy_and_cpp_blocks_have_the_same_dtype(l, u):
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("fasthash")
+    hn = hash_f2(l=l, u=u, seed=9, backend="numpy", gen="counter")
+    hc = hash_f2(l=l, u=u, seed=9, backend="cpp", gen="counter")
+    X = hn.pack([3, 5, (1 << u) - 1])
+    yn, yc = hn.h_many_blocks(X), hc.h_many_blocks(X)
+    assert yn.dtype == yc.dtype
+    assert yn.shape == yc.shape
+    assert (yn == yc).all()
+
+
+def test_numpy_backend_rejects_out_of_range_x():
+    pytest.importorskip("numpy")
+    h = hash_f2(l=5, u=8, seed=7, backend="numpy")
+    with pytest.raises(ValueError):
+        h.h(1 << 8)
+
+
+def test_unknown_backend_raises():
+    with pytest.raises(ValueError):
+        hash_f2(l=5, u=8, seed=7, backend="fortran")
+
+
+@pytest.mark.parametrize("l,u", [(7, 50), (70, 130)])
+def test_counter_gen_rows_are_pure_functions_of_seed(l, u):
+    h = hash_f2(l=l, u=u, seed=5, backend="python", gen="counter")
+    lazy = hash_f2(l=l, u=u, seed=5, backend="python", gen="counter")
+    # rows and columns generated on demand match the materialised matrix
+    assert [lazy.row(i) for i in reversed(range(l))] == list(reversed(h.M))
+    idx = [0, u - 1, 3, 3, u // 2]
+    assert lazy.h_sparse(idx) == h.h_sparse(idx)
+    assert lazy._M is None
+    assert all(0 <= row < (1 << u) for row in h.M)
+    assert h.M != hash_f2(l=l, u=u, seed=6, backend="python", gen="counter").M
+
+
+def test_counter_gen_pickles_without_matrix():
+    h = hash_f2(l=20, u=200, seed=9, backend="python", gen="counter")
+    _ = h.M
+    h2 = pickle.loads(pickle.dumps(h))
+    assert h2._M is None
+    assert h2.M == h.M
+
+
+def test_unknown_gen_raises():
+    with pytest.raises(ValueError):
+        hash_f2(l=4, u=8, seed=0, backend="python", gen="bogus")
@@ -0,0 +1,53 @@
+# tests/test_runner.py
+
+# The S drawn by the experiment grids of src/experiments/runner.py
+
+import random
+
+import pytest
+
+from src.experiments import runner
+from src.hashing import sampling
+from src.hashing.linear_f2 import pack_ints_to_u64_array
+
+pytest.importorskip("numpy")
+
+
+def test_grid_legacy_rng_draws_the_S_of_older_versions(monkeypatch):
+    seen = []
+    monkeypatch.setattr(runner, "estimate_prob_fixed_S", lambda S, **kw: seen.append(S) or 0.0)
+    runner.run_experiment_grid(u_values=[20], l_values=[3], r_values=[1.0], m_factor=1, trials=1,
+                               dist="bernoulli", dist_params={"p": 0.3}, seed=7, legacy_rng=True)
+    # make_S(m=8, u=20, rng=random.Random(7), dist="bernoulli", p=0.3) before the batch samplers
+    expected = [52554, 57658, 84498, 295936, 540983, 32871, 417524, 170690]
+    assert (seen[0] == pack_ints_to_u64_array(expected, 20)).all()
+
+
+def test_grid_not_fixed_S_legacy_rng_draws_the_S_of_older_versions(monkeypatch):
+    seen = []
+
+    class Recorder:
+        def __init__(self, **kw):
+            pass
+
+        def max_load(self, S, **kw):
+            seen.append(list(S))
+            return 0, {}
+
+    monkeypatch.setattr(runner, "Maxload", Recorder)
+    monkeypatch.setattr(runner, "hash_f2", lambda **kw: None)
+    runner.run_experiment_grid_not_fixed_S(u_values=[20], l_values=[3], r_values=[1.0], m_factor=1, trials=1,
+                                           dist="Markov", dist_params={"p0": 0.8, "p1": 0.1}, seed=7,
+                                           legacy_rng=True)
+    # seed_S = random.Random(7).randrange(1 << 30), then make_S_iter before the batch samplers
+    assert random.Random(7).randrange(1 << 30) == 695425564
+    assert seen == [[390032, 14576, 919296, 987135, 528383, 0, 231308, 991232]]
+
+
+def test_grid_draws_S_in_one_batch_by_default(monkeypatch):
+    seen = []
+    monkeypatch.setattr(runner, "estimate_prob_fixed_S", lambda S, **kw: seen.append(S) or 0.0)
+    runner.run_experiment_grid(u_values=[20], l_values=[3], r_values=[1.0], m_factor=1, trials=1,
+                               dist="bernoulli", dist_params={"p": 0.3}, seed=7)
+    expected = sampling.get_samples_batch(20, 8, "bernoulli", random.Random(7), p=0.3)
+    assert (seen[0] == expected).all()
@@ -12,6 +12,10 @@ from src.hashing.sampling import (
     sample_Hamming_weight,
     sample_Markov,
     get_sample_x,
+    get_samples_batch,
+    iter_samples_batch,
+    iter_distinct_samples,
+    DistinctKeys,
 )
 
 def popcount(x: int) -> int:
@@ -169,6 +173,62 @@ def test_sample_markov_first_bit_only_depends_on_initial_coinflip():
     assert x1 == x2
     assert x1 in (0, 1)
 
+def test_sample_bernoulli_word_parallel_digits():
+    # p = 1/2: one word; p = 3/4 = 0.11b: the OR of two words
+    assert sample_bernoulli(200, 0.5, random.Random(5)) == random.Random(5).getrandbits(200)
+    rng = random.Random(5)
+    assert sample_bernoulli(200, 0.75, random.Random(5)) == rng.getrandbits(200) | rng.getrandbits(200)
+
+def test_sample_bernoulli_small_u_draws_bit_by_bit():
+    from src.hashing import sampling
+    # 53 digits to walk for p = 0.3: u = 64 is cheaper as one rng.random() per bit
+    x = sample_bernoulli(64, 0.3, random.Random(5))
+    assert x == sampling._sample_bernoulli_bitwise(64, 0.3, random.Random(5))
+    # p = 1/2 is a single digit, word-parallel even for a small u
+    assert sample_bernoulli(8, 0.5, random.Random(5)) == random.Random(5).getrandbits(8)
+
+@pytest.mark.parametrize("u,p", [(500, 0.01), (500, 0.3), (500, 0.5), (500, 0.9), (16, 0.01), (64, 0.3)])
+def test_sample_bernoulli_bit_frequency(u, p):
+    rng = random.Random(1)
+    n = 200 * 500 // u
+    ones = sum(popcount(sample_bernoulli(u, p, rng)) for _ in range(n))
+    assert abs(ones / (u * n) - p) < 5 * (p * (1 - p) / (u * n)) ** 0.5
+
+# geometric runs (long runs) and word-parallel chains (short runs)
+@pytest.mark.parametrize("u,p0,p1", [(2000, 0.99, 0.01), (64, 0.9, 0.1), (2000, 0.5, 0.5), (2000, 0.7, 0.2),
+                                     (2000, 0.0, 1.0), (2000, 1.0, 0.0)])
+def test_sample_markov_transition_frequencies(u, p0, p1):
+    rng = random.Random(2)
+    stay = {1: 0, 0: 0}
+    ones_after = {1: 0, 0: 0}
+    for _ in range(100 if u > 64 else 2000):
+        x = sample_Markov(u, p0, p1, rng)
+        for i in range(1, u):
+            prev = (x >> (i - 1)) & 1
+            stay[prev] += 1
+            ones_after[prev] += (x >> i) & 1
+    for prev, p in ((1, p0), (0, p1)):
+        if stay[prev] > 1000:
+            assert abs(ones_after[prev] / stay[prev] - p) < 0.02
+
+def test_markov_words_follows_the_chain():
+    # the prefix-XOR resolution gives the bit-by-bit chain on the same A, B words
+    from src.hashing import sampling
+    u = 300
+    for p0, p1 in [(0.5, 0.5), (0.8, 0.3), (0.1, 0.9)]:
+        d0, d1 = sampling._bernoulli_digits(p0), sampling._bernoulli_digits(p1)
+        for seed in range(5):
+            for bit in (0, 1):
+                x = sampling._markov_words(u, bit, d0, d1, random.Random(seed))
+                rng = random.Random(seed)
+                A = sampling._bernoulli_word(u, *d0, rng)
+                B = sampling._bernoulli_word(u, *d1, rng)
+                expected = bit
+                for i in range(1, u):
+                    bit = ((A if bit else B) >> i) & 1
+                    expected |= bit << i
+                assert x == expected
+
 # ---------------------------
 #   Dispatcher tests
 # ---------------------------
@@ -188,6 +248,17 @@ def test_get_sample_x_hamming_weight_dispatch_and_params():
     x = get_sample_x(u=16, rng=rng, dist="Hamming_weight", k=5)
     assert popcount(x) == 5
 
+# x drawn by older versions (one rng.random() per bit) from random.Random(7), u = 20
+@pytest.mark.parametrize("dist,params,expected", [
+    ("uniform", {}, [339563, 993908, 158176, 414002]),
+    ("bernoulli", {"p": 0.3}, [52554, 57658, 84498, 295936]),
+    ("Hamming_weight", {"k": 5}, [5142, 133194, 401414, 139398]),
+    ("Markov", {"p0": 0.8, "p1": 0.1}, [8191, 1040386, 983167, 793600]),
+])
+def test_get_sample_x_legacy_rng_reproduces_older_versions(dist, params, expected):
+    rng = random.Random(7)
+    assert [get_sample_x(u=20, rng=rng, dist=dist, legacy_rng=True, **params) for _ in range(4)] == expected
+
 def test_get_sample_x_unknown_dist_raises_keyerror():
     rng = random.Random(0)
     with pytest.raises((ValueError, TypeError, KeyError)):
@@ -214,3 +285,174 @@ def test_get_sample_x_markov_missing_params_raises_typeerror():
     rng = random.Random(0)
     with pytest.raises(TypeError):
         get_sample_x(u=16, rng=rng, dist="Markov", p0=0.7)  # missing p1
+
+
+# ---------------------------
+#   Batch sampler tests
+# ---------------------------
+
+def batch_ints(X) -> list:
+    return [int.from_bytes(row.astype("<u8").tobytes(), "little") for row in X]
+
+def bit_means(xs, u: int):
+    np = pytest.importorskip("numpy")
+    return np.array([[(x >> i) & 1 for i in range(u)] for x in xs]).mean(axis=0)
+
+BATCH_CASES = [
+    ("uniform", {}),
+    ("bernoulli", {"p": 0.3}),
+    ("bernoulli", {"p": 0.75}),
+    ("Hamming_weight", {"k": 5}),
+    ("Hamming_weight", {"k": 60}),
+    ("Markov", {"p0": 0.8, "p1": 0.1}),
+]
+
+@pytest.mark.parametrize("dist,params", BATCH_CASES)
+@pytest.mark.parametrize("u", [1, 63, 64, 70])
+def test_get_samples_batch_shape_and_range(dist, params, u):
+    np = pytest.importorskip("numpy")
+    if dist == "Hamming_weight" and params["k"] > u:
+        pytest.skip("k > u")
+    X = get_samples_batch(u, 50, dist, 0, **params)
+    assert X.shape == (50, (u + 63) // 64) and X.dtype == np.uint64
+    assert all(0 <= x < (1 << u) for x in batch_ints(X))
+
+@pytest.mark.parametrize("dist,params", BATCH_CASES)
+def test_get_samples_batch_matches_per_int_sampler(dist, params):
+    # same distribution as get_sample_x: bit frequencies and popcount moments agree
+    np = pytest.importorskip("numpy")
+    u, n = 70, 3000
+    rng = random.Random(1)
+    ref = [get_sample_x(u=u, rng=rng, dist=dist, **params) for _ in range(n)]
+    got = batch_ints(get_samples_batch(u, n, dist, np.random.default_rng(2), **params))
+    assert np.abs(bit_means(got, u) - bit_means(ref, u)).max() < 0.06
+    pc_ref = np.array([popcount(x) for x in ref])
+    pc_got = np.array([popcount(x) for x in got])
+    assert abs(pc_got.mean() - pc_ref.mean()) < 0.1 * u ** 0.5 + 0.5
+    assert abs(pc_got.std() - pc_ref.std()) < 0.15 * pc_ref.std() + 0.2
+
+def test_get_samples_batch_edge_cases():
+    pytest.importorskip("numpy")
+    assert batch_ints(get_samples_batch(70, 5, "bernoulli", 0, p=0.0)) == [0] * 5
+    assert batch_ints(get_samples_batch(70, 5, "bernoulli", 0, p=1.0)) == [(1 << 70) - 1] * 5
+    assert batch_ints(get_samples_batch(70, 5, "Hamming_weight", 0, k=70)) == [(1 << 70) - 1] * 5
+    assert all(popcount(x) == 40 for x in batch_ints(get_samples_batch(70, 50, "Hamming_weight", 0, k=40)))
+    # p0 = p1 = 0: only bit 0 can be set; p0 = p1 = 1: all ones past bit 0
+    assert set(batch_ints(get_samples_batch(32, 50, "Markov", 0, p0=0.0, p1=0.0))) <= {0, 1}
+    assert set(batch_ints(get_samples_batch(32, 50, "Markov", 0, p0=1.0, p1=1.0))) <= {(1 << 32) - 1, (1 << 32) - 2}
+    assert get_samples_batch(8, 0, "uniform", 0).shape == (0, 1)
+    # a seed, a random.Random or a Generator
+    assert (get_samples_batch(100, 4, "uniform", 5) == get_samples_batch(100, 4, "uniform", 5)).all()
+    get_samples_batch(100, 4, "uniform", random.Random(0))
+
+@pytest.mark.parametrize("dist,params", [
+    ("bernoulli", {"p": 1.5}),
+    ("Hamming_weight", {"k": 9}),
+    ("Markov", {"p0": -0.1, "p1": 0.5}),
+    ("unknown", {}),
+])
+def test_get_samples_batch_invalid_params(dist, params):
+    pytest.importorskip("numpy")
+    with pytest.raises(ValueError):
+        get_samples_batch(8, 10, dist, 0, **params)
+    with pytest.raises(ValueError):
+        iter_samples_batch(8, 10, dist, 0, **params)
+
+def test_get_samples_batch_missing_param_raises_typeerror():
+    pytest.importorskip("numpy")
+    with pytest.raises(TypeError):
+        get_samples_batch(8, 10, "bernoulli", 0)
+    with pytest.raises(TypeError):
+        get_samples_batch(8, 10, "uniform", 0, p=0.5)
+
+def test_iter_samples_batch_chunks():
+    np = pytest.importorskip("numpy")
+    chunks = list(iter_samples_batch(100, 1000, "Hamming_weight", 3, chunk_size=300, k=7))
+    assert [len(c) for c in chunks] == [300, 300, 300, 100]
+    X = np.concatenate(chunks)
+    assert X.shape == (1000, 2)
+    assert all(popcount(x) == 7 for x in batch_ints(X))
+    assert list(iter_samples_batch(100, 0, "uniform", 3)) == []
+
+
+# ---------------------------
+#   Distinct keys (S as a set)
+# ---------------------------
+
+def test_iter_distinct_samples_has_no_repeats():
+    # 64 keys of weight 1 among u = 64: every unit vector once
+    stats = {}
+    xs = list(iter_distinct_samples(64, 64, "Hamming_weight", random.Random(0), dedup_stats=stats, k=1))
+    assert sorted(xs) == [1 << i for i in range(64)]
+    assert stats["draws"] == 64 + stats["duplicates"] and stats["duplicates"] > 0
+    assert stats["dedup_seconds"] >= 0.0
+    # u > 128: fingerprints
+    xs = list(iter_distinct_samples(300, 200, "Hamming_weight", random.Random(1), k=1))
+    assert len(set(xs)) == 200
+
+def test_distinct_batches_have_no_repeats():
+    np = pytest.importorskip("numpy")
+    for u, k in [(100, 1), (300, 1)]:
+        stats = {}
+        chunks = list(iter_samples_batch(u, 250 if u == 300 else 100, "Hamming_weight", 5, chunk_size=64,
+                                         distinct=True, dedup_stats=stats, k=k))
+        assert all(0 < len(c) <= 64 for c in chunks)
+        X = np.concatenate(chunks)
+        assert len(X) == len({row.tobytes() for row in X}) == (250 if u == 300 else 100)
+        assert stats["draws"] == len(X) + stats["duplicates"]
+    X = get_samples_batch(100, 100, "Hamming_weight", 5, distinct=True, k=1)
+    assert sorted(batch_ints(X)) == [1 << i for i in range(100)]
+    assert get_samples_batch(100, 0, "uniform", 5, distinct=True).shape == (0, 2)
+
+def test_distinct_keys_ints_and_rows_agree():
+    np = pytest.importorskip("numpy")
+    for u in (100, 300):
+        X = get_samples_batch(u, 50, "uniform", 2)
+        seen = DistinctKeys(u, 100)
+        assert list(seen.new_rows(X)) == list(range(50))
+        assert not any(seen.add(x) for x in batch_ints(X))
+        assert list(seen.new_rows(np.concatenate([X[:3], get_samples_batch(u, 4, "uniform", 3)]), 2)) == [3, 4]
+        assert (len(seen), seen.draws, seen.duplicates) == (52, 105, 53)
+
+def test_distinct_keys_table_matches_a_set():
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(0)
+    for u in (20, 100, 300):
+        # few likely keys: many repeats, within a batch and across batches, and the zero key
+        small = rng.integers(0, 1 << 10, size=(2000, 1), dtype=np.uint64)
+        X = np.zeros((2000, (u + 63) // 64), dtype=np.uint64)
+        X[:, :1] = small
+        X[:, -1] |= small[:, 0] << np.uint64(5)
+        X[:, 0] &= np.uint64((1 << min(u, 64)) - 1)
+        seen, ref, want = DistinctKeys(u, 1500), set(), []
+        for i, row in enumerate(X):
+            if row.tobytes() not in ref:
+                ref.add(row.tobytes())
+                want.append(i)
+        got = np.concatenate([seen.new_rows(X[i:i + 300]) + i for i in range(0, 2000, 300)])
+        assert list(got) == want and len(seen) == len(ref)
+        assert not any(seen.add(x) for x in batch_ints(X[:50]))
+    assert DistinctKeys.bytes_for(12) == 16 * 16 and DistinctKeys.bytes_for(13) == 16 * 32
+
+def test_distinct_keys_without_numpy_use_a_set(monkeypatch):
+    import src.hashing.sampling as sampling_mod
+    monkeypatch.setattr(sampling_mod, "np", None)
+    assert DistinctKeys.bytes_for(1000) == 1000 * DistinctKeys._SET_KEY_BYTES
+    for u in (64, 300):
+        stats = {}
+        xs = list(iter_distinct_samples(u, 50, "Hamming_weight", random.Random(0), dedup_stats=stats, k=1))
+        assert len(set(xs)) == 50 and all(popcount(x) == 1 for x in xs)
+        assert stats["draws"] == 50 + stats["duplicates"]
+    with pytest.raises(MemoryError):
+        DistinctKeys(100, 1 << 20, mem_budget=1 << 20)
+
+def test_distinct_keys_too_few_keys_or_memory_raise():
+    # 9 keys of weight 1 among u = 8 do not exist
+    seen = DistinctKeys(8, 9, max_draws=1000)
+    rng = random.Random(0)
+    with pytest.raises(RuntimeError):
+        while True:
+            seen.add(sample_Hamming_weight(8, 1, rng))
+    assert (len(seen), seen.draws) == (8, 1000)
+    with pytest.raises(MemoryError):
+        DistinctKeys(100, 1 << 20, mem_budget=1 << 20)